@@ -141,23 +141,10 @@ app_license = "mit"
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"inv_count.tasks.all"
-# 	],
-# 	"daily": [
-# 		"inv_count.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"inv_count.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"inv_count.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"inv_count.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+	"daily": ["inv_count.inventory_count.warehouse_sync.full_sync_connectwise_warehouses"],
+	"hourly": ["inv_count.inventory_count.warehouse_sync.sync_connectwise_warehouses"],
+}
 
 # Testing
 # -------
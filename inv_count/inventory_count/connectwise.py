@@ -0,0 +1,269 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Shared client of the ConnectWise REST API, one per worker process and set of credentials.
+
+Every call goes through the same `requests.Session`, so the TCP + TLS connection to ConnectWise is
+kept alive and reused instead of being opened for each request, and the authentication headers are
+built once. Responses 429 (rate limited) and 503 (unavailable) are retried up to MAX_RETRIES times
+with exponential backoff, waiting for `Retry-After` (at most BACKOFF_MAX) when ConnectWise sends it.
+A request that may have been applied already is never sent again: one whose response was lost (read
+error), or a POST answered 503, which can come from a proxy after ConnectWise got the request. Timings and
+retries are counted per call label, like the SQL Server pool (`sql_pool`).
+
+Collections are read with `iter_records`, a generator that requests the next page only when the
+caller is done with the current one, so a big tenant is read completely without holding every page.
+"""
+
+import base64
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+import requests
+from frappe import _
+from frappe.utils import cint
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_VERSION = "2025.8"  # ConnectWise API version sent in the Accept header
+MAX_RETRIES = 4  # Retries of a 429 / 503 response, or of a failed connection
+BACKOFF_FACTOR = 0.5  # Seconds, doubled on each retry when there is no Retry-After
+BACKOFF_MAX = 30  # Longest wait between two retries, in seconds
+POOL_SIZE = (
+	10  # Keep-alive connections per client, at least the number of threads calling ConnectWise at once
+)
+DEFAULT_TIMEOUT = 15  # Seconds
+PAGE_SIZE = 1000  # Records per page of a collection (ConnectWise maximum)
+BIN_FETCH_WORKERS = 8  # Warehouses whose bins are fetched at once when the bins cannot be read in one query
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class ConnectWiseRetry(Retry):
+	"""`Retry` capping the server's Retry-After, and retrying a POST on 429 only (refused by ConnectWise)."""
+
+	def get_retry_after(self, response):
+		retry_after = super().get_retry_after(response)
+		return None if retry_after is None else min(retry_after, BACKOFF_MAX)
+
+	def is_retry(self, method, status_code, has_retry_after=False):
+		if method.upper() not in Retry.DEFAULT_ALLOWED_METHODS and status_code != 429:
+			return False
+		return super().is_retry(method, status_code, has_retry_after)
+
+
+class ConnectWiseClient:
+	def __init__(self, api_url, company_id, public_key, private_key, client_id, page_size=PAGE_SIZE):
+		self.api_url = api_url.rstrip("/")
+		self.page_size = page_size or PAGE_SIZE
+		# Never expose the keys in stats
+		self.key = hashlib.sha1(f"{api_url}:{company_id}:{public_key}".encode()).hexdigest()[:8]
+		self._lock = threading.Lock()
+		self.stats = {"requests": 0, "retries": 0, "errors": 0}
+		self.call_timings = {}
+
+		credentials = base64.b64encode(f"{company_id}+{public_key}:{private_key}".encode()).decode()
+		self.session = requests.Session()
+		self.session.headers.update(
+			{
+				"Accept": f"application/vnd.connectwise.com+json; version={API_VERSION}",
+				"Content-Type": "application/json",
+				"Authorization": f"Basic {credentials}",
+				"clientId": client_id,
+			}
+		)
+		retry = ConnectWiseRetry(
+			total=MAX_RETRIES,
+			connect=MAX_RETRIES,
+			read=0,  # The request may have been applied: never sent twice
+			status=MAX_RETRIES,
+			status_forcelist=(429, 503),
+			allowed_methods=None,  # A POST refused with 429 is retried too, see `ConnectWiseRetry`
+			backoff_factor=BACKOFF_FACTOR,
+			backoff_max=BACKOFF_MAX,
+			respect_retry_after_header=True,
+			raise_on_status=False,  # The last 429 / 503 response is returned, `raise_for_status` reports it
+		)
+		adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=POOL_SIZE)
+		self.session.mount("https://", adapter)
+		self.session.mount("http://", adapter)
+
+	def url(self, path):
+		"""Absolute URL of an API `path` ('/procurement/warehouses'), absolute URLs are kept."""
+		if path.startswith(("http://", "https://")):
+			return path
+		return f"{self.api_url}/{path.lstrip('/')}"
+
+	def request(self, method, path, label=None, timeout=DEFAULT_TIMEOUT, **kwargs):
+		"""Sends the request on the pooled session and returns the response, timed under `label` (the path by default)."""
+		start = time.perf_counter()
+		response = None
+		try:
+			response = self.session.request(method, self.url(path), timeout=timeout, **kwargs)
+			return response
+		finally:
+			self.record_timing(label or path, time.perf_counter() - start, response)
+
+	def get(self, path, label=None, **kwargs):
+		return self.request("GET", path, label, **kwargs)
+
+	def post(self, path, label=None, **kwargs):
+		return self.request("POST", path, label, **kwargs)
+
+	def delete(self, path, label=None, **kwargs):
+		return self.request("DELETE", path, label, **kwargs)
+
+	def record_timing(self, label, seconds, response=None):
+		milliseconds = round(seconds * 1000, 1)
+		history = (
+			response.raw.retries.history
+			if response is not None and getattr(response.raw, "retries", None)
+			else ()
+		)
+		failed = response is None or response.status_code >= 400
+		with self._lock:
+			self.stats["requests"] += 1
+			self.stats["retries"] += len(history)
+			self.stats["errors"] += failed
+			timing = self.call_timings.setdefault(
+				label, {"count": 0, "retries": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+			)
+			timing["count"] += 1
+			timing["retries"] += len(history)
+			timing["errors"] += failed
+			timing["total_ms"] = round(timing["total_ms"] + milliseconds, 1)
+			timing["max_ms"] = max(timing["max_ms"], milliseconds)
+			timing["last_ms"] = milliseconds
+
+	def get_stats(self):
+		with self._lock:
+			return {"client": self.key, **self.stats, "call_timings": dict(self.call_timings)}
+
+	def close(self):
+		self.session.close()
+
+
+def get_credentials(settings_doc):
+	"""(API URL, Company ID, Public Key, Private Key, Client ID) of 'Inventory Count Settings', unset ones empty."""
+	return (
+		settings_doc.connectwise_api_url,
+		settings_doc.connectwise_company_id,
+		settings_doc.connectwise_public_key,
+		settings_doc.get_password("connectwise_private_key", raise_exception=False),
+		settings_doc.connectwise_client_id,
+	)
+
+
+def has_credentials(settings_doc=None):
+	"""True when every ConnectWise credential is set, so `get_client` will not throw."""
+	return all(get_credentials(settings_doc or frappe.get_single("Inventory Count Settings")))
+
+
+def get_client(settings_doc=None):
+	"""
+	Returns the client of this worker process for the credentials of 'Inventory Count Settings',
+	created on first use. A client made with older credentials is closed.
+	"""
+	settings_doc = settings_doc or frappe.get_single("Inventory Count Settings")
+	credentials = get_credentials(settings_doc)
+	if not all(credentials):
+		frappe.throw(
+			_(
+				"ConnectWise API credentials (API URL, Company ID, Public Key, Private Key, Client ID) are not fully set in 'Inventory Count Settings'. Please configure them."
+			),
+			title=_("API Credentials Missing"),
+		)
+
+	page_size = cint(settings_doc.get("connectwise_page_size")) or PAGE_SIZE
+	pid = os.getpid()
+	key = (pid, hashlib.sha1(repr((credentials, page_size)).encode("utf-8")).hexdigest())
+	with _clients_lock:
+		if key not in _clients:
+			for stale_key in [stale_key for stale_key in _clients if stale_key[0] == pid]:
+				_clients.pop(stale_key).close()
+			_clients[key] = ConnectWiseClient(*credentials, page_size=page_size)
+		return _clients[key]
+
+
+def iter_records(client, path, label, page_size=None, **params):
+	"""
+	Yields the records of the collection at `path` (with the query `params`), `page_size` per
+	request (the client's by default). The next page is requested once the caller has consumed the
+	current one. It is the `Link: <...>; rel="next"` of the response when ConnectWise sends Link
+	headers, the last page being the one without it; otherwise pages are numbered until a short one.
+	"""
+	page_size = page_size or client.page_size
+	url, query, page = path, {**params, "pagesize": page_size, "page": 1}, 1
+	while True:
+		response = client.get(url, label=label, params=query)
+		response.raise_for_status()
+		records = response.json()
+		if not isinstance(records, list):
+			raise ValueError(f"ConnectWise returned {type(records).__name__} for {path}, expected a list")
+		yield from records
+
+		if response.links:
+			next_page = response.links.get("next", {}).get("url")
+			if not next_page:
+				return
+			url, query = next_page, None  # The link carries the conditions and the page
+		elif len(records) < page_size:
+			return
+		else:
+			page += 1
+			query = {**params, "pagesize": page_size, "page": page}
+
+
+def get_warehouse_bins(client, warehouse_ids):
+	"""
+	Active bins of `warehouse_ids` as {warehouse id: [bin records]}. Every active bin is read with
+	one paged query and grouped on `warehouse.id` here, instead of one request per warehouse. When
+	ConnectWise refuses that query, or its bins do not tell their warehouse, the bins of each
+	warehouse are fetched on a bounded thread pool instead.
+	"""
+	warehouse_ids = list(warehouse_ids)
+	grouped = {warehouse_id: [] for warehouse_id in warehouse_ids}
+	try:
+		for bin_record in iter_records(
+			client, "/procurement/warehouseBins", "warehouse_bins", conditions="inactiveFlag=false"
+		):
+			if not isinstance(bin_record, dict) or not isinstance(bin_record.get("warehouse"), dict):
+				break  # Bin without its warehouse: cannot be grouped
+			warehouse_id = bin_record["warehouse"].get("id")
+			if warehouse_id in grouped:
+				grouped[warehouse_id].append(bin_record)
+		else:
+			return grouped
+	except requests.exceptions.HTTPError:
+		pass
+
+	if not warehouse_ids:
+		return {}
+	with ThreadPoolExecutor(max_workers=min(BIN_FETCH_WORKERS, len(warehouse_ids))) as executor:
+		bins = executor.map(lambda warehouse_id: get_bins_of_warehouse(client, warehouse_id), warehouse_ids)
+		return dict(zip(warehouse_ids, bins, strict=True))
+
+
+def get_bins_of_warehouse(client, warehouse_id):
+	"""Active bins of one warehouse."""
+	return list(
+		iter_records(
+			client,
+			"/procurement/warehouseBins",
+			"warehouse_bins_of_warehouse",
+			conditions=f"warehouse/id={warehouse_id} AND inactiveFlag=false",
+		)
+	)
+
+
+def get_client_stats():
+	"""Request, retry and error counters and call timings of every client of this worker process."""
+	with _clients_lock:
+		clients = [client for (pid, _credentials), client in _clients.items() if pid == os.getpid()]
+	return [client.get_stats() for client in clients]
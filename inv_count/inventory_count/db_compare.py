@@ -0,0 +1,373 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Set-based compare of an Inventory Count, run by the database ('Database' compare mode).
+
+One grouped query over `tabInv_physical_items` and `tabInv_virtual_items` returns only the item
+codes whose quantities differ, then `tabInv_difference` is brought in line with one bulk upsert
+and one DELETE. The Inventory Count document is never loaded, so memory and latency depend on the
+number of differences, not on the size of the virtual snapshot.
+
+An item code listed on several rows of the same table counts its last row only (highest idx), the
+rule of the Python engine (`index_items`), so both compare modes write the same differences.
+"""
+
+import frappe
+from frappe.utils import cint, now
+
+from inv_count.inventory_count.difference_engine import (
+	PHYSICAL_ONLY,
+	QUANTITY_DIFFERENT,
+	REMOVE_ADD,
+	VIRTUAL_ONLY,
+	difference_reason,
+	normalize_code,
+	serial_to_do,
+)
+from inv_count.inventory_count.serial_scan import get_scanned_serial_numbers
+from inv_count.inventory_count.virtual_import import get_serial_numbers
+
+parent_doctype = "Inventory Count"
+UPSERT_CHUNK_SIZE = 1000
+
+DIFFERENCE_FIELDS = [
+	"name",
+	"parent",
+	"parentfield",
+	"parenttype",
+	"idx",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"item_code",
+	"description",
+	"physical_qty",
+	"virtual_qty",
+	"difference_reason",
+	"recid",
+	"confirmed",
+]
+# Refreshed on existing rows, everything else ('confirmed' first of all) is kept
+DIFFERENCE_UPDATE_FIELDS = [
+	"description",
+	"physical_qty",
+	"virtual_qty",
+	"difference_reason",
+	"recid",
+	"modified",
+	"modified_by",
+]
+
+
+def get_quantity_differences(parent_name, category=None, subcategory=None, codes=None):
+	"""
+	Grouped physical vs virtual quantities of `parent_name`, one row per normalized item code whose
+	quantities differ (only the given `codes` when set). Only the last row of a code is read from each
+	table (see `index_items`). Virtual quantities only count inside the category / subcategory scope
+	of that row, which also gives the RecID and description.
+
+	The group of a code holds its virtual rows too, so it knows the code's category: a physical item
+	known to the snapshot but outside the scope is left out, an item unknown to it is kept.
+	"""
+	scope = "1=1"
+	physical_codes = virtual_codes = ""
+	values = {"parent": parent_name, "parenttype": parent_doctype}
+	if codes is not None:
+		physical_codes = "AND UPPER(TRIM(code)) IN %(codes)s"
+		virtual_codes = "AND UPPER(TRIM(item_id)) IN %(codes)s"
+		values["codes"] = tuple(codes) or ("",)
+	if category:
+		scope = "category=%(category)s"
+		values["category"] = category
+	if subcategory:
+		scope += " AND subcatname=%(subcategory)s"
+		values["subcategory"] = subcategory
+
+	return frappe.db.sql(
+		f"""
+        SELECT
+            code,
+            SUM(physical_qty) AS physical_qty,
+            SUM(virtual_qty) AS virtual_qty,
+            MAX(in_physical) AS in_physical,
+            MAX(in_virtual) AS in_virtual,
+            MAX(in_snapshot) AS in_snapshot,
+            MAX(physical_description) AS physical_description,
+            MAX(virtual_description) AS virtual_description,
+            MAX(recid) AS recid
+        FROM (
+            SELECT UPPER(TRIM(code)) AS code, COALESCE(qty, 0) AS physical_qty, 0 AS virtual_qty,
+                1 AS in_physical, 0 AS in_virtual, 0 AS in_snapshot, description AS physical_description,
+                NULL AS virtual_description, NULL AS recid,
+                ROW_NUMBER() OVER (PARTITION BY UPPER(TRIM(code)) ORDER BY idx DESC) AS position
+            FROM `tabInv_physical_items`
+            WHERE parent=%(parent)s AND parenttype=%(parenttype)s AND parentfield='inv_physical_items' {physical_codes}
+            UNION ALL
+            SELECT UPPER(TRIM(item_id)), 0, IF({scope}, COALESCE(qty, 0), 0),
+                0, IF({scope}, 1, 0), 1, NULL,
+                IF({scope}, shortdescription, NULL), NULLIF(iv_item_recid, ''),
+                ROW_NUMBER() OVER (PARTITION BY UPPER(TRIM(item_id)) ORDER BY idx DESC)
+            FROM `tabInv_virtual_items`
+            WHERE parent=%(parent)s AND parenttype=%(parenttype)s AND parentfield='inv_virtual_items' {virtual_codes}
+        ) AS items
+        WHERE code != '' AND position = 1
+        GROUP BY code
+        HAVING SUM(physical_qty) != SUM(virtual_qty) AND (MAX(in_virtual) = 1 OR MAX(in_snapshot) = 0)
+        """,
+		values,
+		as_dict=True,
+	)
+
+
+def _difference_values(row):
+	if row.in_physical and row.in_virtual:
+		status, description = QUANTITY_DIFFERENT, row.physical_description
+	elif row.in_physical:
+		status, description = PHYSICAL_ONLY, row.physical_description
+	else:
+		status, description = VIRTUAL_ONLY, row.virtual_description
+	return {
+		"item_code": row.code,
+		"description": description or "",
+		"physical_qty": int(row.physical_qty),
+		"virtual_qty": int(row.virtual_qty),
+		"difference_reason": difference_reason(status),
+		"recid": row.recid or "",
+	}
+
+
+def upsert_rows(table, fields, update_fields, rows):
+	"""Multi-row INSERT ... ON DUPLICATE KEY UPDATE of `rows` (tuples in `fields` order), by chunks."""
+	column_list = ", ".join(f"`{field}`" for field in fields)
+	row_placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+	update_list = ", ".join(f"`{field}`=VALUES(`{field}`)" for field in update_fields)
+	for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+		chunk = rows[start : start + UPSERT_CHUNK_SIZE]
+		frappe.db.sql(
+			f"INSERT INTO `{table}` ({column_list}) VALUES {', '.join([row_placeholder] * len(chunk))}"
+			f" ON DUPLICATE KEY UPDATE {update_list}",
+			[value for row in chunk for value in row],
+		)
+
+
+def compare_in_database(parent_name, codes=None):
+	"""
+	Recomputes the 'inv_difference' rows of `parent_name` with set-based SQL: existing rows are
+	updated in place (their 'confirmed' flag is kept), new differences inserted and rows that are
+	no longer a difference deleted. The serial numbers of the differences are refreshed the same
+	way as the Python compare. Returns the counts, the caller is responsible for the commit.
+
+	With `codes`, only those item codes are recomputed (live maintenance after a scan or an edit)
+	and the parent's `modified` is left alone, so an open form can still be saved.
+	"""
+	if codes is not None:
+		codes = {normalize_code(code) for code in codes} - {""}
+	category, subcategory, serial_scan = frappe.db.get_value(
+		parent_doctype, parent_name, ["category", "subcategory", "serial_scan"]
+	)
+	differences = {
+		row.code: _difference_values(row)
+		for row in get_quantity_differences(parent_name, category, subcategory, codes)
+	}
+	# Serial scan mode: the serial numbers of an item short of stock that were not scanned are missing
+	short_codes = (
+		{code for code, values in differences.items() if values["physical_qty"] < values["virtual_qty"]}
+		if serial_scan
+		else None
+	)
+
+	existing_rows = frappe.db.sql(
+		"""
+        SELECT name, item_code, idx FROM `tabInv_difference`
+        WHERE parent=%s AND parenttype=%s AND parentfield='inv_difference'
+        ORDER BY idx
+        """,
+		(parent_name, parent_doctype),
+		as_dict=True,
+	)
+	existing_names = {}
+	to_delete = []
+	for row in existing_rows:
+		code = normalize_code(row.item_code)
+		if codes is not None and code not in codes:
+			continue  # Not recomputed by this call
+		if code in differences and code not in existing_names:
+			existing_names[code] = row.name
+		else:
+			to_delete.append(row.name)  # No longer a difference, or a duplicate row of the code
+
+	timestamp = now()
+	user = frappe.session.user
+	next_idx = max((row.idx for row in existing_rows), default=0) + 1
+	rows = []
+	inserted = 0
+	for code, values in differences.items():
+		name = existing_names.get(code)
+		if name is None:
+			name = frappe.generate_hash(length=10)
+			idx = next_idx
+			next_idx += 1
+			inserted += 1
+		else:
+			idx = 0  # Ignored: idx is not in DIFFERENCE_UPDATE_FIELDS, the row keeps its position
+		rows.append(
+			(
+				name,
+				parent_name,
+				"inv_difference",
+				parent_doctype,
+				idx,
+				timestamp,
+				timestamp,
+				user,
+				user,
+				values["item_code"],
+				values["description"],
+				values["physical_qty"],
+				values["virtual_qty"],
+				values["difference_reason"],
+				cint(values["recid"]),  # Int column, converted as a save of the Python engine's rows does
+				0,
+			)
+		)
+
+	if to_delete:
+		frappe.db.delete("Inv_difference", {"name": ("in", to_delete)})
+	upsert_rows("tabInv_difference", DIFFERENCE_FIELDS, DIFFERENCE_UPDATE_FIELDS, rows)
+	serial_count = refresh_difference_serial_numbers(parent_name, list(differences), codes, short_codes)
+
+	if codes is None:
+		frappe.db.set_value(parent_doctype, parent_name, "modified", timestamp, update_modified=False)
+
+	return {
+		"differences": len(differences),
+		"inserted": inserted,
+		"updated": len(differences) - inserted,
+		"deleted": len(to_delete),
+		"serial_numbers": serial_count,
+	}
+
+
+def refresh_difference_serial_numbers(parent_name, codes, touched_codes=None, short_codes=None):
+	"""
+	Rebuilds 'inv_difference_sn' for the difference `codes`: 'Remove/Add' rows of these codes are kept,
+	the others are expected from 'Inv_virtual_sn' with their previous 'to_do'. An existing row still
+	expected with the same 'to_do' is left untouched, only the differing rows are deleted or inserted.
+	The rows of a code that is no longer a difference are deleted, flagged or not, so the push never
+	reads them. Only the serial numbers of the differing codes are read, through the (parent, item_id,
+	serial_number) index. With `touched_codes`, the rows of any other product are left as they are.
+
+	`short_codes` is set in serial scan mode: scanned serial numbers are unflagged and the unscanned
+	ones of these codes are flagged 'Remove/Add' (see `serial_to_do`).
+	"""
+	existing_rows = frappe.db.sql(
+		"""
+        SELECT name, product, serial_number, to_do, idx FROM `tabInv_difference_sn`
+        WHERE parent=%s AND parenttype=%s AND parentfield='inv_difference_sn'
+        """,
+		(parent_name, parent_doctype),
+		as_dict=True,
+	)
+	if touched_codes is not None:
+		untouched_rows = [row for row in existing_rows if row.product not in touched_codes]
+		existing_rows = [row for row in existing_rows if row.product in touched_codes]
+	else:
+		untouched_rows = []
+
+	scanned = get_scanned_serial_numbers(parent_name, codes) if short_codes is not None else set()
+	difference_codes = set(codes)
+	existing_to_do = {}
+	kept_keys = set()
+	for row in existing_rows:
+		if row.product and row.serial_number:
+			existing_to_do[(row.product, row.serial_number)] = row.to_do
+			if (
+				row.to_do == REMOVE_ADD
+				and row.product in difference_codes
+				and (row.product, row.serial_number) not in scanned
+			):
+				kept_keys.add((row.product, row.serial_number))
+
+	serials = get_serial_numbers(parent_name, codes)
+
+	timestamp = now()
+	user = frappe.session.user
+	new_rows = [
+		(
+			code,
+			sn,
+			serial_to_do(
+				existing_to_do.get((code, sn)),
+				(code, sn) in scanned,
+				short_codes is not None and code in short_codes and (code, sn) not in scanned,
+			),
+		)
+		for code in codes
+		for sn in serials.get(code, ())
+		if (code, sn) not in kept_keys  # Set difference: expected serials minus the 'Remove/Add' rows kept
+	]
+
+	# Rows still expected with the same 'to_do' stay as they are (same name and idx): only the rows
+	# that changed are deleted and inserted, so the compare delta stays small
+	expected_to_do = {(product, sn): to_do for product, sn, to_do in new_rows}
+	unchanged_keys = set()
+	to_delete = set()
+	for row in existing_rows:
+		key = (row.product, row.serial_number)
+		if key in kept_keys:
+			continue
+		if (
+			key in expected_to_do
+			and key not in unchanged_keys
+			and (row.to_do or None) == (expected_to_do[key] or None)
+		):
+			unchanged_keys.add(key)
+		else:
+			to_delete.add(row.name)
+	new_rows = [
+		(product, sn, to_do) for product, sn, to_do in new_rows if (product, sn) not in unchanged_keys
+	]
+
+	if to_delete:
+		frappe.db.delete("Inv_difference_sn", {"name": ("in", list(to_delete))})
+
+	next_idx = (
+		max((row.idx for row in existing_rows + untouched_rows if row.name not in to_delete), default=0) + 1
+	)
+	frappe.db.bulk_insert(
+		"Inv_difference_sn",
+		[
+			"name",
+			"parent",
+			"parentfield",
+			"parenttype",
+			"idx",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"product",
+			"serial_number",
+			"to_do",
+		],
+		[
+			(
+				frappe.generate_hash(length=10),
+				parent_name,
+				"inv_difference_sn",
+				parent_doctype,
+				next_idx + i,
+				timestamp,
+				timestamp,
+				user,
+				user,
+				product,
+				sn,
+				to_do,
+			)
+			for i, (product, sn, to_do) in enumerate(new_rows)
+		],
+	)
+	return len(expected_to_do)
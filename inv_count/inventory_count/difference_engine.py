@@ -0,0 +1,181 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Difference engine behind `compare_child_tables`.
+
+Physical items, virtual items and the existing 'Inv_difference' rows are each indexed once in a
+dict keyed on the normalized item code, then every code is classified in a single pass. Lookups
+are O(1), so a compare is O(physical + virtual + differences) instead of scanning the difference
+table for every item. Rows can be child Documents or plain dicts, only `.get()` is used.
+"""
+
+from frappe import _
+from frappe.utils import cint
+
+MATCHED = "matched"
+QUANTITY_DIFFERENT = "quantity_different"
+PHYSICAL_ONLY = "physical_only"
+VIRTUAL_ONLY = "virtual_only"
+
+REMOVE_ADD = "Remove/Add"  # 'to_do' of a serial number to adjust in ConnectWise
+
+
+def normalize_code(code):
+	"""Item code used as index key: the scanned code and the ConnectWise Item_ID only differ by case and spacing."""
+	return str(code or "").strip().upper()
+
+
+def index_items(rows, code_field):
+	"""{normalized code: row}. When a code is listed twice the last row wins, as in the former per-field maps."""
+	return {normalize_code(row.get(code_field)): row for row in rows if normalize_code(row.get(code_field))}
+
+
+def index_categories(rows):
+	"""
+	{normalized code: (category, subcatname)} of the virtual items (snapshot and item list rows).
+	Built once per import, it tells the compare which category a scanned code belongs to.
+	"""
+	return {
+		normalize_code(row.get("item_id")): (row.get("category") or "", row.get("subcatname") or "")
+		for row in rows
+		if normalize_code(row.get("item_id"))
+	}
+
+
+def in_category_scope(category_index, code, category=None, subcategory=None):
+	"""
+	True when `code` belongs to the category / subcategory of the count (or the count is not scoped).
+	A code missing from the index is unknown to ConnectWise and always stays in scope.
+	"""
+	categories = category_index.get(normalize_code(code))
+	if categories is None:
+		return True
+	return (not category or categories[0] == category) and (not subcategory or categories[1] == subcategory)
+
+
+def filter_category_scope(rows, code_field, category_index, category=None, subcategory=None):
+	"""Rows of `rows` whose `code_field` is in the category / subcategory scope, all of them when the count is not scoped."""
+	if not category and not subcategory:
+		return rows
+	return [
+		row for row in rows if in_category_scope(category_index, row.get(code_field), category, subcategory)
+	]
+
+
+def index_differences(rows):
+	"""
+	Returns ({normalized code: first 'Inv_difference' row}, [duplicate rows]). A code should only
+	have one difference row, the extra ones are returned so the caller can drop them.
+	"""
+	index = {}
+	duplicates = []
+	for row in rows:
+		code = normalize_code(row.get("item_code"))
+		if code in index:
+			duplicates.append(row)
+		else:
+			index[code] = row
+	return index, duplicates
+
+
+def classify_items(physical_index, virtual_index):
+	"""
+	Single pass over every code of both indexes. Returns {code: (status, physical_qty, virtual_qty)}
+	with status MATCHED, QUANTITY_DIFFERENT, PHYSICAL_ONLY or VIRTUAL_ONLY, physical codes first.
+	"""
+	classified = {}
+	for code, physical_row in physical_index.items():
+		physical_qty = cint(physical_row.get("qty"))
+		virtual_row = virtual_index.get(code)
+		if virtual_row is None:
+			classified[code] = (PHYSICAL_ONLY, physical_qty, 0)
+			continue
+		virtual_qty = cint(virtual_row.get("qty"))
+		classified[code] = (
+			MATCHED if physical_qty == virtual_qty else QUANTITY_DIFFERENT,
+			physical_qty,
+			virtual_qty,
+		)
+
+	for code, virtual_row in virtual_index.items():
+		if code not in classified:
+			classified[code] = (VIRTUAL_ONLY, 0, cint(virtual_row.get("qty")))
+
+	return classified
+
+
+def difference_reason(status):
+	if status == PHYSICAL_ONLY:
+		return _("Article non trouvé dans l'inventaire virtuel")
+	if status == VIRTUAL_ONLY:
+		return _("Article non trouvé dans l'inventaire physique")
+	return _("Quantité différente")
+
+
+def plan_differences(physical_rows, virtual_rows, existing_differences, lookup_virtual_rows=None):
+	"""
+	Works out the 'Inv_difference' changes of a compare without touching any Document.
+
+	`virtual_rows` are the virtual items in the compare scope (category / subcategory), while
+	`lookup_virtual_rows` (all virtual items by default) give the RecID and serial numbers.
+	Returns a dict with:
+	    updates: [(existing row, values)] for codes that already have a difference row,
+	    inserts: [values] for new differences, in physical then virtual order,
+	    removals: [existing rows] that are no longer a difference (or duplicates),
+	    differences: [(code, values)] of every current difference, in insert order,
+	    counts: number of codes per status.
+	`confirmed` is never part of the values, so it is kept on updated rows.
+	"""
+	physical_index = index_items(physical_rows, "code")
+	virtual_index = index_items(virtual_rows, "item_id")
+	lookup_index = (
+		virtual_index if lookup_virtual_rows is None else index_items(lookup_virtual_rows, "item_id")
+	)
+	existing_index, removals = index_differences(existing_differences)
+
+	plan = {"updates": [], "inserts": [], "removals": removals, "differences": [], "counts": {}}
+	seen_codes = set()
+
+	for code, (status, physical_qty, virtual_qty) in classify_items(physical_index, virtual_index).items():
+		plan["counts"][status] = plan["counts"].get(status, 0) + 1
+		difference = physical_qty - virtual_qty
+		if not difference:
+			continue
+
+		description_row = physical_index.get(code) if status != VIRTUAL_ONLY else virtual_index.get(code)
+		description_field = "description" if status != VIRTUAL_ONLY else "shortdescription"
+		lookup_row = lookup_index.get(code)
+		values = {
+			"item_code": code,
+			"description": description_row.get(description_field) or "",
+			"physical_qty": physical_qty,
+			"virtual_qty": virtual_qty,
+			"difference_qty": difference,
+			"difference_reason": difference_reason(status),
+			"recid": lookup_row.get("iv_item_recid") if lookup_row is not None else "",
+		}
+		plan["differences"].append((code, values))
+		seen_codes.add(code)
+
+		existing_row = existing_index.get(code)
+		if existing_row is not None:
+			plan["updates"].append((existing_row, values))
+		else:
+			plan["inserts"].append(values)
+
+	plan["removals"].extend(row for code, row in existing_index.items() if code not in seen_codes)
+	return plan
+
+
+def serial_to_do(previous_to_do, scanned=False, missing=False):
+	"""
+	'to_do' of a rebuilt 'Inv_difference_sn' row. A serial number scanned during the count is never
+	flagged; one expected but not scanned on an item short of stock (`missing`) is flagged
+	'Remove/Add'. Otherwise the previous choice is kept.
+	"""
+	if scanned:
+		return None
+	if missing:
+		return REMOVE_ADD
+	return previous_to_do
@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Microtec and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
 
 class Inv_physical_items(Document):
 	pass
+
+
+def on_doctype_update():
+	# One row per scanned code in a count: the scan upsert relies on it (INSERT ... ON DUPLICATE KEY UPDATE)
+	frappe.db.add_unique("Inv_physical_items", ["parent", "code"], constraint_name="parent_code")
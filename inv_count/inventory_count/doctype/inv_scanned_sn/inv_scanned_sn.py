@@ -0,0 +1,14 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class Inv_scanned_sn(Document):
+	pass
+
+
+def on_doctype_update():
+	# A serial number is counted once per count, a second scan of it is ignored
+	frappe.db.add_unique("Inv_scanned_sn", ["parent", "serial_number"], constraint_name="parent_serial")
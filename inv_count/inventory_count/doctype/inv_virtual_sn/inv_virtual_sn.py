@@ -0,0 +1,16 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class Inv_virtual_sn(Document):
+	pass
+
+
+def on_doctype_update():
+	# One row per serial number of an item in a count, and the index behind every lookup by item
+	frappe.db.add_unique(
+		"Inv_virtual_sn", ["parent", "item_id", "serial_number"], constraint_name="parent_item_serial"
+	)
@@ -20,56 +20,11 @@ frappe.ui.form.on('Inventory Count', {
             });
             if (debug_mode) console.log("Debug Mode is active");
             
-            if (frm.doc.__islocal) {
-                frappe.call({
-                method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.get_connectwise_warehouses_and_bins',
-                callback: function(r) {
-                    if (r.message) {
-                        const warehouses = r.message.warehouses;
-                        const bins_map = r.message.bins_map;
-
-                        // Set options for the 'warehouse' field
-                        // Add an empty option at the beginning to allow unselecting
-                        if (warehouses && warehouses.length > 0) {
-                            frm.set_df_property('warehouse', 'options', [""] /* Empty option */.concat(warehouses));
-                        } else {
-                            frm.set_df_property('warehouse', 'options', [""]); // No options if none found
-                        }
-
-                        // Store the bins_map on the form object for later dynamic updates
-                        // This avoids fetching data again when only the warehouse selection changes
-                        frm.__connectwise_bins_map = bins_map;
-
-                        // Clear and refresh warehouse_bin options initially
-                        // They will be populated when a 'warehouse' is selected
-                        frm.set_df_property('warehouse_bin', 'options', [""]);
-                        if (frm.doc.warehouse) {
-                            frm.trigger('warehouse'); 
-                        }
-                        frm.refresh_field('warehouse');
-                        frm.refresh_field('warehouse_bin');
-
-                    } else if (r.exc) {
-                        // Display error from server-side traceback
-                        frappe.show_alert({
-                            message: __("Error loading ConnectWise warehouses: ") + r.exc.split('\n')[0],
-                            indicator: 'red'
-                        }, 10);
-                        console.error("ConnectWise API call failed:", r.exc);
-                    }
-                },
-                error: function(err) {
-                    // Display client-side communication error
-                    frappe.show_alert({
-                        message: __("Server communication error for ConnectWise warehouses: ") + err.message,
-                        indicator: 'red'
-                    }, 10);
-                    console.error("Server communication error for ConnectWise warehouses:", err);
-                }
-            });
-        }
+            // Warehouses and bins are linked from the local mirror of ConnectWise ('CW Warehouse', 'CW Warehouse Bin')
+            frm.set_query('warehouse', () => ({ filters: { inactive: 0 } }));
+            frm.set_query('warehouse_bin', () => ({ filters: { warehouse: frm.doc.warehouse, inactive: 0 } }));
  
-        if (!frm.doc.__islocal && frm.doc.inv_virtual_items.length === 0 && auto_update) {
+        if (!frm.doc.__islocal && frm.doc.inv_virtual_items.length === 0 && auto_update && !frm.__import_cancelled) {
             python_request_in_progress(true); // Disable auto-update during initial import
             frappe.show_alert({
                 message: __("L'importation de l'inventaire a démarré. Cela peut prendre un certain temps."),
@@ -77,27 +32,17 @@ frappe.ui.form.on('Inventory Count', {
             }, 5); // Show alert for 5 seconds
 
             frappe.call({
-                // Calls the whitelisted Python wrapper function to enqueue the import
-                method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.import_data_with_pandas',
+                // Enqueues the import as a background job, the call returns as soon as the job is queued
+                method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.enqueue_import',
                 args: {
                     inventory_count_name: frm.doc.name // Pass the current document's name
                 },
                 callback: function(r) {
-                    // This callback fires when the job is SUCCESSFULLY ENQUEUED on the server.
-                    // It does NOT mean the import job itself is complete.
-                    if (r.message.status === "success") {
-                        const jobId = r.message.job_id;
-                            frappe.show_alert({
-                                message: __("Importation de l'inventaire virtuel terminée."),
-                                indicator: 'green'
-                            });
-                            frm.reload_doc().then(() => {
-                                // Then, populate the categories using the fresh data
-                                populateMainCategoryDropdown(frm);
-                                python_request_in_progress(false); // Re-enable auto-update after import
-                            });
-                        
-
+                    // This callback does NOT mean the import job itself is complete.
+                    // Progress and completion arrive through the 'inventory_count_import_progress' realtime event.
+                    if (r.message && (r.message.status === "queued" || r.message.status === "already_running")) {
+                        frm.__import_job_id = r.message.job_id;
+                        addCancelImportButton(frm);
                     } else {
                         // Handle cases where the enqueueing itself failed (e.g., server error before job creation)
                         frappe.msgprint({
@@ -133,6 +78,9 @@ frappe.ui.form.on('Inventory Count', {
         // --- Apply Coloring Logic on every refresh ---
         // Ensures physical items are colored based on quantity difference from expected.
         applyPhysicalItemsColoring(frm);
+
+        // --- Serial scan mode: serial → item map of the snapshot ---
+        loadSerialIndex(frm);
     },
 
     onload: function(frm) {
@@ -147,19 +95,38 @@ frappe.ui.form.on('Inventory Count', {
                 frm.reload_doc();
             }
         });
-        frappe.realtime.on('inv_physical_items_refresh', (r) => {
+        // --- Background Import Progress Listener ---
+        // The import job publishes one event per stage (fetch, map, write, commit) and a final one (done, cancelled, error).
+        frappe.realtime.on('inventory_count_import_progress', (data) => {
+            if (data.docname !== frm.doc.name) return; // Ignore if not for this document
+            handleImportProgress(frm, data);
+        });
+        frappe.realtime.on('inv_physical_items_delta', (r) => {
+            if (r.parent !== frm.doc.name) return; // Ignore if not for this document
+            // Only the scanned row(s), numbered: a gap in the numbers reloads the whole table
+            if (debug_mode) console.log(`Physical items delta #${r.sequence} received via realtime.`, r.rows);
+            applyPhysicalItemsDelta(frm, r.sequence, r.rows);
+        });
+        frappe.realtime.on('inv_difference_refresh', (r) => {
             if (r.parent !== frm.doc.name) return; // Ignore if not for this document
-            console.log("Refresh request for inv_physical_items received via realtime." + r.items);
-            frm.set_value('inv_physical_items', r.items); // Set new data
-            frm.refresh_field('inv_physical_items'); // Refresh again with new data
-            applyPhysicalItemsColoring(frm); // Apply coloring
+            // 'Live Differences': only the difference rows of the scanned codes, patched in place so the
+            // form does not become dirty. An unsaved 'confirmed' tick is kept (the server never changes it).
+            if (debug_mode) console.log("Live difference delta received via realtime.", r.delta);
+            applyDifferenceDelta(frm, r.delta, null, { inv_difference: ['confirmed'] });
         });
 
         const physicalItemsTable = 'inv_physical_items';
-        const virtualItemsTable = 'inv_virtual_items';
 
         let currentScannedCode = ''; // Variable to store the current scanned code
 
+        // Clears the 'code' field after a scan that is not sent to the server
+        const resetScan = function() {
+            frm.set_value('code', '');
+            frm.refresh_field('code');
+            currentScannedCode = '';
+            if (!scanQueuePending(frm)) python_request_in_progress(false); // Otherwise re-enabled once the queue is flushed
+        };
+
         // --- Global Keyboard Input Redirection (for Barcode Scanners) ---
         // This is the core logic to direct keyboard input (e.g., from a barcode scanner)
         // to the 'code' field when no other input field is actively focused.
@@ -249,6 +216,7 @@ frappe.ui.form.on('Inventory Count', {
         // --- Clean up global listener when form is closed ---
         // This is crucial for performance and to prevent unintended behavior on other DocTypes.
         frm.on_close = function() {
+            flushScanQueue(frm); // Send the scans still waiting in the queue
             document.removeEventListener('keydown', handleGlobalKeyboardInput);
             console.log("Global keydown listener for 'code' field removed.");
         };
@@ -277,14 +245,27 @@ frappe.ui.form.on('Inventory Count', {
                             let foundExistingRow = false;
                             let itemDescription = '';
                             let expectedQty = 0;
+                            let serialNumber = null; // Set when a serial number was scanned (serial scan mode)
+
+                            // 0. Serial scan mode: resolve the serial number to its item (hash map lookup)
+                            if (frm.doc.serial_scan) {
+                                const scan = resolveSerialScan(frm, enteredCode);
+                                if (scan.error) {
+                                    frappe.show_alert({ message: scan.error, indicator: 'orange' });
+                                    resetScan();
+                                    return;
+                                }
+                                if (scan.serial_number) {
+                                    serialNumber = scan.serial_number;
+                                    enteredCode = scan.item_id;
+                                }
+                            }
 
                             // 1. Find description and QOH in virtual items first
-                            if (frm.doc[virtualItemsTable] && frm.doc[virtualItemsTable].length > 0) {
-                                const virtualItem = frm.doc[virtualItemsTable].find(row => row.item_id.toUpperCase() === enteredCode.toUpperCase());
-                                if (virtualItem) {
-                                    itemDescription = virtualItem.shortdescription || '';
-                                    expectedQty = virtualItem.qty || 0;
-                                }
+                            const virtualItem = getVirtualItem(frm, enteredCode);
+                            if (virtualItem) {
+                                itemDescription = virtualItem.shortdescription || '';
+                                expectedQty = virtualItem.qty || 0;
                             }
 
                             // 2. Update or add to physical items
@@ -304,30 +285,6 @@ frappe.ui.form.on('Inventory Count', {
                                             frappe.model.set_value(row.doctype, row.name, 'expected_qty', expectedQty);
                                         }
 
-                                        // Persist only the single child row to backend (no full form save)
-                                        frappe.call({
-                                            method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.upsert_physical_item',
-                                            args: {
-                                                parent_name: frm.doc.name,
-                                                code: enteredCode,
-                                                qty: 1,
-                                                description: itemDescription,
-                                                expected_qty: expectedQty
-                                            },
-                                            callback: function(r) {
-                                                if (r.message && r.message.items) {
-                                                    // Replace and refresh only the child table
-                                                    frm.set_value('inv_physical_items', r.message.items);
-                                                    frm.refresh_field('inv_physical_items');
-                                                    applyPhysicalItemsColoring(frm);
-                                                    frm.set_value('code', ''); // Clear the main 'code' field for next scan
-                                                    frm.refresh_field('code'); // Refresh the 'code' field display
-                                                    currentScannedCode = '';
-                                                    python_request_in_progress(false);
-                                                }
-                                            }
-                                        });
-
                                         break;
                                     }
                                 }
@@ -341,33 +298,12 @@ frappe.ui.form.on('Inventory Count', {
                                 newRow.qty = 1;
                                 newRow.description = itemDescription;
                                 newRow.expected_qty = expectedQty;
-
-                                // Persist via server and refresh only the child table when done
-                                frappe.call({
-                                    method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.upsert_physical_item',
-                                    args: {
-                                        parent_name: frm.doc.name,
-                                        code: enteredCode,
-                                        qty: 1,
-                                        description: itemDescription,
-                                        expected_qty: expectedQty
-                                    },
-                                    callback: function(r) {
-                                        if (r.message && r.message.items) {
-                                            frm.set_value('inv_physical_items', r.message.items);
-                                            frm.refresh_field('inv_physical_items');
-                                            applyPhysicalItemsColoring(frm);
-                                            frm.set_value('code', ''); // Clear the main 'code' field for next scan
-                                            frm.refresh_field('code'); // Refresh the 'code' field display
-                                            currentScannedCode = '';
-                                            python_request_in_progress(false);
-                                        }
-                                    },
-                                    error: function(err) {
-                                        console.error('Error persisting physical item:', err);
-                                    }
-                                });
+                                frm.refresh_field(physicalItemsTable);
                             }
+
+                            // 3. Queue the scan: the queue persists the scans in batches (no full form save)
+                            enqueueScan(frm, enteredCode, itemDescription, expectedQty, serialNumber);
+                            resetScan(); // Clear the main 'code' field for next scan
                         } else {
                             frappe.show_alert({
                                 message: __("Veuillez entrer un code avant d'appuyer sur Entrée."),
@@ -384,27 +320,17 @@ frappe.ui.form.on('Inventory Count', {
     },
 
     warehouse: function(frm) {
-        const selectedWarehouse = frm.doc.warehouse;
-        const bins_map = frm.__connectwise_bins_map; // Retrieve the stored map
-
-        let bin_options = [""]; // Start with an empty option
-
-        if (selectedWarehouse && bins_map && bins_map[selectedWarehouse]) {
-            // Get bins for the selected warehouse from the map
-            const binsForWarehouse = bins_map[selectedWarehouse];
-            if (Array.isArray(binsForWarehouse)) {
-                bin_options = bin_options.concat(binsForWarehouse);
-            } else {
-                // This case should ideally not happen if Python correctly handles single/list,
-                // but as a fallback, if it's not an array, treat it as empty.
-                console.warn("Expected an array for bins, but got:", binsForWarehouse);
-            }
+        // Clear the bin when it does not belong to the selected warehouse
+        if (!frm.doc.warehouse_bin) return;
+        if (!frm.doc.warehouse) {
+            frm.set_value('warehouse_bin', '');
+            return;
         }
-        
-        // Set options for the 'warehouse_bin' field
-        frm.set_df_property('warehouse_bin', 'options', bin_options);
-        frm.set_value('warehouse_bin', ''); // Clear current bin selection when warehouse changes
-        frm.refresh_field('warehouse_bin'); // Refresh the dropdown to show new options
+        frappe.db.get_value('CW Warehouse Bin', frm.doc.warehouse_bin, 'warehouse').then(r => {
+            if (r.message && r.message.warehouse !== frm.doc.warehouse) {
+                frm.set_value('warehouse_bin', '');
+            }
+        });
     },
 
     category: function(frm) {
@@ -414,6 +340,9 @@ frappe.ui.form.on('Inventory Count', {
     subcategory: function(frm) {
             frm.save();
     },
+    serial_scan: function(frm) {
+        loadSerialIndex(frm);
+    },
 
     // --- Before Submit Logic ---
     // This logic ensures necessary checks are performed before the document is submitted.
@@ -438,11 +367,17 @@ frappe.ui.form.on('Inventory Count', {
                 frappe.call({
                     method: "inv_count.inventory_count.doctype.inventory_count.inventory_count.compare_child_tables",
                     args: {
-                        doc_name: frm.doc.name
+                        doc_name: frm.doc.name,
+                        before_submit: 1 // Skipped by the server when 'Live Differences' keeps them current
                     },
                     callback: function(r) {
                         console.log("Comparison response:", r);
-                        if (r.message.status == "success") {
+                        if (r.message.status == "success" && r.message.delta) {
+                            // Only the changed difference rows come back: patch the grids instead of reloading the whole form
+                            if (debug_mode) console.log("All child tables compared successfully. Applying difference delta...", r.message.delta);
+                            applyDifferenceDelta(frm, r.message.delta, r.message.version);
+                            checkAllDifferencesConfirmed(frm, resolve, reject);
+                        } else if (r.message.status == "success") {
                             if (debug_mode) console.log("All child tables compared successfully. Reloading document...");
                             frm.reload_doc().then(() => {
                                 checkAllDifferencesConfirmed(frm, resolve, reject);
@@ -468,6 +403,280 @@ frappe.ui.form.on('Inventory Count', {
     }
 });
 
+// --- Applies the compare delta (added/updated/removed rows) to the difference grids ---
+// `version` is the document's new 'modified', so the next save is not rejected as outdated.
+// `keepFields` ({table field: [fieldnames]}) are left as they are on the updated rows (unsaved edits).
+function applyDifferenceDelta(frm, delta, version, keepFields) {
+    const tables = {
+        inv_difference: 'Inv_difference',
+        inv_difference_sn: 'Inv_difference_sn'
+    };
+
+    Object.entries(tables).forEach(([fieldname, doctype]) => {
+        const changes = delta[fieldname];
+        if (!changes) return;
+
+        const removed = new Set(changes.removed || []);
+        const rows = (frm.doc[fieldname] || []).filter(row => !removed.has(row.name));
+        removed.forEach(name => {
+            if (locals[doctype]) delete locals[doctype][name];
+        });
+
+        const kept = (keepFields && keepFields[fieldname]) || [];
+        (changes.updated || []).forEach(values => {
+            const row = rows.find(r => r.name === values.name);
+            if (!row) return;
+            const keptValues = {};
+            kept.forEach(field => { keptValues[field] = row[field]; });
+            Object.assign(row, values, keptValues);
+        });
+
+        (changes.added || []).forEach(values => {
+            const row = Object.assign({
+                doctype: doctype,
+                parent: frm.doc.name,
+                parentfield: fieldname,
+                parenttype: frm.doctype,
+                docstatus: frm.doc.docstatus
+            }, values);
+            frappe.model.add_to_locals(row);
+            rows.push(row);
+        });
+
+        rows.sort((a, b) => a.idx - b.idx);
+        frm.doc[fieldname] = rows;
+        frm.refresh_field(fieldname);
+    });
+
+    if (version) frm.doc.modified = version;
+}
+
+// --- Serial scan mode ---
+// The snapshot's serial numbers are loaded once per count into a Map (serial → item) and a Set of
+// the serials already scanned, so resolving a scan is a constant-time lookup on any bin size.
+function loadSerialIndex(frm) {
+    if (!frm.doc.serial_scan || frm.doc.__islocal) return;
+    if (frm.__serial_index && frm.__serial_index_for === frm.doc.name) return;
+
+    frappe.call({
+        method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.get_serial_number_index',
+        args: { inventory_count_name: frm.doc.name },
+        callback: function(r) {
+            const serials = new Map();
+            const scanned = new Set();
+            ((r.message && r.message.serials) || []).forEach(([item_id, serial_number, is_scanned]) => {
+                const key = serial_number.toUpperCase();
+                serials.set(key, { item_id: item_id, serial_number: serial_number });
+                if (is_scanned) scanned.add(key);
+            });
+            frm.__serial_index = serials;
+            frm.__scanned_serials = scanned;
+            frm.__serial_index_for = frm.doc.name;
+            if (debug_mode) console.log(`Serial index loaded: ${serials.size} serial numbers, ${scanned.size} scanned.`);
+        }
+    });
+}
+
+// Returns {serial_number, item_id} for a known serial number, {} for an item code of the snapshot
+// (items without serial numbers are still counted by code) or {error} otherwise.
+function resolveSerialScan(frm, scannedCode) {
+    if (!frm.__serial_index) {
+        loadSerialIndex(frm);
+        return { error: __("Chargement des numéros de série en cours, veuillez rescanner.") };
+    }
+
+    const key = scannedCode.toUpperCase();
+    const serial = frm.__serial_index.get(key);
+    if (serial) {
+        if (frm.__scanned_serials.has(key)) {
+            return { error: __("Le numéro de série {0} a déjà été scanné.", [serial.serial_number]) };
+        }
+        return serial;
+    }
+    if (getVirtualItem(frm, scannedCode)) return {};
+    return { error: __("Numéro de série ou article inconnu : {0}", [scannedCode]) };
+}
+
+// --- Scan queue ---
+// Scans are not sent one request per Enter: they are queued, a code scanned again adds to its queued
+// entry, and the queue is sent to 'upsert_physical_items' SCAN_FLUSH_DELAY ms after its first scan,
+// or at once when it holds SCAN_BATCH_SIZE scans. One batch is in flight at a time, the scans made
+// meanwhile go with the next one.
+const SCAN_FLUSH_DELAY = 300;
+const SCAN_BATCH_SIZE = 25;
+
+function getScanQueue(frm) {
+    if (!frm.__scan_queue || frm.__scan_queue.doc !== frm.doc.name) {
+        frm.__scan_queue = { doc: frm.doc.name, scans: new Map(), count: 0, timer: null, in_flight: false };
+    }
+    return frm.__scan_queue;
+}
+
+function scanQueuePending(frm) {
+    const queue = frm.__scan_queue;
+    return !!queue && (queue.count > 0 || queue.in_flight);
+}
+
+function enqueueScan(frm, code, description, expectedQty, serialNumber) {
+    const queue = getScanQueue(frm);
+    const key = code.toUpperCase();
+    let scan = queue.scans.get(key);
+    if (scan) {
+        scan.qty += 1;
+        scan.description = description;
+        scan.expected_qty = expectedQty;
+    } else {
+        scan = { code: code, qty: 1, timestamp: Date.now(), description: description, expected_qty: expectedQty, serial_numbers: [] };
+        queue.scans.set(key, scan);
+    }
+    if (serialNumber) {
+        scan.serial_numbers.push(serialNumber);
+        if (frm.__scanned_serials) frm.__scanned_serials.add(serialNumber.toUpperCase()); // A second scan is refused locally
+    }
+
+    queue.count += 1;
+    if (queue.count >= SCAN_BATCH_SIZE) {
+        flushScanQueue(frm);
+    } else if (!queue.timer) {
+        queue.timer = setTimeout(() => flushScanQueue(frm), SCAN_FLUSH_DELAY);
+    }
+}
+
+function flushScanQueue(frm) {
+    const queue = getScanQueue(frm);
+    if (queue.timer) {
+        clearTimeout(queue.timer);
+        queue.timer = null;
+    }
+    if (queue.in_flight || !queue.count) return; // Sent when the batch in flight comes back
+
+    const scans = Array.from(queue.scans.values());
+    queue.scans = new Map();
+    queue.count = 0;
+    queue.in_flight = true;
+    if (debug_mode) console.log(`Sending ${scans.length} queued code(s).`, scans);
+
+    frappe.call({
+        method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.upsert_physical_items',
+        args: { parent_name: queue.doc, scans: scans },
+        callback: function(r) {
+            const message = r.message || {};
+            if (message.rows) {
+                applyPhysicalItemsDelta(frm, message.sequence, message.rows); // Patch only the scanned rows
+            }
+            if (message.duplicate_serials && message.duplicate_serials.length) {
+                frappe.show_alert({
+                    message: __("Numéro(s) de série déjà scanné(s) : {0}", [message.duplicate_serials.join(', ')]),
+                    indicator: 'orange'
+                });
+                resyncPhysicalItems(frm); // Drops the optimistic +1 of these scans
+            }
+        },
+        error: function(err) {
+            console.error('Error persisting scans:', err);
+            frappe.show_alert({ message: __("Les derniers scans n'ont pas été enregistrés, veuillez les rescanner."), indicator: 'red' });
+            scans.forEach(scan => scan.serial_numbers.forEach(sn => frm.__scanned_serials && frm.__scanned_serials.delete(sn.toUpperCase())));
+            resyncPhysicalItems(frm);
+        },
+        always: function() {
+            queue.in_flight = false;
+            if (queue.count) {
+                flushScanQueue(frm); // Scans queued while this batch was in flight
+            } else {
+                python_request_in_progress(false);
+            }
+        }
+    });
+}
+
+// Virtual item of a code through a Map of the snapshot (first row of each item_id), rebuilt when the table changes
+function getVirtualItem(frm, code) {
+    const rows = frm.doc.inv_virtual_items || [];
+    if (frm.__virtual_items_rows !== rows || frm.__virtual_items_count !== rows.length) {
+        const index = new Map();
+        rows.forEach(row => {
+            const key = (row.item_id || '').toUpperCase();
+            if (!index.has(key)) index.set(key, row);
+        });
+        frm.__virtual_items_index = index;
+        frm.__virtual_items_rows = rows;
+        frm.__virtual_items_count = rows.length;
+    }
+    return frm.__virtual_items_index.get(code.toUpperCase());
+}
+
+// --- Physical items deltas ---
+// Each committed scan is published as the changed row(s) with a sequence number per count. Delta n + 1
+// is applied on top of delta n; a duplicate (scan response and realtime event of the same scan) is
+// ignored and a gap, or a sequence restarting at 1 (server cache flushed), reloads the whole table.
+function applyPhysicalItemsDelta(frm, sequence, rows) {
+    if (frm.__scan_sequence_doc !== frm.doc.name) frm.__scan_sequence = null; // Form reused for another count
+    if (frm.__scan_sequence != null && sequence <= frm.__scan_sequence && sequence !== 1) return;
+    if (frm.__scan_sequence == null || sequence !== frm.__scan_sequence + 1) {
+        resyncPhysicalItems(frm);
+        return;
+    }
+    frm.__scan_sequence = sequence;
+
+    const grid = frm.fields_dict.inv_physical_items.grid;
+    let added = false;
+    rows.forEach(values => {
+        const items = frm.doc.inv_physical_items || [];
+        const code = (values.code || '').toUpperCase();
+        const row = items.find(r => r.name === values.name) || items.find(r => (r.code || '').toUpperCase() === code);
+        if (!row) {
+            const newRow = Object.assign({
+                doctype: 'Inv_physical_items',
+                parent: frm.doc.name,
+                parentfield: 'inv_physical_items',
+                parenttype: frm.doctype
+            }, values);
+            frappe.model.add_to_locals(newRow);
+            frm.doc.inv_physical_items = items.concat([newRow]);
+            added = true;
+            return;
+        }
+
+        if (row.name !== values.name) {
+            // Optimistic row of this scan: it takes the name of the server row
+            delete locals[row.doctype][row.name];
+            delete row.__islocal;
+            delete row.__unsaved;
+            Object.assign(row, values);
+            locals[row.doctype][row.name] = row;
+            added = true;
+            return;
+        }
+        Object.assign(row, values);
+        const grid_row = grid.get_row(row.name);
+        if (grid_row) grid_row.refresh(); // Only this row is re-rendered
+    });
+
+    if (added) frm.refresh_field('inv_physical_items');
+    applyPhysicalItemsColoring(frm);
+}
+
+function resyncPhysicalItems(frm) {
+    if (frm.__physical_items_resync) return; // One reload at a time
+    frm.__physical_items_resync = true;
+    frappe.call({
+        method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.get_physical_items_state',
+        args: { inventory_count_name: frm.doc.name },
+        callback: function(r) {
+            if (r.message) {
+                frm.__scan_sequence = r.message.sequence;
+                frm.__scan_sequence_doc = frm.doc.name;
+                frm.set_value('inv_physical_items', r.message.items);
+                frm.refresh_field('inv_physical_items');
+                applyPhysicalItemsColoring(frm);
+            }
+        },
+        always: function() {
+            frm.__physical_items_resync = false;
+        }
+    });
+}
+
 // --- Helper function to check if all differences are confirmed ---
 function checkAllDifferencesConfirmed(frm, resolve, reject) {
     const invDifferenceTable = frm.doc.inv_difference;
@@ -561,9 +770,9 @@ function checkAllDifferencesConfirmed(frm, resolve, reject) {
                 method: "inv_count.inventory_count.doctype.inventory_count.inventory_count.get_connectwise_type_adjustments",
                 args: {},
             }).then(r => {
-                if (r.message) {
-                    const adjustmentTypes = r.message;
-                    console.log("ConnectWise Type Adjustments:", adjustmentTypes);
+                if (r.message && r.message.types) {
+                    const adjustmentTypes = r.message.types;
+                    console.log(`ConnectWise Type Adjustments (cached ${r.message.cache_age} s ago):`, adjustmentTypes);
                     frm.set_df_property('adjustment_type', 'options', [''].concat(adjustmentTypes));
                     frm.set_df_property('adjustment_type', 'read_only', 0);
                     frm.refresh_field('adjustment_type');
@@ -637,6 +846,67 @@ function checkAllDifferencesConfirmed(frm, resolve, reject) {
 }
 
 
+// --- Helpers for the background import ---
+function handleImportProgress(frm, data) {
+    const stageLabels = {
+        fetch: __("Lecture de l'inventaire virtuel"),
+        map: __("Association des colonnes"),
+        merge: __("Fusion de la liste d'articles"),
+        write: __("Écriture des articles"),
+        commit: __("Enregistrement")
+    };
+
+    if (stageLabels[data.stage]) {
+        let description = stageLabels[data.stage];
+        if (data.rows) description += ` (${data.rows})`;
+        frappe.show_progress(__("Importation de l'inventaire virtuel"), data.progress || 0, 100, description);
+        return;
+    }
+
+    // Final event: done, cancelled or error
+    frappe.hide_progress();
+    frm.remove_custom_button(__("Annuler l'importation"));
+    frm.__import_job_id = null;
+
+    if (data.stage === 'done') {
+        frappe.show_alert({
+            message: __("Importation de l'inventaire virtuel terminée."),
+            indicator: 'green'
+        });
+        frm.__serial_index = null; // New snapshot, new serial numbers
+        frm.reload_doc().then(() => {
+            // Then, populate the categories using the fresh data
+            populateMainCategoryDropdown(frm);
+            python_request_in_progress(false); // Re-enable auto-update after import
+        });
+    } else if (data.stage === 'cancelled') {
+        frm.__import_cancelled = true; // Do not restart the import automatically on the next refresh
+        frappe.show_alert({
+            message: __("Importation de l'inventaire virtuel annulée."),
+            indicator: 'orange'
+        }, 5);
+        python_request_in_progress(false);
+    } else {
+        frappe.msgprint({
+            message: __('Échec d\'importation.') + (data.message ? ' ' + data.message : ''),
+            title: __('Erreur'),
+            indicator: 'red'
+        });
+        python_request_in_progress(false); // Re-enable auto-update after import failure
+    }
+}
+
+function addCancelImportButton(frm) {
+    frm.add_custom_button(__("Annuler l'importation"), function() {
+        frappe.call({
+            method: 'inv_count.inventory_count.doctype.inventory_count.inventory_count.cancel_import',
+            args: {
+                inventory_count_name: frm.doc.name
+            }
+        });
+    });
+}
+
 // --- Helper Function for Coloring ---
 function applyPhysicalItemsColoring(frm) {
     // Ensure the grid exists before trying to access its elements
@@ -1,25 +1,280 @@
 # Copyright (c) 2025, Microtec and contributors
 # For license information, please see license.txt
 
+import json
+import os
+import traceback  # Import for more detailed error traceback
+from functools import partial
+
 import frappe
-from frappe import _ # Import for translation support
-from frappe.model.document import Document
 import pandas as pd
-import os
 import pyodbc
-import traceback # Import for more detailed error traceback
 import requests
-import base64
-import json
-from frappe.utils import get_datetime, get_timestamp
-import re
+from frappe import _  # Import for translation support
+from frappe.model.document import Document
+from frappe.utils import cint, get_datetime, get_timestamp, getdate, now
+
+from inv_count.inventory_count.connectwise import get_client, get_client_stats, iter_records
+from inv_count.inventory_count.db_compare import compare_in_database
+from inv_count.inventory_count.difference_engine import (
+    REMOVE_ADD,
+    filter_category_scope,
+    index_categories,
+    normalize_code,
+    plan_differences,
+    serial_to_do,
+)
+from inv_count.inventory_count.reference_cache import get_reference_data
+from inv_count.inventory_count.scan_batch import coalesce_scans
+from inv_count.inventory_count.serial_scan import (
+    clear_scanned_serial_numbers,
+    get_scanned_serial_numbers,
+    get_serial_index,
+    record_scanned_serial,
+)
+from inv_count.inventory_count.snapshot_cache import (
+    clear_cached_snapshots,
+    clear_category_index,
+    get_cached_snapshot,
+    get_category_index,
+    set_cached_snapshot,
+    set_category_index,
+    snapshot_cache_key,
+)
+from inv_count.inventory_count.sql_pool import bind_query, get_pool_stats, read_queries_concurrently
+from inv_count.inventory_count.virtual_import import (
+    bulk_import_virtual_items,
+    clear_serial_numbers,
+    delta_import_virtual_items,
+    get_serial_numbers,
+    get_virtual_item_categories,
+    get_virtual_item_totals,
+    insert_serial_numbers,
+    iter_sql_chunks,
+    parse_serial_numbers,
+    read_snapshot_csv,
+    stream_import_virtual_items,
+)
+from inv_count.inventory_count.warehouse_sync import enqueue_sync, get_sync_age
 
 response_details = None
 
 class InventoryCount(Document):
-    pass
+    def validate(self):
+        if not self.is_new() and live_differences_enabled():
+            self.update_live_differences()
+
+    def on_trash(self):
+        clear_category_index(self.name)
+        clear_serial_numbers(self.name) # Not a table field of the document, so not deleted with it
+        clear_scanned_serial_numbers(self.name)
+        frappe.cache.delete_value(frappe.cache.make_key(f"{SCAN_SEQUENCE_KEY}{self.name}"), make_keys=False)
+
+    def update_live_differences(self):
+        """
+        'Live Differences': refreshes the difference rows of the physical items whose quantity was
+        changed or deleted by this save (manual grid edits), instead of waiting for a full compare.
+        """
+        doc_before_save = self.get_doc_before_save()
+        if not doc_before_save:
+            return
+
+        qty_before = {normalize_code(row.code): cint(row.qty) for row in doc_before_save.get("inv_physical_items")}
+        qty_after = {normalize_code(row.code): cint(row.qty) for row in self.get("inv_physical_items")}
+        codes = {code for code in qty_before.keys() | qty_after.keys() if qty_before.get(code) != qty_after.get(code)} - {""}
+        if not codes:
+            return
+
+        def touched(rows, code_field):
+            return [row for row in rows if normalize_code(row.get(code_field)) in codes]
+
+        physical_items = touched(self.get("inv_physical_items"), "code")
+        virtual_items = touched(self.get("inv_virtual_items"), "item_id")
+        category_index = get_count_category_index(self) if self.get("category") or self.get("subcategory") else None
+        plan = plan_differences(
+            get_items_in_scope(self, physical_items, "code", category_index),
+            get_items_in_scope(self, virtual_items, "item_id", category_index),
+            touched(self.get("inv_difference"), "item_code"),
+            virtual_items,
+        )
+        apply_difference_plan(self, plan, codes)
+
+
+IMPORT_PROGRESS_EVENT = "inventory_count_import_progress" # Realtime event published to the form during an import
+IMPORT_STAGE_PROGRESS = {"fetch": 10, "map": 35, "merge": 45, "write": 60, "commit": 90} # Percent shown when a stage starts
+
+
+class ImportCancelled(Exception):
+    """Raised between import stages when the user cancelled the background import."""
+
+
+def _import_cancel_key(inventory_count_name):
+    return f"inv_count:import_cancelled:{inventory_count_name}"
+
+
+def _publish_import_event(inventory_count_name, stage, **details):
+    frappe.publish_realtime(
+        IMPORT_PROGRESS_EVENT,
+        {"docname": inventory_count_name, "stage": stage, "progress": IMPORT_STAGE_PROGRESS.get(stage, 100), **details},
+        doctype="Inventory Count",
+        docname=inventory_count_name,
+    )
+
+
+def publish_import_progress(inventory_count_name, stage, **details):
+    """
+    Publishes the current import stage (fetch, map, merge, write, commit) to the Inventory Count form.
+    Also the cancellation point: raises ImportCancelled if `cancel_import` was called for this document.
+    """
+    if frappe.cache.get_value(_import_cancel_key(inventory_count_name)):
+        raise ImportCancelled(_("Import cancelled by the user."))
+    _publish_import_event(inventory_count_name, stage, **details)
+
+
+@frappe.whitelist()
+def enqueue_import(inventory_count_name):
+    """
+    Starts `import_data_with_pandas` as a background job on the long queue and returns its job id
+    right away. Progress is published with the 'inventory_count_import_progress' realtime event.
+    """
+    if not inventory_count_name or not frappe.db.exists("Inventory Count", inventory_count_name):
+        frappe.throw(_("Document '{0}' with name '{1}' not found.").format("Inventory Count", inventory_count_name), title=_("Document Missing"))
+
+    frappe.has_permission("Inventory Count", "write", inventory_count_name, throw=True)
+
+    # A cancel request left over from a previous run must not stop this one
+    frappe.cache.delete_value(_import_cancel_key(inventory_count_name))
+
+    job = frappe.enqueue(
+        "inv_count.inventory_count.doctype.inventory_count.inventory_count.run_import_job",
+        queue="long",
+        timeout=3600,
+        job_id=f"inventory_count_import::{inventory_count_name}",
+        deduplicate=True,
+        inventory_count_name=inventory_count_name,
+    )
+    if not job:
+        return {"status": "already_running", "message": _("An import is already running for this document.")}
+
+    return {"status": "queued", "job_id": job.id}
+
+
+def run_import_job(inventory_count_name):
+    """Background job body: runs the import and publishes its final state (done, cancelled or error)."""
+    try:
+        result = import_data_with_pandas(inventory_count_name)
+    except Exception as e:
+        # Errors raised before the import's own error handling (missing document or settings)
+        result = {"status": "error", "message": str(e)}
+    frappe.cache.delete_value(_import_cancel_key(inventory_count_name))
+
+    if result.get("status") == "success" and live_differences_enabled():
+        # A new snapshot changes the virtual side of every item: live differences are recomputed once here
+        try:
+            compare_in_database(inventory_count_name)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), "Live differences refresh after import failed")
+
+    stage = {"success": "done", "cancelled": "cancelled"}.get(result.get("status"), "error")
+    _publish_import_event(inventory_count_name, stage, message=result.get("message"), stats=result.get("stats"))
+    return result
+
+
+@frappe.whitelist()
+def cancel_import(inventory_count_name):
+    """
+    Asks the running import of `inventory_count_name` to stop. The job stops at its next stage
+    (or chunk in Streaming mode) and rolls back everything it wrote.
+    """
+    frappe.has_permission("Inventory Count", "write", inventory_count_name, throw=True)
+    frappe.cache.set_value(_import_cancel_key(inventory_count_name), 1, expires_in_sec=3600)
+    return {"status": "cancelling"}
+
+
+def get_warehouse_ids(inventory_count_doc):
+    """
+    Returns the ConnectWise (warehouse_id, warehouse_bin_id) of a count: fetched from 'CW Warehouse'
+    and 'CW Warehouse Bin' into the count, read from them when the count predates these fields.
+    """
+    warehouse_id = cint(inventory_count_doc.get("warehouse_id")) or cint(
+        inventory_count_doc.warehouse and frappe.db.get_value("CW Warehouse", inventory_count_doc.warehouse, "cw_id"))
+    warehouse_bin_id = cint(inventory_count_doc.get("warehouse_bin_id")) or cint(
+        inventory_count_doc.warehouse_bin and frappe.db.get_value("CW Warehouse Bin", inventory_count_doc.warehouse_bin, "cw_id"))
+    return warehouse_id, warehouse_bin_id
+
+
+def get_snapshot_parameters(inventory_count_doc):
+    """Returns the (warehouse_id, warehouse_bin_id, valuation_date) used by the SQL snapshot queries."""
+    warehouse_id, warehouse_bin_id = get_warehouse_ids(inventory_count_doc)
+    valuation_date = inventory_count_doc.date.strftime('"%Y-%m-%d"')
+    return warehouse_id, warehouse_bin_id, valuation_date
+
+
+def get_snapshot_queries(settings_doc, inventory_count_doc):
+    """
+    Returns 'SQL Query' and 'SQL Query #2' as (sql, params) pairs: {warehouse_id}, {warehouse_bin_id},
+    {valuation_date}, {category} and {subcategory} become bound parameters instead of being pasted
+    into the SQL text. {category} / {subcategory} are NULL when the count is not scoped, so a query
+    can filter with `({category} IS NULL OR Category = {category})`.
+    """
+    warehouse_id, warehouse_bin_id, _valuation_date = get_snapshot_parameters(inventory_count_doc)
+    parameters = {
+        "warehouse_id": warehouse_id,
+        "warehouse_bin_id": warehouse_bin_id,
+        "valuation_date": getdate(inventory_count_doc.date),
+        "category": inventory_count_doc.get("category") or None,
+        "subcategory": inventory_count_doc.get("subcategory") or None,
+    }
+    return bind_query(settings_doc.sql_query, parameters), bind_query(settings_doc.sql_query_2, parameters)
+
+
+def get_snapshot_source(settings_doc):
+    """SQL Server and database the snapshot is read from, part of its cache key."""
+    return f"{settings_doc.sql_host},{settings_doc.sql_port}/{settings_doc.sql_database}"
+
+
+@frappe.whitelist()
+def clear_snapshot_cache(inventory_count_name=None):
+    """
+    Invalidates the shared SQL snapshot cache: only the snapshot used by `inventory_count_name`
+    when given, every cached snapshot otherwise.
+    """
+    if inventory_count_name:
+        frappe.has_permission("Inventory Count", "write", inventory_count_name, throw=True)
+        inventory_count_doc = frappe.get_doc("Inventory Count", inventory_count_name)
+        settings_doc = frappe.get_single("Inventory Count Settings")
+        warehouse_id, warehouse_bin_id, valuation_date = get_snapshot_parameters(inventory_count_doc)
+        clear_cached_snapshots(snapshot_cache_key(get_snapshot_source(settings_doc), warehouse_id, warehouse_bin_id, valuation_date, *get_snapshot_queries(settings_doc, inventory_count_doc)))
+    else:
+        frappe.only_for("System Manager")
+        clear_cached_snapshots()
+    return {"status": "success"}
 
-cwAPI_version="2025.8" # Define the ConnectWise API version to use throughout the code
+
+@frappe.whitelist()
+def get_sql_import_stats():
+    """Connection pool hits/misses/evictions and SQL query timings of the current worker, for monitoring."""
+    frappe.only_for("System Manager")
+    return get_pool_stats()
+
+
+@frappe.whitelist()
+def get_connectwise_stats():
+    """Request/retry/error counters and ConnectWise call timings of the current worker, for monitoring."""
+    frappe.only_for("System Manager")
+    return get_client_stats()
+
+@frappe.whitelist()
+def get_virtual_inventory_totals(inventory_count_name):
+    """
+    Totals (rows, items, QOH, qty, picked quantities, extended cost and qty x selected cost) of the
+    virtual snapshot, within the count's category / subcategory, computed with one SQL aggregate.
+    """
+    frappe.has_permission("Inventory Count", "read", inventory_count_name, throw=True)
+    category, subcategory = frappe.db.get_value("Inventory Count", inventory_count_name, ["category", "subcategory"])
+    return get_virtual_item_totals(inventory_count_name, category, subcategory)
 
 @frappe.whitelist()
 def import_data_with_pandas(inventory_count_name):
@@ -47,12 +302,19 @@ def import_data_with_pandas(inventory_count_name):
     except Exception:
         frappe.throw(_("'{0}' document not found. Please configure your import settings first.").format(settings_doctype), title=_("Settings Missing"))
 
+    progress = partial(publish_import_progress, inventory_count_name)
+
     try:
+        progress("fetch")
         df = pd.DataFrame() # Initialize an empty DataFrame
         df_item_list = pd.DataFrame() # Initialize an empty DataFrame for second query if needed
+        chunks = None # Iterator of DataFrames, only used by the Streaming import mode
+        cache_hit = False # True when the SQL snapshot was served from the shared snapshot cache
         
-        # Determine import source type from settings
+        # Determine import source type and mode from settings
         import_source_type = settings_doc.import_source_type
+        import_mode = settings_doc.get("import_mode") or "Standard"
+        chunk_size = settings_doc.get("import_chunk_size") or 5000
 
         if import_source_type == "CSV":
             csv_file_path_relative = settings_doc.csv_file_path
@@ -67,15 +329,21 @@ def import_data_with_pandas(inventory_count_name):
                 frappe.log_error(f"CSV file not found: {csv_full_path}", "Inventory Count Import Error") # Internal log, not for translation
                 frappe.throw(_("Error: CSV file '{0}' not found at '{1}'. Please check 'Inventory Count Settings'.").format(csv_file_path_relative, csv_full_path), title=_("File Not Found"))
             
-            df = pd.read_csv(csv_full_path, encoding='iso-8859-1')
+            if settings_doc.get("csv_fast_parse"):
+                # Only the mapped columns, typed, parsed once per file version (path + mtime + size)
+                csv_cache_dir = frappe.get_site_path("private", "inv_count_csv_cache")
+                if import_mode == "Streaming":
+                    chunks = read_snapshot_csv(csv_full_path, chunksize=chunk_size)
+                else:
+                    df = read_snapshot_csv(csv_full_path, cache_dir=csv_cache_dir)
+            elif import_mode == "Streaming":
+                chunks = pd.read_csv(csv_full_path, encoding='iso-8859-1', chunksize=chunk_size)
+            else:
+                df = pd.read_csv(csv_full_path, encoding='iso-8859-1')
 
         elif import_source_type == "SQL Database":
 
-            warehouse_id_split=inventory_count_doc.warehouse.split('(')[1]
-            warehouse_id = warehouse_id_split.split(')')[0]
-            warehouse_bin_id_split = inventory_count_doc.warehouse_bin.split('(')[1]
-            warehouse_bin_id = warehouse_bin_id_split.split(')')[0]
-            valuation_date = inventory_count_doc.date.strftime('"%Y-%m-%d"')
+            warehouse_id, warehouse_bin_id, valuation_date = get_snapshot_parameters(inventory_count_doc)
 
             # Retrieve SQL connection details from the Settings DocType
             sql_host = settings_doc.sql_host
@@ -84,41 +352,83 @@ def import_data_with_pandas(inventory_count_name):
             sql_username = settings_doc.sql_username
             sql_password = settings_doc.get_password('sql_password')
             sql_query = settings_doc.sql_query
-            sql_query_2 = settings_doc.sql_query_2
-
-            sql_query = sql_query.replace("{warehouse_id}", warehouse_id).replace("{warehouse_bin_id}", warehouse_bin_id).replace("{valuation_date}", valuation_date)
 
             # These are marked as required in the DocType, but a quick check here is good too
             if not all([sql_host, sql_database, sql_username, sql_query]):
                 frappe.throw(_("Missing SQL connection details (Host, Database, Username, or Query) in 'Inventory Count Settings'."), title=_("SQL Details Missing"))
 
-            try:
-                conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={sql_host},{sql_port};DATABASE={sql_database};UID={sql_username};PWD={sql_password};TrustServerCertificate=yes;Encrypt=yes"
-                conn = pyodbc.connect(conn_str)
-                df = pd.read_sql_query(sql_query, conn)
-                if sql_query_2: 
-                    df_item_list = pd.read_sql_query(sql_query_2, conn)
-                conn.close()
-
-            except pyodbc.Error as e:
-                frappe.log_error(f"SQL Database connection/query error: {e}", "Inventory Count SQL Import Error") # Internal log, not for translation
-                frappe.throw(_("SQL Database Error: {0}. Check your connection details and query in 'Inventory Count Settings'.").format(e), title=_("SQL Error"))
-            except Exception as e:
-                frappe.log_error(f"General error during SQL import: {e}", "Inventory Count SQL Import Error") # Internal log, not for translation
-                frappe.throw(_("An unexpected error occurred during SQL import: {0}").format(e), title=_("SQL Import Failed"))
+            # Placeholders are bound as parameters, so the count's category/subcategory can scope the snapshot on the server
+            snapshot_query, item_list_query = get_snapshot_queries(settings_doc, inventory_count_doc)
+
+            # Shared snapshot cache: other counts of the same bin and date reuse the SQL Server result.
+            # The Streaming mode never holds the whole snapshot, so it always reads SQL Server.
+            cache_ttl = (settings_doc.get("snapshot_cache_ttl") or 0) if import_mode != "Streaming" else 0
+            cache_key = snapshot_cache_key(get_snapshot_source(settings_doc), warehouse_id, warehouse_bin_id, valuation_date, snapshot_query, item_list_query)
+            cached_snapshot = get_cached_snapshot(cache_key) if cache_ttl else None
+
+            if cached_snapshot is not None:
+                df, df_item_list = cached_snapshot
+                cache_hit = True
+            else:
+                try:
+                    conn_str = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={sql_host},{sql_port};DATABASE={sql_database};UID={sql_username};PWD={sql_password};TrustServerCertificate=yes;Encrypt=yes"
+                    # Both queries run at the same time, each on a warm connection from the worker's pool
+                    results = read_queries_concurrently(conn_str, {
+                        "snapshot": snapshot_query if import_mode != "Streaming" else None,
+                        "item_list": item_list_query,
+                    })
+                    df = results.get("snapshot", df)
+                    df_item_list = results.get("item_list", df_item_list)
+
+                    if import_mode == "Streaming":
+                        # Lazy: rows are fetched chunk by chunk while they are written
+                        chunks = iter_sql_chunks(conn_str, snapshot_query[0], chunk_size, params=snapshot_query[1])
+
+                except pyodbc.Error as e:
+                    frappe.log_error(f"SQL Database connection/query error: {e}", "Inventory Count SQL Import Error") # Internal log, not for translation
+                    frappe.throw(_("SQL Database Error: {0}. Check your connection details and query in 'Inventory Count Settings'.").format(e), title=_("SQL Error"))
+                except Exception as e:
+                    frappe.log_error(f"General error during SQL import: {e}", "Inventory Count SQL Import Error") # Internal log, not for translation
+                    frappe.throw(_("An unexpected error occurred during SQL import: {0}").format(e), title=_("SQL Import Failed"))
+
+                if cache_ttl:
+                    set_cached_snapshot(cache_key, df, df_item_list, cache_ttl)
 
         else:
             frappe.throw(_("Invalid import source type selected in 'Inventory Count Settings'. Please choose 'CSV' or 'SQL Database'."), title=_("Invalid Source Type"))
         
+        qoh_calculation_type = settings_doc.get('qty_calculation_type', 'QOH + Picked') 
+
+        # Bulk mode: column by column mapping + multi-row INSERT, no child Document per row.
+        # A Standard import with an item list ('SQL Query #2') goes the same way: the item list is outer-merged
+        # with the snapshot on IV_Item_RecID and the merged frame is written by the bulk writer.
+        if import_mode == "Bulk" or (import_mode == "Standard" and not df_item_list.empty):
+            stats = bulk_import_virtual_items(inventory_count_doc.name, df, df_item_list, qoh_calculation_type, progress=progress)
+            progress("commit")
+            frappe.db.commit() # Ensure changes are persisted in the database
+            store_category_index(inventory_count_doc.name)
+
+            return {"status": "success", "message": _("Import completed successfully. {0} items imported.").format(stats["rows"]), "stats": stats, "cache_hit": cache_hit}
+
+        # Delta mode: only the rows whose content changed since the last import are written
+        if import_mode == "Delta":
+            stats = delta_import_virtual_items(inventory_count_doc.name, df, df_item_list, qoh_calculation_type, progress=progress)
+            progress("commit")
+            frappe.db.commit() # Ensure changes are persisted in the database
+            store_category_index(inventory_count_doc.name)
+
+            return {"status": "success", "message": _("Import completed successfully. {0} items imported.").format(stats["rows"]), "stats": stats, "cache_hit": cache_hit}
+
+        # Streaming mode: each chunk is mapped and flushed before the next one is fetched
+        if import_mode == "Streaming":
+            stats = stream_import_virtual_items(inventory_count_doc.name, chunks, df_item_list, qoh_calculation_type, chunk_size, progress=progress)
+            progress("commit")
+            frappe.db.commit() # Ensure changes are persisted in the database
+            store_category_index(inventory_count_doc.name)
+
+            return {"status": "success", "message": _("Import completed successfully. {0} items imported.").format(stats["rows"]), "stats": stats, "cache_hit": cache_hit}
         
-        if not df_item_list.empty and sql_query_2:
-        # Create a map of IV_Item_RecID to row data from df_item_list
-            df_item_list=df_item_list.fillna(0)
-            df_item_list_map = {}
-            for index2, row2 in df_item_list.iterrows():
-                recid = row2.get('IV_Item_RecID')
-                if pd.notna(recid):
-                    df_item_list_map[recid] = row2
+        progress("map")
 
         # --- Common logic after DataFrame is loaded ---
         df = df.fillna(0)
@@ -126,8 +436,6 @@ def import_data_with_pandas(inventory_count_name):
         # Clear the childtable before adding new entries
         inventory_count_doc.set(child_table_field_name, [])
 
-        qoh_calculation_type = settings_doc.get('qty_calculation_type', 'QOH + Picked') 
-
         # Iterate through each row of the DataFrame and add to the childtable
         for index, row in df.iterrows():
             child_item = inventory_count_doc.append(child_table_field_name, {})
@@ -166,52 +474,20 @@ def import_data_with_pandas(inventory_count_name):
                 frappe.log_error(f"Error mapping data row: {row}. Error: {e}", "Inventory Count Data Mapping Error") # Internal log, not for translation
                 frappe.throw(_("Error mapping data row to child table: {0}. Check your CSV/SQL column names and data types.").format(e), title=_("Data Mapping Error"))
 
-        if 'df_item_list_map' in locals() and df_item_list_map:
-            # Create a map of existing items by IV_Item_RecID for quick lookup
-            existing_items_map = {}
-            for child in inventory_count_doc.get(child_table_field_name):
-                if child.iv_item_recid:
-                    existing_items_map[child.iv_item_recid] = child
-            
-            # Process each item from df2
-            for recid, row2 in df_item_list_map.items():
-                if recid in existing_items_map:
-                    # Update existing item with additional data from df2
-                    child_item = existing_items_map[recid]
-                    child_item.subcatname = row2.get('subCatName', '')
-                else:
-                    # Create new item from df2 data
-                    child_item = inventory_count_doc.append(child_table_field_name, {})
-                    child_item.location = ''
-                    child_item.iv_item_recid = row2.get('IV_Item_RecID', '')
-                    child_item.item_id = str(row2.get('Item_ID', '')).upper()
-                    child_item.shortdescription = row2.get('Description', '')
-                    child_item.category = row2.get('catName', '')
-                    child_item.vendor_recid = row2.get('Vendor_RecID', '')
-                    child_item.vendor_name = row2.get('Vendor_Name', '')
-                    child_item.warehouse_recid = ''
-                    child_item.warehouse = ''
-                    child_item.warehouse_bin_recid = ''
-                    child_item.bin = ''
-                    child_item.qoh = 0
-                    child_item.qty = 0
-                    child_item.lasttransactiondate = None
-                    child_item.iv_audit_recid = ''
-                    child_item.pickednotshipped = 0
-                    child_item.pickednotshippedcost = 0.0
-                    child_item.pickednotinvoiced = 0
-                    child_item.pickednotinvoicedcost = 0.0
-                    child_item.selectedcost = 0
-                    child_item.extendedcost = 0.0
-                    child_item.snlist = ''
-                    # New fields from df2
-                    child_item.subcatname = row2.get('subCatName', '')
-
+        progress("write", rows=len(inventory_count_doc.get(child_table_field_name)))
         inventory_count_doc.save()
+        serial_pairs = parse_serial_numbers(pd.DataFrame([{"item_id": row.item_id, "snlist": row.snlist} for row in inventory_count_doc.get(child_table_field_name)], columns=["item_id", "snlist"]))
+        clear_serial_numbers(inventory_count_doc.name)
+        insert_serial_numbers(inventory_count_doc.name, serial_pairs)
+        progress("commit")
         frappe.db.commit() # Ensure changes are persisted in the database
+        set_category_index(inventory_count_doc.name, index_categories(inventory_count_doc.get(child_table_field_name)))
 
-        return {"status": "success", "message": _("Import completed successfully. {0} items imported.").format(len(inventory_count_doc.get(child_table_field_name)))} # This is a translatable user-facing message
+        return {"status": "success", "message": _("Import completed successfully. {0} items imported.").format(len(inventory_count_doc.get(child_table_field_name))), "cache_hit": cache_hit} # This is a translatable user-facing message
 
+    except ImportCancelled as e:
+        frappe.db.rollback() # Nothing written by the cancelled import is kept
+        return {"status": "cancelled", "message": str(e)}
     except Exception as e:
         frappe.db.rollback() # Rollback changes in case of error
         frappe.log_error(frappe.get_traceback(), "Error during Inventory Count import") # Changed log category to English
@@ -221,8 +497,179 @@ def import_data_with_pandas(inventory_count_name):
         return {"status": "error", "message": str(e)}
 
 
+def store_category_index(inventory_count_name):
+    """Builds the item → (category, subcatname) index of the imported snapshot and stores it with the snapshot cache."""
+    category_index = index_categories(get_virtual_item_categories(inventory_count_name))
+    set_category_index(inventory_count_name, category_index)
+    return category_index
+
+
+def get_count_category_index(doc):
+    """Index stored by the last import, rebuilt from the loaded virtual items when it is missing (cache flushed)."""
+    category_index = get_category_index(doc.name)
+    if category_index is None:
+        category_index = index_categories(doc.get("inv_virtual_items"))
+        set_category_index(doc.name, category_index)
+    return category_index
+
+
+def get_items_in_scope(doc, rows, code_field, category_index=None):
+    """
+    Physical or virtual rows compared by the count: the selected category / subcategory, or all of
+    them. Both sides are filtered with the item → category index, so a scanned item of another
+    category is not reported as missing from the virtual inventory. Unknown codes are always kept.
+    """
+    category = doc.get("category")
+    subcategory = doc.get("subcategory")
+    if not category and not subcategory:
+        return rows
+    if category_index is None:
+        category_index = get_count_category_index(doc)
+    return filter_category_scope(rows, code_field, category_index, category, subcategory)
+
+
+def apply_difference_plan(doc, plan, codes=None):
+    """
+    Applies a `plan_differences` result to the 'inv_difference' / 'inv_difference_sn' rows of `doc`
+    (not saved). With `codes`, the plan only covers those item codes and the serial rows of any
+    other product are left untouched.
+    """
+    # Existing rows are updated in place ('confirmed' is kept), new differences appended,
+    # and rows that are no longer a difference dropped
+    for existing_row_diff, values in plan["updates"]:
+        existing_row_diff.update(values)
+
+    removed_rows = {id(row) for row in plan["removals"]}
+    kept_rows = [row for row in doc.get("inv_difference") if id(row) not in removed_rows]
+    doc.set("inv_difference", kept_rows)
+    for values in plan["inserts"]:
+        doc.append("inv_difference", {**values, "confirmed": 0})
+
+    # --- inv_difference_sn: serial numbers of every difference, PRESERVING existing 'to_do' statuses ---
+    # Rows flagged 'Remove/Add' are kept while their item is a difference, the other ones are expected from the virtual serial numbers
+    difference_codes = [item_code for item_code, _values in plan["differences"]]
+    # Serial scan mode: scanned serial numbers are unflagged, the unscanned ones of an item short of stock flagged
+    serial_scan = doc.get("serial_scan")
+    scanned = get_scanned_serial_numbers(doc.name, difference_codes) if serial_scan else set()
+    existing_to_do_map = {}
+    flagged_keys = set()
+
+    def recomputed(sn_key):
+        return (codes is None or sn_key[0] in codes) and sn_key[0] and sn_key[1]
+
+    for sn_row in doc.get("inv_difference_sn"):
+        sn_key = (sn_row.get("product"), sn_row.get("serial_number"))
+        if recomputed(sn_key):
+            existing_to_do_map[sn_key] = sn_row.get("to_do")
+            if sn_row.get("to_do") == REMOVE_ADD and sn_key[0] in difference_codes and sn_key not in scanned:
+                flagged_keys.add(sn_key)
+
+    # Serial numbers of the differing items only, read from the 'Inv_virtual_sn' index built at import
+    serials = get_serial_numbers(doc.name, difference_codes)
+    expected_to_do = {}
+    for item_code, values in plan["differences"]:
+        short = serial_scan and values["difference_qty"] < 0
+        for sn in serials.get(item_code, ()):
+            sn_key = (item_code, sn)
+            if sn_key not in flagged_keys and sn_key not in expected_to_do:
+                expected_to_do[sn_key] = serial_to_do(existing_to_do_map.get(sn_key), sn_key in scanned, short and sn_key not in scanned)
+
+    # Existing rows still expected with the same 'to_do' are kept as they are (same name and idx), so the
+    # compare delta only carries the serial rows that changed
+    final_inv_difference_sn_rows = []
+    seen_sn_keys = set()
+    for sn_row in doc.get("inv_difference_sn"):
+        sn_key = (sn_row.get("product"), sn_row.get("serial_number"))
+        if not recomputed(sn_key):
+            if codes is not None and sn_key[0] not in codes:
+                final_inv_difference_sn_rows.append(sn_row) # Product not recomputed by this plan
+                seen_sn_keys.add(sn_key)
+        elif sn_key in seen_sn_keys:
+            continue # Duplicate row
+        elif sn_key in flagged_keys or (sn_key in expected_to_do and (sn_row.get("to_do") or None) == (expected_to_do[sn_key] or None)):
+            final_inv_difference_sn_rows.append(sn_row)
+            seen_sn_keys.add(sn_key)
+
+    new_sn_rows = []
+    for (item_code, sn), to_do in expected_to_do.items():
+        if (item_code, sn) in seen_sn_keys:
+            continue
+        new_sn_row = {"product": item_code, "serial_number": sn}
+        if to_do:
+            new_sn_row["to_do"] = to_do
+        new_sn_rows.append(new_sn_row)
+
+    doc.set("inv_difference_sn", final_inv_difference_sn_rows)
+    for new_sn_row in new_sn_rows:
+        doc.append("inv_difference_sn", new_sn_row)
+
+    # Kept rows keep their position, new rows go after the last one (like the 'Database' compare)
+    for table_field in ("inv_difference", "inv_difference_sn"):
+        next_idx = max((row.idx or 0 for row in doc.get(table_field) if not row.is_new()), default=0) + 1
+        for row in doc.get(table_field):
+            if row.is_new():
+                row.idx = next_idx
+                next_idx += 1
+
+
+def live_differences_enabled():
+    return bool(frappe.db.get_single_value("Inventory Count Settings", "live_differences"))
+
+
+def refresh_live_differences(parent_name, codes):
+    """
+    Recomputes the difference rows (and serial rows) of `codes` in the current transaction when
+    'Live Differences' is enabled. Returns the delta of the rows of these codes (see
+    `get_difference_delta`), or None when 'Live Differences' is disabled.
+    """
+    if not live_differences_enabled():
+        return None
+    codes = list({normalize_code(code) for code in codes} - {""})
+    rows_before = get_difference_rows(parent_name, codes)
+    compare_in_database(parent_name, codes)
+    return get_difference_delta(rows_before, get_difference_rows(parent_name, codes))
+
+
+# Difference tables sent to the form: (child doctype, item code field, fields) per table field
+DIFFERENCE_TABLES = {
+    "inv_difference": ("Inv_difference", "item_code", ["name", "idx", "item_code", "description", "physical_qty", "virtual_qty", "difference_reason", "recid", "confirmed", "response"]),
+    "inv_difference_sn": ("Inv_difference_sn", "product", ["name", "idx", "product", "serial_number", "to_do"]),
+}
+
+
+def get_difference_rows(parent_name, codes=None):
+    """{table field: {row name: row}} of the difference and serial rows of `parent_name`, only those of the normalized `codes` when given."""
+    rows = {}
+    for table_field, (child_doctype, code_field, fields) in DIFFERENCE_TABLES.items():
+        filters = {"parent": parent_name, "parenttype": "Inventory Count", "parentfield": table_field}
+        if codes is not None:
+            filters[code_field] = ("in", codes or [""])
+        rows[table_field] = {row.name: row for row in frappe.get_all(child_doctype, filters=filters, fields=fields, order_by="idx")}
+    return rows
+
+
+def get_difference_delta(rows_before, rows_after):
+    """Added and updated rows, and names of the removed rows, of each difference table between two `get_difference_rows` results."""
+    delta = {}
+    for table_field, after in rows_after.items():
+        before = rows_before.get(table_field, {})
+        delta[table_field] = {
+            "added": [row for name, row in after.items() if name not in before],
+            "updated": [row for name, row in after.items() if name in before and row != before[name]],
+            "removed": [name for name in before if name not in after],
+        }
+    return delta
+
+
+def publish_differences(parent_name, delta):
+    """Sends the difference and serial rows changed by a scan (`refresh_live_differences` delta) to the open forms of `parent_name` only."""
+    if not any(changes["added"] or changes["updated"] or changes["removed"] for changes in delta.values()):
+        return
+    frappe.publish_realtime("inv_difference_refresh", {"parent": parent_name, "delta": delta}, doctype="Inventory Count", docname=parent_name)
+
+
 @frappe.whitelist()
-def compare_child_tables(doc_name):
+def compare_child_tables(doc_name, before_submit=False):
     """
     Compares 'inv_physical_items' and 'inv_virtual_items' child tables
     of an 'Inventory Count' document and populates/updates the 'inv_difference' child table
@@ -235,409 +682,85 @@ def compare_child_tables(doc_name):
     Additionally, if a product added to 'inv_difference' has serial numbers in
     'inv_virtual_items', these serial numbers will populate/update the 'inv_difference_sn'
     child table, linking them to the 'item_code' and PRESERVING existing 'to_do' statuses.
-    """
-    try:
-        doc = frappe.get_doc("Inventory Count", doc_name)
 
-        main_category_filter = doc.get("category")
-        sub_category_filter = doc.get("subcategory")
-        
-        all_physical_items = doc.get("inv_physical_items")
-        all_virtual_items = doc.get("inv_virtual_items")
-
-        existing_confirmed_status_map = {
-            row.item_code: row.confirmed
-            for row in doc.get("inv_difference") if row.item_code
-        }
+    Returns the added/updated/removed rows of both difference tables ('delta') and the new
+    'modified' of the document ('version'), so the form patches its grids instead of reloading.
 
-        # Map to store SNList for virtual items (normalize item_id to uppercase for consistent matching)
-        virtual_item_snlist_map = {
-            row.get("item_id", "").upper(): row.get("snlist")
-            for row in all_virtual_items if row.get("item_id")
-        }
-
-        physical_items_to_compare = []
-        virtual_items_to_compare = []
-
-        # Decide which items to compare based on the category filter
-        if sub_category_filter:
-            # Filter virtual items by the selected category
-            virtual_items_to_compare = [
-                item for item in all_virtual_items if item.category == main_category_filter and item.subcatname == sub_category_filter
-            ]
-            
-            # If physical items should *also* be filtered by category:
-            physical_items_to_compare = [
-                item for item in all_physical_items 
-            ]
-        elif main_category_filter:
-            # Filter virtual items by the selected category
-            virtual_items_to_compare = [
-                item for item in all_virtual_items if item.category == main_category_filter
-            ]
-            
-            # If physical items should *also* be filtered by category:
-            physical_items_to_compare = [
-                item for item in all_physical_items 
-            ]
-        else:
-            physical_items_to_compare = all_physical_items
-            virtual_items_to_compare = all_virtual_items
-
-        # Build maps from the *filtered* or *all* lists (normalize item_id to uppercase for consistent matching)
-        physical_items_map = {
-            row.get("code", "").upper(): int(row.get("qty") or 0)
-            for row in physical_items_to_compare
-        }
-        virtual_items_map = {
-            row.get("item_id", "").upper(): int(row.get("qty") or 0)
-            for row in virtual_items_to_compare
-        }
-        description_virtual_item_map = {
-            row.get("item_id", "").upper(): row.get("shortdescription")
-            for row in virtual_items_to_compare
-        }
-        description_physical_item_map = {
-            row.get("code", "").upper(): row.get("description")
-            for row in physical_items_to_compare
-        }
-        virtual_item_Recid = {
-            row.get("item_id", "").upper(): row.get("iv_item_recid")
-            for row in all_virtual_items if row.get("item_id")
-        }
+    `before_submit`: with 'Live Differences' the differences are already current, nothing is
+    compared ('skipped') and the form only checks that they are confirmed.
+    """
+    if cint(before_submit) and live_differences_enabled():
+        frappe.has_permission("Inventory Count", "read", doc_name, throw=True)
+        return {"status": "success", "skipped": True}
 
-        # Keep track of item_codes that were updated/created in inv_difference
-        processed_difference_items = set()
+    frappe.has_permission("Inventory Count", "write", doc_name, throw=True) # Before any difference row is read
+    try:
+        rows_before = get_difference_rows(doc_name)
 
-        # --- MODIFIED: Store existing inv_difference_sn data to preserve 'to_do' ---
-        # Also, pre-populate the final list with existing rows that have a 'Remove/Add' status
-        existing_sn_data_map = {} 
-        preserved_sn_rows = []
-        preserved_sn_keys = set() # To ensure uniqueness for preserved rows
+        # Database mode: grouped SQL + bulk upsert of tabInv_difference, the document is never loaded
+        if frappe.db.get_single_value("Inventory Count Settings", "compare_mode") == "Database":
+            stats = compare_in_database(doc_name)
+            frappe.db.commit() # Ensure changes are persisted in the database
 
-        for sn_row in doc.get("inv_difference_sn"):
-            sn_key = (sn_row.get("product"), sn_row.get("serial_number"))
-            if sn_key[0] and sn_key[1]: # Ensure both product and serial_number exist
-                existing_sn_data_map[sn_key] = {
-                    "to_do": sn_row.get("to_do"),
-                    # Add any other fields you want to preserve here
-                }
-                # If an existing row has 'Add/Remove' status, we want to explicitly preserve it
-                if sn_row.get("to_do") == "Remove/Add":
-                    preserved_sn_rows.append(sn_row)
-                    preserved_sn_keys.add(sn_key) # Add to set to mark as seen
-
-        # Initialize updated_inv_difference_sn. We will populate this with new differences.
-        updated_inv_difference_sn_new_entries = []
-        # --- END MODIFIED ---
-
-        # --- Upsert logic for discrepancies based on Physical Items (from the items selected for comparison) ---
-        for item_code, physical_qty_int in physical_items_map.items():
-            if item_code is None:
-                continue
+            return {
+                "status": "success",
+                "message": _("Comparaison des inventaires terminée avec succès."),
+                "stats": stats,
+                "delta": get_difference_delta(rows_before, get_difference_rows(doc_name)),
+                "version": frappe.db.get_value("Inventory Count", doc_name, "modified"),
+            }
 
-            description_physical = description_physical_item_map.get(item_code, "")
-            virtual_qty_int = virtual_items_map.get(item_code, 0) # Will be 0 if not found in virtual_items_to_compare
+        doc = frappe.get_doc("Inventory Count", doc_name)
 
-            difference = physical_qty_int - virtual_qty_int
+        all_physical_items = doc.get("inv_physical_items")
+        all_virtual_items = doc.get("inv_virtual_items")
 
-            RecID_from_virtual = virtual_item_Recid.get(item_code, "")
-            
-            if difference != 0:
-                # Try to find an existing row in inv_difference for this item_code
-                existing_row_diff = None
-                for row in doc.get("inv_difference"):
-                    if row.item_code == item_code:
-                        existing_row_diff = row
-                        break
-
-                if existing_row_diff:
-                    # Update existing row
-                    existing_row_diff.description = description_physical
-                    existing_row_diff.physical_qty = physical_qty_int
-                    existing_row_diff.virtual_qty = virtual_qty_int
-                    existing_row_diff.difference_qty = difference
-                    existing_row_diff.difference_reason = _("Quantité différente") if item_code in virtual_items_map else _("Article non trouvé dans l'inventaire virtuel")
-                    existing_row_diff.recid = RecID_from_virtual
-                else:
-                    # Create new row
-                    new_diff_item = doc.append("inv_difference", {})
-                    new_diff_item.item_code = item_code
-                    new_diff_item.description = description_physical
-                    new_diff_item.physical_qty = physical_qty_int
-                    new_diff_item.virtual_qty = virtual_qty_int
-                    new_diff_item.difference_qty = difference
-                    new_diff_item.difference_reason = _("Quantité différente") if item_code in virtual_items_map else _("Article non trouvé dans l'inventaire virtuel")
-                    new_diff_item.confirmed = existing_confirmed_status_map.get(item_code, 0)
-                    new_diff_item.recid = RecID_from_virtual
-
-                processed_difference_items.add(item_code)
-
-                # --- MODIFIED: Populate/Update inv_difference_sn for this item ---
-                snlist_str = virtual_item_snlist_map.get(item_code)
-                if snlist_str and snlist_str != '0':
-                    serial_numbers = [sn.strip() for sn in snlist_str.split(',') if sn.strip()]
-                    for sn in serial_numbers:
-                        sn_key = (item_code, sn)
-                        
-                        # Create a new row data (will be added to the temporary list)
-                        new_sn_row_data = {
-                            "product": item_code,
-                            "serial_number": sn
-                        }
-                        
-                        # Preserve 'to_do' status if it existed for this serial
-                        if sn_key in existing_sn_data_map:
-                            new_sn_row_data["to_do"] = existing_sn_data_map[sn_key]["to_do"]
-                        # else: new_sn_row_data["to_do"] will default to whatever its default value is (usually None/empty)
-                        
-                        updated_inv_difference_sn_new_entries.append(new_sn_row_data)
-                # --- END MODIFIED ---
-
-
-        # --- Upsert logic for items only in Virtual Items (from the items selected for comparison, not in Physical's selected list) ---
-        for item_code, virtual_qty_int in virtual_items_map.items():
-            if item_code is None or item_code in physical_items_map:
-                continue # Skip if already processed or exists in physical items map
-
-            description_virtual = description_virtual_item_map.get(item_code, "")
-            difference = 0 - virtual_qty_int # Item found in virtual but not in physical (in this comparison scope)
-
-            physical_qty_int = physical_items_map.get(item_code, 0)
-
-            RecID_from_virtual = virtual_item_Recid.get(item_code, "")
-
-            # Always iterate to find existing row now, as we don't clear the table
-            existing_row_diff = None
-            for row in doc.get("inv_difference"):
-                if row.item_code == item_code:
-                    existing_row_diff = row
-                    break
-
-            if existing_row_diff:
-                # Update existing row
-                existing_row_diff.description = description_virtual
-                existing_row_diff.physical_qty = physical_qty_int
-                existing_row_diff.virtual_qty = virtual_qty_int
-                existing_row_diff.difference_qty = difference
-                existing_row_diff.difference_reason = _("Article non trouvé dans l'inventaire physique")
-                existing_row_diff.recid = RecID_from_virtual
-                # existing_row_diff.confirmed is implicitly preserved here
-            else:
-                # Create new row
-                new_diff_item = doc.append("inv_difference", {})
-                new_diff_item.item_code = item_code
-                new_diff_item.description = description_virtual
-                new_diff_item.physical_qty = physical_qty_int
-                new_diff_item.virtual_qty = virtual_qty_int
-                new_diff_item.difference_qty = difference
-                new_diff_item.difference_reason = _("Article non trouvé dans l'inventaire physique")
-                new_diff_item.confirmed = existing_confirmed_status_map.get(item_code, 0)
-                new_diff_item.recid = RecID_from_virtual
-                
-            processed_difference_items.add(item_code)
-
-            # --- MODIFIED: Populate/Update inv_difference_sn for this item ---
-            snlist_str = virtual_item_snlist_map.get(item_code)
-            if snlist_str and snlist_str != '0':
-                serial_numbers = [sn.strip() for sn in snlist_str.split(',') if sn.strip()]
-                for sn in serial_numbers:
-                    sn_key = (item_code, sn)
-                    
-                    new_sn_row_data = {
-                        "product": item_code,
-                        "serial_number": sn
-                    }
-                    
-                    if sn_key in existing_sn_data_map:
-                        new_sn_row_data["to_do"] = existing_sn_data_map[sn_key]["to_do"]
-                    
-                    updated_inv_difference_sn_new_entries.append(new_sn_row_data)
-            # --- END MODIFIED ---
-
-
-        # --- Clean up inv_difference table: remove items that are no longer differences ---
-        items_to_remove = []
-        for i in range(len(doc.get("inv_difference")) - 1, -1, -1):
-            row = doc.get("inv_difference")[i]
-            # Remove if the item_code was NOT processed in this run (meaning it's no longer a difference)
-            # Or if it was processed, but now has zero difference (and thus shouldn't be in the table)
-            if row.item_code not in processed_difference_items:
-                items_to_remove.append(row)
-            elif row.item_code in processed_difference_items:
-                current_physical_qty = physical_items_map.get(row.item_code, 0)
-                current_virtual_qty = virtual_items_map.get(row.item_code, 0)
-                if (current_physical_qty - current_virtual_qty) == 0: # If difference is now 0
-                    if (row.item_code in virtual_items_map and 
-                        physical_items_map.get(row.item_code, 0) == virtual_items_map.get(row.item_code, 0)):
-                        items_to_remove.append(row)
-                    elif row.item_code not in virtual_items_map and physical_items_map.get(row.item_code, 0) == 0:
-                        items_to_remove.append(row)
-
-        for row_to_remove in items_to_remove:
-            doc.remove(row_to_remove)
-
-        # --- MODIFIED: Final update of inv_difference_sn ---
-        # Start the final list with all previously preserved 'Add/Remove' rows
-        final_inv_difference_sn_rows = list(preserved_sn_rows)
-        seen_sn_keys = set(preserved_sn_keys) # Initialize with keys of preserved rows
-
-        # Now, iterate through the newly generated entries and add them if not already present (preserved)
-        for sn_data in updated_inv_difference_sn_new_entries:
-            sn_key = (sn_data["product"], sn_data["serial_number"])
-            if sn_key not in seen_sn_keys: # Only add if not already processed in this run (or preserved)
-                # Create a new Frappe child table row
-                new_row = doc.append("inv_difference_sn", sn_data)
-                final_inv_difference_sn_rows.append(new_row)
-                seen_sn_keys.add(sn_key)
+        # Both sides are limited to the count's category / subcategory with the item → category index
+        category_index = get_count_category_index(doc) if doc.get("category") or doc.get("subcategory") else None
+        physical_items_in_scope = get_items_in_scope(doc, all_physical_items, "code", category_index)
+        virtual_items_in_scope = get_items_in_scope(doc, all_virtual_items, "item_id", category_index)
 
-        # Set the entire child table with the new list of rows.
-        doc.set("inv_difference_sn", final_inv_difference_sn_rows)
-        # --- END MODIFIED ---
+        # Every table is indexed once by normalized item code, then each code is classified in a single pass
+        plan = plan_differences(physical_items_in_scope, virtual_items_in_scope, doc.get("inv_difference"), all_virtual_items)
+        apply_difference_plan(doc, plan)
 
         doc.save()
         frappe.db.commit() # Ensure changes are persisted in the database
 
-        frappe.publish_realtime("Compare Complete")
-        return {"status": "success", "message": _("Comparaison des inventaires terminée avec succès.")}
+        return {
+            "status": "success",
+            "message": _("Comparaison des inventaires terminée avec succès."),
+            "delta": get_difference_delta(rows_before, get_difference_rows(doc_name)),
+            "version": doc.modified,
+        }
 
     except Exception as e:
         frappe.db.rollback() # Rollback changes in case of error
         error_trace = traceback.format_exc()
         frappe.log_error(error_trace, "Error in compare_child_tables")
-        print(error_trace) # Also print to bench console for immediate visibility during dev
-        frappe.msgprint(_(f"Une erreur est survenue lors de la comparaison des tables : {e}"), title=_("Erreur d'importation"), indicator='red')
+        frappe.msgprint(_("Une erreur est survenue lors de la comparaison des tables : {0}").format(e), title=_("Erreur d'importation"), indicator='red')
         frappe.publish_realtime("Compare Error", {"message": str(e), "traceback": error_trace})
         return {"status": "error", "message": str(e)}
 
 
 # Get ConnectWise Warehouses and Bins
 @frappe.whitelist()
-def get_connectwise_warehouses_and_bins(): 
+def get_connectwise_warehouses_and_bins():
     """
-    Fetches warehouses and their bins from ConnectWise API.
-    Assumes ConnectWise API credentials are set in 'Inventory Count Settings'.
+    Active warehouses and their bins, from the local mirror (see `warehouse_sync`) with the seconds
+    since its last sync: {"warehouses", "bins_map", "cache_age"}. The form links to the mirror
+    directly, this is kept for the other callers.
     """
-    try:
-        settings_doc = frappe.get_single('Inventory Count Settings')
+    frappe.has_permission("CW Warehouse", "read", throw=True)
+    if not frappe.db.exists("CW Warehouse", {"inactive": 0}):
+        enqueue_sync(full=True) # First use, before the scheduler ran: filled in the background
 
-        connectwise_api_url = settings_doc.connectwise_api_url 
-        connectwise_company_id = settings_doc.connectwise_company_id 
-        public_key = settings_doc.connectwise_public_key
-        private_key = settings_doc.get_password('connectwise_private_key')
-        client_id = settings_doc.connectwise_client_id
+    warehouses = frappe.get_all("CW Warehouse", filters={"inactive": 0}, pluck="name", order_by="name")
+    bins_map = {warehouse: [] for warehouse in warehouses}
+    for bin_row in frappe.get_all("CW Warehouse Bin", filters={"inactive": 0, "warehouse": ["in", warehouses or [""]]}, fields=["name", "warehouse"], order_by="name"):
+        bins_map[bin_row.warehouse].append(bin_row.name)
 
-        if not all([connectwise_api_url, connectwise_company_id, public_key, private_key, client_id]):
-            frappe.throw(
-                _("ConnectWise API credentials (API URL, Company ID, Public Key, Private Key, Client ID) are not fully set in 'Inventory Count Settings'. Please configure them."),
-                title=_("API Credentials Missing")
-            )
-        # ConnectWise API requires Base64 encoded keys for authentication
-        credentials = f"{connectwise_company_id}+{public_key}:{private_key}"
-        encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-
-        headers = {
-            "Accept": f"application/vnd.connectwise.com+json; version={cwAPI_version}",
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {encoded_credentials}",
-            "clientID": client_id # Client ID is often also required as a separate header
-        }
-
-        warehouses_endpoint = f"{connectwise_api_url}/procurement/warehouses"
-        warehouse_bins_base_endpoint = f"{connectwise_api_url}/procurement/warehouseBins" # Base for individual bin lookups or filtered lists
-
-        # Fetch Warehouses
-        frappe.log_error(f"ConnectWise: Fetching warehouses from: {warehouses_endpoint}", "ConnectWise Debug")
-        response = requests.get(warehouses_endpoint, headers=headers, timeout=15)
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        
-        connectwise_warehouses_data = None
-        try:
-            connectwise_warehouses_data = response.json()
-            frappe.log_error(f"ConnectWise: Warehouses data type: {type(connectwise_warehouses_data)}", "ConnectWise Debug")
-            frappe.log_error(f"ConnectWise: Warehouses JSON (first 500 chars): {json.dumps(connectwise_warehouses_data, indent=2)[:500]}...", "ConnectWise Debug")
-        except json.JSONDecodeError:
-            frappe.log_error(f"ConnectWise: Warehouses API did not return valid JSON. Raw text: {response.text}", "ConnectWise JSON Error")
-            frappe.throw(f"ConnectWise API did not return valid JSON for warehouses. Response: {response.text[:200]}...", title="API Response Error")
-            return {"warehouses": [], "bins_map": {}}
-
-        # Ensure top-level is a list before iterating
-        if not isinstance(connectwise_warehouses_data, list):
-            frappe.log_error(f"ConnectWise: Unexpected top-level data type for warehouses. Expected list, got {type(connectwise_warehouses_data)}.", "ConnectWise Data Type Error")
-            frappe.throw("ConnectWise API returned unexpected format for warehouses. Expected a list.", title="API Format Error")
-            return {"warehouses": [], "bins_map": {}}
-
-
-        warehouse_options = []
-        warehouse_bin_options_map = {} # Maps warehouse name to a list of its bins
-
-        for warehouse in connectwise_warehouses_data:
-            if not isinstance(warehouse, dict):
-                frappe.log_error(f"ConnectWise: Skipping non-dictionary item in warehouse list: {warehouse}", "ConnectWise List Item Error")
-                continue # Skip if an item isn't a dictionary
-
-            warehouse_name = warehouse.get("name") + " (" + str(warehouse.get("id")) + ")"
-            warehouse_id = warehouse.get("id") # Keep ID if you need to fetch bins separately
-
-            if warehouse_name:
-                warehouse_options.append(warehouse_name)
-
-                #  Making a separate call for bins for each warehouse 
-                if warehouse_id:
-                    # Construct the URL for a specific bin
-                    bins_endpoint = f"{warehouse_bins_base_endpoint}?pagesize=1000&conditions=warehouse/id={warehouse_id} AND inactiveFlag=false" 
-                    
-                    #frappe.log_error(f"ConnectWise: Fetching bins for '{warehouse_name}' from: {bins_endpoint}", "ConnectWise Debug")
-                    bins_response = requests.get(bins_endpoint, headers=headers, timeout=15)
-                    bins_response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-                    
-                    connectwise_bins_data = None
-                    try:
-                        connectwise_bins_data = bins_response.json()
-                        #frappe.log_error(f"ConnectWise: Bins data type for '{warehouse_name}': {type(connectwise_bins_data)}", "ConnectWise Debug")
-                        #frappe.log_error(f"ConnectWise: Bins JSON for '{warehouse_name}' (first 500 chars): {json.dumps(connectwise_bins_data, indent=2)[:500]}...", "ConnectWise Debug")
-                    except json.JSONDecodeError:
-                        frappe.log_error(f"ConnectWise: Bins API for '{warehouse_name}' did not return valid JSON. Raw text: {bins_response.text}", "ConnectWise Bins JSON Error")
-                        warehouse_bin_options_map[warehouse_name] = []
-                        continue # Skip to next warehouse if JSON is invalid
-
-                    # --- Handle the response for bins ---
-                    # Based on your provided JSON, if the API returns a list of bins (most likely for a filtered query),
-                    # or if it returns a single dictionary (like your example), we handle both.
-                    if isinstance(connectwise_bins_data, list):
-                        # If it's a list (which is ideal for 'bins for a warehouse')
-                        warehouse_bin_options_map[warehouse_name] = [
-                            bin_item.get("name") + " (" + str(bin_item.get("id")) + ")"
-                            for bin_item in connectwise_bins_data 
-                            if isinstance(bin_item, dict) and bin_item.get("name")
-                        ]
-                    elif isinstance(connectwise_bins_data, dict):
-                        # If it's a single dictionary (like your example 'Magasin' bin)
-                        bin_name = connectwise_bins_data.get("name") 
-                        if bin_name:
-                            warehouse_bin_options_map[warehouse_name] = [bin_name] # Store as a list containing one bin
-                        else:
-                            warehouse_bin_options_map[warehouse_name] = []
-                    else:
-                        frappe.log_error(f"ConnectWise: Bins API for '{warehouse_name}' returned unexpected data type: {type(connectwise_bins_data)}. Expected list or dict.", "ConnectWise Bins Data Type Error")
-                        warehouse_bin_options_map[warehouse_name] = []
-                else:
-                    warehouse_bin_options_map[warehouse_name] = [] # No warehouse_id, no bins fetched
-
-
-        # Return a dictionary with unique warehouse names and the map of bins
-        # Ensure 'warehouse_bin_options_map' is returned, not 'connectwise_bins_data'
-        return {
-            "warehouses": sorted(list(set(warehouse_options))), # Ensure uniqueness and sort
-            "bins_map": warehouse_bin_options_map
-        }
-
-    except requests.exceptions.HTTPError as e:
-        frappe.throw(f"Error fetching data from ConnectWise API: {e.response.status_code} - {e.response.text}", title="ConnectWise API Error")
-    except requests.exceptions.RequestException as e:
-        frappe.throw(f"Connection error to ConnectWise API: {e}", title="Network Error")
-    except Exception as e:
-        frappe.throw(f"An unexpected error occurred while fetching ConnectWise data: {e}", title="API Fetch Error")
+    return {"warehouses": warehouses, "bins_map": bins_map, "cache_age": get_sync_age()}
 
 
 @frappe.whitelist()
@@ -651,50 +774,20 @@ def push_confirmed_differences_to_connectwise(doc_name):
     Note: This version does NOT include Warehouse ID or Warehouse Bin ID in the adjustment details payload.
     Please verify ConnectWise API requirements for these fields.
     """
-    print("Pushing confirmed differences to ConnectWise...") # For debugging purposes, can be removed later
     try:
         doc = frappe.get_doc("Inventory Count", doc_name)
         
-        # --- Retrieve ConnectWise API Credentials from Inventory Count Settings ---
-        settings_doc = frappe.get_single('Inventory Count Settings')
-
-        connectwise_api_url = settings_doc.connectwise_api_url
-        connectwise_company_id = settings_doc.connectwise_company_id
-        public_key = settings_doc.connectwise_public_key
-        private_key = settings_doc.get_password('connectwise_private_key')
-        client_id = settings_doc.connectwise_client_id
-
-        # Validate core API credentials from settings
-        if not all([connectwise_api_url, connectwise_company_id, public_key, private_key, client_id]):
-            frappe.throw(
-                _("ConnectWise API credentials (API URL, Company ID, Public Key, Private Key, Client ID) are not fully set in 'Inventory Count Settings'. Please configure them."),
-                title=_("API Credentials Missing")
-            )
-        
-        credentials = f"{connectwise_company_id}+{public_key}:{private_key}"
-        encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-
-        # --- Construct ConnectWise API Headers ---
-        headers = {
-            "Accept": "application/vnd.connectwise.com+json; version=2025.8", # Consider updating API version if ConnectWise has newer ones
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {encoded_credentials}",
-            "clientId": client_id
-        }
-        # --- End Credential Retrieval & Header Construction ---
+        # --- ConnectWise client: credentials from Inventory Count Settings, pooled keep-alive session ---
+        client = get_client()
 
         
         # --- Retrieve relevant fields directly from the Inventory Count document (doc) ---
         cw_adjustment_type_name_for_item = doc.adjustment_type # Correction type name from Frappe
         reason = doc.reason # This is a free text field for the reason of the inventory count
 
-        try:
-            # Use regex for a robust way to find the number in the last parentheses
-            matchwh = re.search(r'\((\d+)\)$', doc.warehouse)
-            warehouse_id = int(matchwh.group(1))
-            matchwhbin = re.search(r'\((\d+)\)$', doc.warehouse_bin)
-            bin_id = int(matchwhbin.group(1))
-        except (AttributeError, TypeError, IndexError):
+        # ConnectWise ids of the linked 'CW Warehouse' / 'CW Warehouse Bin'
+        warehouse_id, bin_id = get_warehouse_ids(doc)
+        if not warehouse_id or not bin_id:
             frappe.throw(
                 _("Warehouse is not set or is in an invalid format in the Inventory Count document."),
                 title=_("Missing or Invalid Warehouse")
@@ -721,14 +814,19 @@ def push_confirmed_differences_to_connectwise(doc_name):
                 if item_code not in item_serials_map:
                     item_serials_map[item_code] = []
                 item_serials_map[item_code].append(serial_number)
-            
+
+        # Serial numbers ConnectWise has in stock for the pushed items, from the 'Inv_virtual_sn' index
+        virtual_serials_map = {
+            item_code: set(serials)
+            for item_code, serials in get_serial_numbers(doc.name, list(item_serials_map)).items()
+        }
         
 
         failed_pushes = []
         adjustment_details_list = [] # This will hold all individual item adjustments
 
         # --- ConnectWise API Endpoints ---
-        adjustments_api_endpoint = f"{connectwise_api_url}/procurement/adjustments"
+        adjustments_api_endpoint = "/procurement/adjustments"
 
         
         for item in confirmed_items_to_push:
@@ -752,6 +850,18 @@ def push_confirmed_differences_to_connectwise(doc_name):
                 }
 
                 serials_for_item = item_serials_map.get(item.item_code)
+                if serials_for_item:
+                    # A removed serial must be in stock and an added one must not be: checked with set operations
+                    virtual_serials = virtual_serials_map.get(item.item_code, set())
+                    if difference_qty < 0:
+                        conflicting_serials = set(serials_for_item) - virtual_serials
+                    else:
+                        conflicting_serials = set(serials_for_item) & virtual_serials
+                    if conflicting_serials:
+                        error_detail = _("Serial numbers do not match the virtual inventory: {0}").format(", ".join(sorted(conflicting_serials)))
+                        item.db_set('response', error_detail[:140])
+                        failed_pushes.append(f"'{item.item_code}': {error_detail}")
+                        continue
 
                 # --- Logic Branching ---
                 # Case 1: Negative difference AND there are serial numbers selected for removal.
@@ -811,14 +921,14 @@ def push_confirmed_differences_to_connectwise(doc_name):
 
         try:
             # Step 1: Create the main inventory adjustment (uncommented this part)
-            response = requests.post(adjustments_api_endpoint, headers=headers, data=json.dumps(main_adjustment_payload, ensure_ascii=False).encode('utf-8'), timeout=60)
+            response = client.post(adjustments_api_endpoint, label="create_adjustment", data=json.dumps(main_adjustment_payload, ensure_ascii=False).encode('utf-8'), timeout=60)
             response.raise_for_status() # Raise an exception for bad status codes
 
             parentId = response.json().get('id') # Get the ID of the created adjustment
 
             # Step 2: Iterate and send each adjustment detail individually
             for detail in adjustment_details_list:
-                adjustments_details_api_endpoint = f"{connectwise_api_url}/procurement/adjustments/{parentId}/details"
+                adjustments_details_api_endpoint = f"/procurement/adjustments/{parentId}/details"
 
                 # --- ADDED: Find the original Frappe item row using 'recid' ---
                 frappe_item_row = next((r for r in doc.get("inv_difference") 
@@ -826,7 +936,7 @@ def push_confirmed_differences_to_connectwise(doc_name):
 
                 try:
                     response_details = None
-                    details_response = requests.post(adjustments_details_api_endpoint, headers=headers, data=json.dumps(detail, ensure_ascii=False).encode('utf-8'), timeout=60)
+                    details_response = client.post(adjustments_details_api_endpoint, label="adjustment_detail", data=json.dumps(detail, ensure_ascii=False).encode('utf-8'), timeout=60)
                     try:
                         # Tente de convertir la réponse en JSON
                         response_details = details_response.json()
@@ -890,8 +1000,8 @@ def push_confirmed_differences_to_connectwise(doc_name):
                             order_by="creation"
                         )
                 if parentId:
-                    adjustments_delete_api_endpoint = f"{connectwise_api_url}/procurement/adjustments/{parentId}"
-                    response = requests.delete(adjustments_delete_api_endpoint, headers=headers, timeout=60)
+                    adjustments_delete_api_endpoint = f"/procurement/adjustments/{parentId}"
+                    response = client.delete(adjustments_delete_api_endpoint, label="delete_adjustment", timeout=60)
                 return {"status": "partial_success", "message": final_message, "items": refreshed, "docname": doc.name}
             else:
                 return {"status": "success", "message": final_message}
@@ -899,7 +1009,7 @@ def push_confirmed_differences_to_connectwise(doc_name):
             error_detail = f"Consolidated request to ConnectWise timed out after preparing {len(adjustment_details_list)} items."
            
             failed_pushes.append(f"Consolidated Push: {error_detail}")
-            print(error_detail) # Print to console for immediate visibility during dev
+            frappe.log_error(error_detail, "ConnectWise Push Error") # Internal log, not for translation
             return {"status": "error", "message": error_detail, "debug": json.dumps(detail) if detail else "No detail available"}
         except requests.exceptions.RequestException as req_err:
             error_detail = f"Failed to push consolidated adjustment: {req_err}"
@@ -911,12 +1021,12 @@ def push_confirmed_differences_to_connectwise(doc_name):
                 except json.JSONDecodeError:
                     error_detail += f" - CW Raw Response: {req_err.response.text}"
             failed_pushes.append(f"Consolidated Push: {error_detail}")
-            print(error_detail) # Print to console for immediate visibility during dev
+            frappe.log_error(error_detail, "ConnectWise Push Error") # Internal log, not for translation
             return {"status": "error", "message": error_detail, "debug": json.dumps(detail) if detail else "No detail available"}
         except Exception as push_err:
             error_detail = f"An unexpected error occurred during consolidated push: {push_err}"
             failed_pushes.append(f"Consolidated Push: {error_detail}")
-            print(error_detail) # Print to console for immediate visibility during dev
+            frappe.log_error(error_detail, "ConnectWise Push Error") # Internal log, not for translation
             return {"status": "error", "message": error_detail, "debug": json.dumps(detail) if detail else "No detail available"}  
     
     except frappe.exceptions.ValidationError:
@@ -928,60 +1038,24 @@ def push_confirmed_differences_to_connectwise(doc_name):
     
 @frappe.whitelist()
 def get_connectwise_type_adjustments():
+    """Adjustment types from the reference cache (see `reference_cache`) with its age in seconds: {"types", "cache_age"}."""
+    types, cache_age = get_reference_data("type_adjustments")
+    return {"types": types, "cache_age": cache_age}
+
+
+def fetch_connectwise_type_adjustments():
     """
     Fetches available inventory adjustment types from the ConnectWise API.
     Assumes ConnectWise API credentials are set in 'Inventory Count Settings'.
     """
     try:
-        # Retrieve ConnectWise API credentials from 'Inventory Count Settings'
-        settings_doc = frappe.get_single('Inventory Count Settings')
-
-        connectwise_api_url = settings_doc.connectwise_api_url
-        connectwise_company_id = settings_doc.connectwise_company_id
-        public_key = settings_doc.connectwise_public_key
-        private_key = settings_doc.get_password('connectwise_private_key')
-        client_id = settings_doc.connectwise_client_id
-
-        # Validate that all required credentials are set
-        if not all([connectwise_api_url, connectwise_company_id, public_key, private_key, client_id]):
-            frappe.throw(
-                _("ConnectWise API credentials (API URL, Company ID, Public Key, Private Key, Client ID) are not fully set in 'Inventory Count Settings'. Please configure them."),
-                title=_("API Credentials Missing")
-            )
-
-        # ConnectWise API requires Base64 encoded keys for authentication
-        credentials = f"{connectwise_company_id}+{public_key}:{private_key}"
-        encoded_credentials = base64.b64encode(credentials.encode('utf-8')).decode('utf-8')
-
-        # Set up HTTP headers for the ConnectWise API request
-        headers = {
-            "Accept": f"application/vnd.connectwise.com+json; version={cwAPI_version}", # Specify API version
-            "Content-Type": "application/json",
-            "Authorization": f"Basic {encoded_credentials}", # Basic authentication with encoded credentials
-            "clientID": client_id # Client ID as a separate header
-        }
-
-        type_adjustments_endpoint = f"{connectwise_api_url}/procurement/adjustments/types"
+        # ConnectWise client with the credentials of 'Inventory Count Settings' (pooled keep-alive session)
+        client = get_client()
 
-        # Make the HTTP GET request to the ConnectWise API
-        response = requests.get(type_adjustments_endpoint, headers=headers, timeout=15)
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
+        type_adjustments_endpoint = "/procurement/adjustments/types"
 
-        connectwise_type_adjustments_data = None
-        try:
-            # Attempt to parse the JSON response
-            connectwise_type_adjustments_data = response.json()
-        except json.JSONDecodeError:
-            # Log and throw an error if the response is not valid JSON
-            frappe.log_error(f"ConnectWise: Type Adjustments API did not return valid JSON. Raw text: {response.text}", "ConnectWise JSON Error")
-            frappe.throw(f"ConnectWise API did not return valid JSON for type adjustments. Response: {response.text[:200]}...", title="API Response Error")
-            return [] # Return an empty list on JSON error
-
-        # Ensure the top-level data structure is a list (as expected for collections of items)
-        if not isinstance(connectwise_type_adjustments_data, list):
-            frappe.log_error(f"ConnectWise: Unexpected top-level data type for type adjustments. Expected list, got {type(connectwise_type_adjustments_data)}.", "ConnectWise Data Type Error")
-            frappe.throw("ConnectWise API returned unexpected format for type adjustments. Expected a list.", title="API Format Error")
-            return [] # Return empty list on unexpected format
+        # Every page of the collection, read lazily (one page in memory at a time)
+        connectwise_type_adjustments_data = iter_records(client, type_adjustments_endpoint, "adjustment_types")
 
         # Extract 'identifier' from each adjustment type dictionary
         type_adjustment_options = [
@@ -993,6 +1067,10 @@ def get_connectwise_type_adjustments():
         # Return a sorted list of unique type adjustment names
         return sorted(list(set(type_adjustment_options)))
 
+    except ValueError as e:
+        # Invalid JSON, or not a list of records
+        frappe.log_error(f"ConnectWise: Unexpected type adjustments response: {e}", "ConnectWise Data Type Error")
+        frappe.throw(f"ConnectWise API returned an unexpected response for type adjustments: {e}", title="API Format Error")
     except requests.exceptions.HTTPError as e:
         # Handle HTTP errors (e.g., 404 Not Found, 401 Unauthorized)
         frappe.log_error(f"ConnectWise API HTTP Error fetching type adjustments: {e.response.status_code} - {e.response.text} - URL: {e.request.url}", "ConnectWise API Error")
@@ -1007,17 +1085,26 @@ def get_connectwise_type_adjustments():
         frappe.throw(f"An unexpected error occurred while fetching ConnectWise type adjustments: {e}", title="API Fetch Error")
 
 
+def check_scan_allowed(parent_name):
+    """
+    Scans write their rows with raw SQL, outside `Document.save`: the write permission and the draft
+    state of the count are checked here instead. Submitted and cancelled counts take no scan.
+    """
+    frappe.has_permission("Inventory Count", "write", parent_name, throw=True)
+    if parent_name and frappe.db.get_value("Inventory Count", parent_name, "docstatus") != 0:
+        frappe.throw(_("Scans can only be added to a draft Inventory Count."), title=_("Inventory Count Not Draft"))
+
+
 @frappe.whitelist()
-def upsert_physical_item(parent_name, code, qty=1, description='', expected_qty=0):
+def upsert_physical_item(parent_name, code, qty=1, description='', expected_qty=0, serial_number=None):
     """
-    Atomic upsert with duplicate-insert fallback:
+    Atomic scan upsert, one INSERT ... ON DUPLICATE KEY UPDATE backed by the unique (parent, code) index:
     - trim/normalize code
-    - try UPDATE qty = qty + inc
-    - if UPDATE affected 0 rows, try INSERT
-    - if INSERT fails due to duplicate, retry UPDATE once
+    - serial scan mode: record `serial_number` as seen, a serial already scanned is not counted again
+    - insert the row, or add `qty` to the existing one when the code is already counted
     """
     import traceback
-    child_doctype = "Inv_physical_items"
+    check_scan_allowed(parent_name)
     try:
         if not parent_name:
             frappe.throw(_("parent_name is required"))
@@ -1025,93 +1112,173 @@ def upsert_physical_item(parent_name, code, qty=1, description='', expected_qty=
         if not code:
             frappe.throw(_("code is required"))
 
-        # Normalize code to avoid duplicates due to whitespace/case
+        # Strip whitespace only: codes differing in case already share one row through the
+        # case-insensitive unique (parent, code) index, as in the unique_physical_item_codes merge
         code = str(code).strip()
+        inc = cint(qty) if qty not in (None, "") else 1
 
-        try:
-            inc = 1
-        except Exception:
-            inc = 1
+        if serial_number and not record_scanned_serial(parent_name, code, serial_number):
+            return {
+                "status": "duplicate_serial",
+                "message": _("Le numéro de série {0} a déjà été scanné.").format(serial_number),
+            }
 
-        desc_clause = ""
-        expected_clause = ""
-        params = [inc]
+        add_physical_item_quantities(parent_name, [{"code": code, "qty": inc, "description": description, "expected_qty": expected_qty}])
+        live_differences = refresh_live_differences(parent_name, [code]) # Same transaction as the scan
+        frappe.db.commit()
 
-        if description is not None and description != "":
-            desc_clause = ", description = %s"
-            params.append(description)
+        # Only the scanned row goes back to the forms, numbered so they can detect a missed change
+        delta = publish_physical_items_delta(parent_name, [code])
+        if live_differences:
+            publish_differences(parent_name, live_differences)
+        return {"status": "success", **delta}
 
-        if expected_qty is not None and expected_qty != "":
-            expected_clause = ", expected_qty = %s"
-            try:
-                params.append(int(expected_qty))
-            except Exception:
-                params.append(expected_qty)
-
-        # parent params
-        params.extend([parent_name, "inv_physical_items", "Inventory Count", code])
-
-        update_sql = """
-            UPDATE `tabInv_physical_items`
-            SET qty = COALESCE(qty, 0) + %s
-            {desc_clause}
-            {expected_clause}
-            WHERE parent=%s AND parentfield=%s AND parenttype=%s AND code=%s
-        """.format(desc_clause=desc_clause, expected_clause=expected_clause)
-
-        # 1) Try atomic UPDATE
-        frappe.db.sql(update_sql, params)
-        # Get number of affected rows for the previous UPDATE
-        affected = 0
-        try:
-            affected = int(frappe.db.sql("SELECT ROW_COUNT()")[0][0])
-        except Exception:
-            affected = 0
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(traceback.format_exc(), "upsert_physical_item")
+        raise
 
-        # 2) If no row updated, try to INSERT (may race => catch duplicate and retry UPDATE)
-        if affected == 0:
-            try:
-                child = frappe.get_doc({
-                    "doctype": child_doctype,
-                    "parent": parent_name,
-                    "parentfield": "inv_physical_items",
-                    "parenttype": "Inventory Count",
-                    "code": code,
-                    "qty": inc,
-                    "description": description,
-                    "expected_qty": expected_qty
-                })
-                child.insert(ignore_permissions=True)
-                frappe.db.commit()
-            except Exception as e:
-                # If another transaction inserted the same row concurrently, retry the atomic UPDATE once
-                err_str = str(e)
-                if "Duplicate entry" in err_str or "Duplicate" in err_str:
-                    try:
-                        # Retry UPDATE to increment the qty
-                        frappe.db.sql(update_sql, params)
-                        frappe.db.commit()
-                    except Exception as e2:
-                        frappe.db.rollback()
-                        frappe.log_error(traceback.format_exc(), "upsert_physical_item retry update failed")
-                        raise
-                else:
-                    frappe.db.rollback()
-                    frappe.log_error(traceback.format_exc(), "upsert_physical_item insert failed")
-                    raise
-        else:
-            # UPDATE succeeded, commit
-            frappe.db.commit()
 
-        # Refresh and return rows
-        refreshed = frappe.get_all(child_doctype,
-                                  filters={"parent": parent_name, "parentfield": "inv_physical_items", "parenttype": "Inventory Count"},
-                                  fields=["name", "code", "description", "qty", "expected_qty"],
-                                  order_by="creation")
-        frappe.publish_realtime('inv_physical_items_refresh', {"items": refreshed, "parent": parent_name})
-        return {"status": "success", "items": refreshed}
+@frappe.whitelist()
+def upsert_physical_items(parent_name, scans):
+    """
+    Batch scan upsert: `scans` is the form's scan queue, a list of {code, qty, timestamp} (plus
+    description, expected_qty and serial_numbers). Repeated codes are merged, serial numbers already
+    scanned are not counted again, then every code is applied with one multi-row upsert and the
+    batch is committed once. Returns the changed rows with their sequence number and the duplicate
+    serial numbers.
+    """
+    import traceback
+    check_scan_allowed(parent_name)
+    try:
+        if not parent_name:
+            frappe.throw(_("parent_name is required"))
+
+        scans = coalesce_scans(frappe.parse_json(scans) or [])
+        duplicate_serials = []
+        for scan in scans:
+            for serial_number in scan["serial_numbers"]:
+                if not record_scanned_serial(parent_name, scan["code"], serial_number):
+                    duplicate_serials.append(serial_number)
+                    scan["qty"] -= 1 # Counted by an earlier scan
+        scans = [scan for scan in scans if scan["qty"]]
+        codes = [scan["code"] for scan in scans]
+
+        add_physical_item_quantities(parent_name, scans)
+        live_differences = refresh_live_differences(parent_name, codes) if codes else None
+        frappe.db.commit()
+
+        if codes:
+            delta = publish_physical_items_delta(parent_name, codes)
+        else:
+            delta = {"sequence": current_scan_sequence(parent_name), "rows": []} # Nothing changed
+        if live_differences:
+            publish_differences(parent_name, live_differences)
+        return {"status": "success", **delta, "duplicate_serials": duplicate_serials}
 
     except Exception:
         frappe.db.rollback()
-        frappe.log_error(traceback.format_exc(), "upsert_physical_item")
-        raise
\ No newline at end of file
+        frappe.log_error(traceback.format_exc(), "upsert_physical_items")
+        raise
+
+
+def add_physical_item_quantities(parent_name, scans):
+    """
+    Adds the quantity of each scan ({code, qty, description, expected_qty}) to its 'Inv_physical_items'
+    row in one INSERT ... SELECT ... ON DUPLICATE KEY UPDATE: codes not counted yet get a new row at
+    the end of the table, the others have their quantity increased (and description / expected
+    quantity refreshed when given). Concurrent scans of the same code cannot create a second row.
+    """
+    if not scans:
+        return
+
+    timestamp = now()
+    user = frappe.session.user
+    scan_rows = []
+    values = [parent_name, timestamp, timestamp, user, user] # In placeholder order: row columns, scans, last idx
+    for position, scan in enumerate(scans, start=1):
+        expected_qty = scan.get("expected_qty")
+        scan_rows.append("SELECT %s AS name, %s AS position, %s AS code, %s AS qty, %s AS description, %s AS expected_qty")
+        values.extend([
+            frappe.generate_hash(length=10),
+            position,
+            scan["code"],
+            scan["qty"],
+            scan.get("description") or "",
+            cint(expected_qty) if expected_qty not in (None, "") else None,
+        ])
+    values.append(parent_name)
+
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabInv_physical_items`
+            (name, parent, parentfield, parenttype, idx, creation, modified, owner, modified_by, code, qty, description, expected_qty)
+        SELECT scans.name, %s, 'inv_physical_items', 'Inventory Count', last_row.idx + scans.position, %s, %s, %s, %s,
+            scans.code, scans.qty, scans.description, scans.expected_qty
+        FROM ({" UNION ALL ".join(scan_rows)}) AS scans
+        CROSS JOIN (
+            SELECT COALESCE(MAX(idx), 0) AS idx FROM `tabInv_physical_items`
+            WHERE parent=%s AND parenttype='Inventory Count' AND parentfield='inv_physical_items'
+        ) AS last_row
+        ON DUPLICATE KEY UPDATE
+            qty = COALESCE(`tabInv_physical_items`.qty, 0) + VALUES(qty),
+            description = IF(VALUES(description) != '', VALUES(description), `tabInv_physical_items`.description),
+            expected_qty = COALESCE(VALUES(expected_qty), `tabInv_physical_items`.expected_qty),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by)
+        """,
+        values,
+    )
+
+
+def get_physical_items(parent_name, codes=None):
+    filters = {"parent": parent_name, "parentfield": "inv_physical_items", "parenttype": "Inventory Count"}
+    if codes is not None:
+        filters["code"] = ("in", codes) # Unique (parent, code) index
+    return frappe.get_all("Inv_physical_items",
+                          filters=filters,
+                          fields=["name", "idx", "code", "description", "qty", "expected_qty"],
+                          order_by="creation")
+
+
+# Sequence number of the scan deltas of a count, incremented after each committed scan.
+# A form applies delta n + 1 on top of delta n and reloads the table when it sees a gap.
+SCAN_SEQUENCE_KEY = "inv_count:scan_sequence:"
+
+
+def next_scan_sequence(parent_name):
+    return frappe.cache.incr(frappe.cache.make_key(f"{SCAN_SEQUENCE_KEY}{parent_name}"))
+
+
+def current_scan_sequence(parent_name):
+    return int(frappe.cache.get(frappe.cache.make_key(f"{SCAN_SEQUENCE_KEY}{parent_name}")) or 0)
+
+
+def publish_physical_items_delta(parent_name, codes):
+    """
+    Publishes the committed 'Inv_physical_items' rows of `codes` to the forms of `parent_name` with the
+    next sequence number, and returns {"sequence", "rows"}. The rows are read after the number is
+    taken, so a higher number never carries older quantities.
+    """
+    sequence = next_scan_sequence(parent_name)
+    delta = {"sequence": sequence, "rows": get_physical_items(parent_name, codes)}
+    frappe.publish_realtime("inv_physical_items_delta", {"parent": parent_name, **delta}, doctype="Inventory Count", docname=parent_name)
+    return delta
+
+
+@frappe.whitelist()
+def get_physical_items_state(inventory_count_name):
+    """Full 'Inv_physical_items' table with the sequence number it is current with, for a form that missed a delta."""
+    frappe.has_permission("Inventory Count", "read", inventory_count_name, throw=True)
+    sequence = current_scan_sequence(inventory_count_name) # Read first: the rows can only be newer
+    return {"sequence": sequence, "items": get_physical_items(inventory_count_name)}
+
+
+@frappe.whitelist()
+def get_serial_number_index(inventory_count_name):
+    """
+    Serial numbers of the snapshot for the form's serial scan mode: [[item_id, serial_number, scanned], ...].
+    The form turns them into a serial → item hash map, so resolving a scan stays constant-time.
+    """
+    frappe.has_permission("Inventory Count", "read", inventory_count_name, throw=True)
+    return {"serials": [[item_id, serial_number, cint(scanned)] for item_id, serial_number, scanned in get_serial_index(inventory_count_name)]}
@@ -1,9 +1,33 @@
 # Copyright (c) 2025, Microtec and Contributors
 # See license.txt
 
-# import frappe
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import frappe
+import pandas as pd
 from frappe.tests import IntegrationTestCase, UnitTestCase
 
+from inv_count.inventory_count.db_compare import compare_in_database
+from inv_count.inventory_count.difference_engine import plan_differences
+from inv_count.inventory_count.doctype.inventory_count import inventory_count as inventory_count_module
+from inv_count.inventory_count.doctype.inventory_count.inventory_count import get_difference_delta
+from inv_count.inventory_count.scan_batch import coalesce_scans
+from inv_count.inventory_count.serial_scan import record_scanned_serial
+from inv_count.inventory_count.snapshot_cache import (
+	get_cached_snapshot,
+	set_cached_snapshot,
+	snapshot_cache_key,
+)
+from inv_count.inventory_count.virtual_import import (
+	bulk_import_virtual_items,
+	delta_import_virtual_items,
+	get_serial_numbers,
+	stream_import_virtual_items,
+)
+from inv_count.patches.v0_0 import convert_virtual_item_numbers
+from inv_count.tests.utils import make_inventory_count, make_snapshot_frame
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
@@ -12,13 +36,124 @@ EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 
 
+def scan_concurrently(inventory_count_name, scanners, scans, codes, batch_size=1):
+	"""
+	`scanners` threads, each with its own site connection like a counter's phone, make `scans` scans
+	over `codes` shared codes, `batch_size` scans per request. Returns the number of requests sent.
+	"""
+	from inv_count.inventory_count.doctype.inventory_count.inventory_count import (
+		upsert_physical_item,
+		upsert_physical_items,
+	)
+
+	site, user = frappe.local.site, frappe.session.user
+
+	def scanner(seed):
+		frappe.init(site=site)
+		frappe.connect()
+		frappe.set_user(user)
+		frappe.flags.mute_messages = True
+		requests_sent = 0
+		try:
+			for sent in range(0, scans, batch_size):
+				batch = [
+					{"code": f"SCAN-{(seed + sent + i) % codes}", "qty": 1, "timestamp": time.time()}
+					for i in range(min(batch_size, scans - sent))
+				]
+				if batch_size == 1:
+					upsert_physical_item(inventory_count_name, batch[0]["code"], qty=1)
+				else:
+					upsert_physical_items(inventory_count_name, batch)
+				requests_sent += 1
+		finally:
+			frappe.destroy()
+		return requests_sent
+
+	with ThreadPoolExecutor(max_workers=scanners) as executor:
+		return sum(executor.map(scanner, range(scanners)))
+
+
+def get_counted_items(inventory_count_name):
+	"""(code, qty) of the physical items of `inventory_count_name`, by code."""
+	return frappe.get_all(
+		"Inv_physical_items",
+		filters={"parent": inventory_count_name},
+		fields=["code", "qty"],
+		order_by="code",
+	)
+
+
 class UnitTestInventoryCount(UnitTestCase):
 	"""
 	Unit tests for InventoryCount.
 	Use this class for testing individual functions and methods.
 	"""
 
-	pass
+	def test_coalesce_scans(self):
+		scans = [
+			{"code": "item-2", "qty": 1, "timestamp": 1002},
+			{"code": " Item-1 ", "qty": 1, "timestamp": 1001, "description": "First"},
+			{
+				"code": "ITEM-1",
+				"qty": 2,
+				"timestamp": 1003,
+				"description": "Second",
+				"serial_numbers": ["SN1"],
+			},
+			{"code": "ITEM-2", "timestamp": 1004, "expected_qty": 5},
+			{"code": "  ", "qty": 1, "timestamp": 1005},
+		]
+
+		merged = coalesce_scans(scans)
+
+		self.assertEqual([(row["code"], row["qty"]) for row in merged], [("Item-1", 3), ("item-2", 2)])
+		self.assertEqual(merged[0]["description"], "Second")
+		self.assertEqual(merged[0]["serial_numbers"], ["SN1"])
+		self.assertEqual(merged[1]["expected_qty"], 5)
+
+	def test_difference_delta(self):
+		"""Added, updated and removed rows of both difference tables, unchanged rows are left out."""
+		rows_before = {
+			"inv_difference": {
+				"d1": {"name": "d1", "item_code": "A", "physical_qty": 1},
+				"d2": {"name": "d2", "item_code": "B", "physical_qty": 1},
+				"d3": {"name": "d3", "item_code": "C", "physical_qty": 1},
+			},
+			"inv_difference_sn": {
+				"s1": {"name": "s1", "product": "A", "serial_number": "SN-1", "to_do": None},
+				"s2": {"name": "s2", "product": "B", "serial_number": "SN-2", "to_do": None},
+			},
+		}
+		rows_after = {
+			"inv_difference": {
+				"d1": {"name": "d1", "item_code": "A", "physical_qty": 2},
+				"d3": {"name": "d3", "item_code": "C", "physical_qty": 1},
+				"d4": {"name": "d4", "item_code": "D", "physical_qty": 1},
+			},
+			"inv_difference_sn": {
+				"s1": {"name": "s1", "product": "A", "serial_number": "SN-1", "to_do": "Remove/Add"},
+				"s3": {"name": "s3", "product": "D", "serial_number": "SN-3", "to_do": None},
+			},
+		}
+
+		delta = get_difference_delta(rows_before, rows_after)
+
+		self.assertEqual(
+			delta["inv_difference"],
+			{
+				"added": [rows_after["inv_difference"]["d4"]],
+				"updated": [rows_after["inv_difference"]["d1"]],
+				"removed": ["d2"],
+			},
+		)
+		self.assertEqual(
+			delta["inv_difference_sn"],
+			{
+				"added": [rows_after["inv_difference_sn"]["s3"]],
+				"updated": [rows_after["inv_difference_sn"]["s1"]],
+				"removed": ["s2"],
+			},
+		)
 
 
 class IntegrationTestInventoryCount(IntegrationTestCase):
@@ -27,4 +162,474 @@ class IntegrationTestInventoryCount(IntegrationTestCase):
 	Use this class for testing interactions between multiple components.
 	"""
 
-	pass
+	def test_concurrent_scans_counted_once(self):
+		"""Concurrent scanners on the same codes: every scan is counted exactly once, in one row per code."""
+		inventory_count = make_inventory_count("Concurrent scans")
+		frappe.db.commit()  # The scanners use their own connections
+
+		try:
+			scan_concurrently(inventory_count.name, scanners=4, scans=50, codes=10)
+			counted = get_counted_items(inventory_count.name)
+		finally:
+			frappe.delete_doc("Inventory Count", inventory_count.name, force=True)
+			frappe.db.commit()
+
+		# One row per code, never a duplicate
+		self.assertEqual([row.code for row in counted], [f"SCAN-{i}" for i in range(10)])
+		self.assertEqual(sum(row.qty for row in counted), 200)
+
+	def test_batched_scans_counted_once(self):
+		"""Scans sent in batches, as by the form's scan queue: same counted quantity, fewer requests."""
+		inventory_count = make_inventory_count("Batched scans")
+		frappe.db.commit()
+
+		try:
+			requests_sent = scan_concurrently(
+				inventory_count.name, scanners=4, scans=50, codes=10, batch_size=10
+			)
+			counted = get_counted_items(inventory_count.name)
+		finally:
+			frappe.delete_doc("Inventory Count", inventory_count.name, force=True)
+			frappe.db.commit()
+
+		self.assertEqual(requests_sent, 20)
+		self.assertEqual([row.code for row in counted], [f"SCAN-{i}" for i in range(10)])
+		self.assertEqual(sum(row.qty for row in counted), 200)
+
+	def test_bulk_import_replaces_snapshot(self):
+		"""The bulk mode replaces the stored snapshot: rows in order, computed quantities and parsed serial numbers."""
+		inventory_count = make_inventory_count(
+			"Bulk import", inv_virtual_items=[{"item_id": "OLD", "qty": 9, "iv_item_recid": "99"}]
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		df = make_snapshot_frame(3)
+		df["SNList"] = ["SN1, SN2", None, "SN3"]
+
+		stats = bulk_import_virtual_items(inventory_count.name, df, None, "QOH+PickedNotShipped")
+
+		self.assertEqual((stats["rows"], stats["serial_numbers"]), (3, 3))
+		rows = frappe.get_all(
+			"Inv_virtual_items",
+			filters={"parent": inventory_count.name},
+			fields=["idx", "item_id", "qty", "row_hash"],
+			order_by="idx",
+		)
+		self.assertEqual(
+			[(row.idx, row.item_id, row.qty) for row in rows],
+			[(1, "ITEM-0", 0), (2, "ITEM-1", 2), (3, "ITEM-2", 2)],
+		)
+		self.assertTrue(all(row.row_hash for row in rows))
+		self.assertEqual(
+			get_serial_numbers(inventory_count.name, ["ITEM-0", "ITEM-2"]),
+			{"ITEM-0": ["SN1", "SN2"], "ITEM-2": ["SN3"]},
+		)
+
+	def test_streaming_import_writes_chunk_by_chunk(self):
+		"""Every chunk is written before the next one is read, the catalog only rows come last."""
+		inventory_count = make_inventory_count(
+			"Streaming import", inv_virtual_items=[{"item_id": "OLD", "qty": 9, "iv_item_recid": "99"}]
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		df = make_snapshot_frame(5)
+		df.loc[4, "Item_ID"] = "item-0"
+		df["SNList"] = ["SN1", None, None, None, "SN1"]  # Same pair in the first and last chunk
+		item_list = pd.DataFrame(
+			{"IV_Item_RecID": [2, 9], "Item_ID": ["item-1", "catalog-9"], "subCatName": ["Sub 2", "Sub 9"]}
+		)
+		stored_rows = []
+
+		def progress(stage, **details):
+			if stage == "write":
+				stored_rows.append(frappe.db.count("Inv_virtual_items", {"parent": inventory_count.name}))
+
+		chunks = (df.iloc[start : start + 2] for start in range(0, len(df), 2))
+		stats = stream_import_virtual_items(inventory_count.name, chunks, item_list, "QOH", 2, progress)
+
+		self.assertEqual(stored_rows, [2, 4, 5])
+		self.assertEqual((stats["rows"], stats["chunks"]), (6, 3))
+		rows = frappe.get_all(
+			"Inv_virtual_items",
+			filters={"parent": inventory_count.name},
+			fields=["idx", "item_id", "subcatname"],
+			order_by="idx",
+		)
+		self.assertEqual([row.idx for row in rows], [1, 2, 3, 4, 5, 6])
+		self.assertEqual(
+			[row.item_id for row in rows], ["ITEM-0", "ITEM-1", "ITEM-2", "ITEM-3", "ITEM-0", "CATALOG-9"]
+		)
+		self.assertEqual(rows[1].subcatname, "Sub 2")
+		self.assertEqual(frappe.db.count("Inv_virtual_sn", {"parent": inventory_count.name}), 1)
+
+	def test_import_job_progress_and_cancel(self):
+		"""The import is queued once per count, publishes its stages and stops at the next one once cancelled."""
+		inventory_count = make_inventory_count("Background import")
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		cancel_key = inventory_count_module._import_cancel_key(inventory_count.name)
+
+		inventory_count_module.cancel_import(inventory_count.name)  # Left over from an earlier run
+		with patch("frappe.enqueue") as enqueue:
+			enqueue.return_value.id = "import-job"
+			self.assertEqual(
+				inventory_count_module.enqueue_import(inventory_count.name),
+				{"status": "queued", "job_id": "import-job"},
+			)
+			enqueue.return_value = None  # Deduplicated: the first job is still running
+			self.assertEqual(
+				inventory_count_module.enqueue_import(inventory_count.name)["status"], "already_running"
+			)
+		self.assertEqual(
+			enqueue.call_args.kwargs["job_id"], f"inventory_count_import::{inventory_count.name}"
+		)
+		self.assertTrue(enqueue.call_args.kwargs["deduplicate"])
+		self.assertIsNone(frappe.cache.get_value(cancel_key))
+
+		with patch("frappe.publish_realtime") as publish:
+			inventory_count_module.publish_import_progress(inventory_count.name, "map", rows=3)
+		payload = publish.call_args.args[1]
+		self.assertEqual((payload["stage"], payload["progress"], payload["rows"]), ("map", 35, 3))
+
+		inventory_count_module.cancel_import(inventory_count.name)
+		with self.assertRaises(inventory_count_module.ImportCancelled):
+			inventory_count_module.publish_import_progress(inventory_count.name, "write")
+
+		with (
+			patch.object(
+				inventory_count_module,
+				"import_data_with_pandas",
+				return_value={"status": "cancelled", "message": "Import cancelled by the user."},
+			),
+			patch.object(inventory_count_module, "_publish_import_event") as publish_event,
+		):
+			inventory_count_module.run_import_job(inventory_count.name)
+		self.assertEqual(publish_event.call_args.args, (inventory_count.name, "cancelled"))
+		self.assertIsNone(frappe.cache.get_value(cancel_key))  # The next import is not cancelled
+
+	def test_delta_import_writes_changed_rows_only(self):
+		"""Re-importing an unchanged bin writes nothing, a changed row keeps its name and idx, a vanished one is deleted."""
+		inventory_count = make_inventory_count("Delta import")
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		df = make_snapshot_frame(4)
+		df["SNList"] = [None, "SN1", None, "SN4"]
+		bulk_import_virtual_items(inventory_count.name, df, None, "QOH")
+
+		def get_rows():
+			return {
+				row.iv_item_recid: row
+				for row in frappe.get_all(
+					"Inv_virtual_items",
+					filters={"parent": inventory_count.name},
+					fields=["name", "idx", "iv_item_recid", "qty"],
+				)
+			}
+
+		before = get_rows()
+		with (
+			patch.object(frappe.db, "bulk_insert", wraps=frappe.db.bulk_insert) as bulk_insert,
+			patch.object(frappe.db, "delete", wraps=frappe.db.delete) as delete,
+			patch.object(frappe.db, "set_value", wraps=frappe.db.set_value) as set_value,
+		):
+			stats = delta_import_virtual_items(inventory_count.name, df, None, "QOH")
+		self.assertEqual(
+			(stats["inserted"], stats["updated"], stats["deleted"], stats["unchanged"]), (0, 0, 0, 4)
+		)
+		bulk_insert.assert_not_called()
+		delete.assert_not_called()
+		set_value.assert_not_called()
+
+		changed = df.copy()
+		changed.loc[1, "QOH"] = 10
+		changed = pd.concat([changed.drop(index=3), make_snapshot_frame(5).iloc[[4]]])
+		stats = delta_import_virtual_items(inventory_count.name, changed, None, "QOH")
+
+		self.assertEqual(
+			(stats["inserted"], stats["updated"], stats["deleted"], stats["unchanged"]), (1, 1, 1, 2)
+		)
+		self.assertEqual((stats["serial_numbers_inserted"], stats["serial_numbers_deleted"]), (0, 1))
+		after = get_rows()
+		self.assertEqual(sorted(after), ["1", "2", "3", "5"])
+		self.assertEqual(
+			(after["2"].name, after["2"].idx, after["2"].qty), (before["2"].name, before["2"].idx, 10)
+		)
+		self.assertEqual(after["1"].name, before["1"].name)
+		self.assertEqual(after["5"].idx, 5)
+
+	def test_virtual_item_numbers_patch(self):
+		"""Text quantities and costs become numbers MariaDB converts in strict mode: empty, NULL and text give 0."""
+		values = ["", None, "3.0", " 2.5 ", "abc", "-4", "1,234.00", "+3", ".5", "1e3", "2,5"]
+		source = " UNION ALL ".join(f"SELECT %(value_{i})s AS stored_value" for i in range(len(values)))
+		rows = frappe.db.sql(
+			f"""
+			SELECT
+				{convert_virtual_item_numbers.clean_number("stored_value", integer=True)},
+				{convert_virtual_item_numbers.clean_number("stored_value", integer=False)}
+			FROM ({source}) AS snapshot
+			""",
+			{
+				"pattern": convert_virtual_item_numbers.NUMBER_PATTERN,
+				**{f"value_{i}": value for i, value in enumerate(values)},
+			},
+		)
+		self.assertEqual(
+			[row[0] for row in rows], ["0", "0", "3", "3", "0", "-4", "1234", "3", "1", "1000", "0"]
+		)
+		self.assertEqual([float(row[1]) for row in rows], [0, 0, 3, 2.5, 0, -4, 1234, 3, 0.5, 1000, 0])
+
+	def test_scanned_serial_counted_once(self):
+		"""A serial number scanned again, alone or in a batch, is a no-op: its item is counted once."""
+		inventory_count = make_inventory_count(
+			"Serial scan", inv_virtual_items=[{"item_id": "S", "qty": 2, "iv_item_recid": "51"}]
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+
+		with patch.object(frappe.db, "commit"), patch("frappe.publish_realtime"):
+			first = inventory_count_module.upsert_physical_item(
+				inventory_count.name, "s ", serial_number="SN-1"
+			)
+			again = inventory_count_module.upsert_physical_item(
+				inventory_count.name, "S", serial_number=" SN-1 "
+			)
+			batch = inventory_count_module.upsert_physical_items(
+				inventory_count.name,
+				[{"code": "S", "qty": 2, "timestamp": 1, "serial_numbers": ["SN-1", "SN-2"]}],
+			)
+
+		self.assertEqual((first["status"], again["status"]), ("success", "duplicate_serial"))
+		self.assertEqual(batch["duplicate_serials"], ["SN-1"])
+		self.assertFalse(record_scanned_serial(inventory_count.name, "S", "SN-2"))
+		self.assertEqual(
+			frappe.db.get_value("Inv_physical_items", {"parent": inventory_count.name}, "qty"), 2
+		)
+		scanned = frappe.get_all(
+			"Inv_scanned_sn",
+			filters={"parent": inventory_count.name},
+			fields=["item_id", "serial_number"],
+			order_by="serial_number",
+		)
+		self.assertEqual(
+			[(row.item_id, row.serial_number) for row in scanned], [("S", "SN-1"), ("S", "SN-2")]
+		)
+
+	def test_scans_need_write_permission_on_a_draft(self):
+		"""Both scan endpoints refuse a user without write permission and a submitted count, before any write."""
+		inventory_count = make_inventory_count("Scan checks")
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		scans = [
+			lambda: inventory_count_module.upsert_physical_item(
+				inventory_count.name, "A", serial_number="SN-1"
+			),
+			lambda: inventory_count_module.upsert_physical_items(
+				inventory_count.name, [{"code": "A", "qty": 1, "serial_numbers": ["SN-1"]}]
+			),
+		]
+
+		frappe.set_user("Guest")
+		self.addCleanup(frappe.set_user, "Administrator")
+		for scan in scans:
+			with self.assertRaises(frappe.PermissionError):
+				scan()
+
+		frappe.set_user("Administrator")
+		frappe.db.set_value("Inventory Count", inventory_count.name, "docstatus", 1)
+		self.addCleanup(frappe.db.set_value, "Inventory Count", inventory_count.name, "docstatus", 0)
+		for scan in scans:
+			with self.assertRaises(frappe.ValidationError):
+				scan()
+
+		self.assertFalse(frappe.db.exists("Inv_physical_items", {"parent": inventory_count.name}))
+		self.assertFalse(frappe.db.exists("Inv_scanned_sn", {"parent": inventory_count.name}))
+
+	def test_scan_deltas_are_numbered(self):
+		"""Each committed scan publishes its rows under the next sequence number, the full state carries the current one."""
+		inventory_count = make_inventory_count(
+			"Scan deltas", inv_physical_items=[{"code": "A", "qty": 1}, {"code": "B", "qty": 1}]
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+
+		with patch.object(frappe.db, "commit"), patch("frappe.publish_realtime") as publish:
+			start = inventory_count_module.get_physical_items_state(inventory_count.name)["sequence"]
+			first = inventory_count_module.upsert_physical_item(inventory_count.name, "A")
+			second = inventory_count_module.upsert_physical_items(
+				inventory_count.name,
+				[{"code": "B", "qty": 2, "timestamp": 1}, {"code": "C", "qty": 1, "timestamp": 2}],
+			)
+			nothing_counted = inventory_count_module.upsert_physical_items(inventory_count.name, "[]")
+			state = inventory_count_module.get_physical_items_state(inventory_count.name)
+
+		self.assertEqual([(row.code, row.qty) for row in first["rows"]], [("A", 2)])
+		self.assertEqual(sorted((row.code, row.qty) for row in second["rows"]), [("B", 3), ("C", 1)])
+		self.assertEqual(nothing_counted["rows"], [])
+		self.assertEqual(
+			(first["sequence"], second["sequence"], nothing_counted["sequence"], state["sequence"]),
+			(start + 1, start + 2, start + 2, start + 2),
+		)
+		published = [
+			call.args[1]["sequence"]
+			for call in publish.call_args_list
+			if call.args[0] == "inv_physical_items_delta"
+		]
+		self.assertEqual(published, [start + 1, start + 2])  # No delta without a change
+		self.assertEqual(
+			sorted((row.code, row.qty) for row in state["items"]), [("A", 2), ("B", 3), ("C", 1)]
+		)
+
+	def live_differences(self):
+		"""'Live Differences' turned on for the rest of the test."""
+		patcher = patch.object(inventory_count_module, "live_differences_enabled", return_value=True)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_scan_updates_difference_in_same_transaction(self):
+		"""With live differences, the scanned code's difference row is written before the scan's commit."""
+		self.live_differences()
+		inventory_count = make_inventory_count(
+			"Live scan", inv_virtual_items=[{"item_id": "A", "qty": 2, "iv_item_recid": "11"}]
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+
+		at_commit = []
+
+		def record_difference():
+			at_commit.append(
+				frappe.db.get_value(
+					"Inv_difference",
+					{"parent": inventory_count.name, "item_code": "A"},
+					["physical_qty", "virtual_qty"],
+				)
+			)
+
+		with (
+			patch.object(frappe.db, "commit", side_effect=record_difference),
+			patch.object(inventory_count_module, "publish_differences"),
+		):
+			inventory_count_module.upsert_physical_item(inventory_count.name, "a ", 1)
+
+		self.assertEqual(at_commit, [(1, 2)])
+
+	def test_live_difference_delta_sent_to_its_count_only(self):
+		"""A scan publishes the difference rows of its code only, to the forms of its count."""
+		self.live_differences()
+		inventory_count = make_inventory_count(
+			"Live delta",
+			inv_physical_items=[{"code": "B", "qty": 1}],
+			inv_virtual_items=[
+				{"item_id": "A", "qty": 2, "iv_item_recid": "11"},
+				{"item_id": "B", "qty": 3, "iv_item_recid": "12"},
+			],
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		compare_in_database(inventory_count.name)
+		row_a = frappe.db.get_value("Inv_difference", {"parent": inventory_count.name, "item_code": "A"})
+
+		def scan_a():
+			with patch.object(frappe.db, "commit"), patch("frappe.publish_realtime") as publish:
+				inventory_count_module.upsert_physical_item(inventory_count.name, "a")
+			(published,) = [
+				call for call in publish.call_args_list if call.args[0] == "inv_difference_refresh"
+			]
+			self.assertEqual(
+				(published.kwargs["doctype"], published.kwargs["docname"]),
+				("Inventory Count", inventory_count.name),
+			)
+			return published.args[1]["delta"]["inv_difference"]
+
+		delta = scan_a()
+		self.assertEqual([(row.name, row.physical_qty) for row in delta["updated"]], [(row_a, 1)])
+		self.assertEqual((delta["added"], delta["removed"]), ([], []))  # B is not sent
+
+		delta = scan_a()  # Quantities match: the difference is gone
+		self.assertEqual((delta["added"], delta["updated"], delta["removed"]), ([], [], [row_a]))
+
+	def test_edit_replans_touched_codes_only(self):
+		"""A qty edit and a row deletion re-plan these two codes only, and keep 'confirmed'."""
+		inventory_count = make_inventory_count(
+			"Live edit",
+			inv_physical_items=[{"code": "A", "qty": 1}, {"code": "B", "qty": 1}, {"code": "C", "qty": 1}],
+			inv_virtual_items=[
+				{"item_id": "A", "qty": 5},
+				{"item_id": "B", "qty": 2},
+				{"item_id": "C", "qty": 4},
+			],
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		compare_in_database(inventory_count.name)
+		frappe.db.set_value(
+			"Inv_difference", {"parent": inventory_count.name, "item_code": "A"}, "confirmed", 1
+		)
+
+		self.live_differences()
+		doc = frappe.get_doc("Inventory Count", inventory_count.name)
+		doc.set("inv_physical_items", [row for row in doc.get("inv_physical_items") if row.code != "B"])
+		doc.get("inv_physical_items", {"code": "A"})[0].qty = 3
+		with patch.object(inventory_count_module, "plan_differences", wraps=plan_differences) as plan:
+			doc.save()
+
+		physical_rows, virtual_rows, existing_differences, _lookup_rows = plan.call_args.args
+		self.assertEqual(plan.call_count, 1)
+		self.assertEqual([row.code for row in physical_rows], ["A"])
+		self.assertEqual(sorted(row.item_id for row in virtual_rows), ["A", "B"])
+		self.assertEqual(sorted(row.item_code for row in existing_differences), ["A", "B"])
+
+		differences = {
+			row.item_code: row
+			for row in frappe.get_all(
+				"Inv_difference",
+				filters={"parent": inventory_count.name},
+				fields=["item_code", "physical_qty", "virtual_qty", "confirmed"],
+			)
+		}
+		self.assertEqual((differences["A"].physical_qty, differences["A"].confirmed), (3, 1))
+		self.assertEqual((differences["B"].physical_qty, differences["B"].virtual_qty), (0, 2))
+		self.assertEqual((differences["C"].physical_qty, differences["C"].virtual_qty), (1, 4))
+
+	def test_submit_skips_compare_with_live_differences(self):
+		inventory_count = make_inventory_count("Live submit")
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		self.live_differences()
+
+		with (
+			patch.object(inventory_count_module, "compare_in_database") as database_compare,
+			patch.object(inventory_count_module, "plan_differences") as python_compare,
+		):
+			result = inventory_count_module.compare_child_tables(inventory_count.name, before_submit=1)
+
+		self.assertTrue(result["skipped"])
+		database_compare.assert_not_called()
+		python_compare.assert_not_called()
+
+	def test_import_recomputes_live_differences_once(self):
+		self.live_differences()
+		with (
+			patch.object(
+				inventory_count_module, "import_data_with_pandas", return_value={"status": "success"}
+			),
+			patch.object(inventory_count_module, "compare_in_database") as database_compare,
+			patch.object(inventory_count_module, "_publish_import_event"),
+		):
+			inventory_count_module.run_import_job("IC-LIVE")
+
+		database_compare.assert_called_once_with("IC-LIVE")
+
+	def test_clear_snapshot_cache(self):
+		"""Clearing the cache of a count drops the snapshot its next import would read."""
+		for fieldname, value in {
+			"sql_host": "sql01",
+			"sql_port": "1433",
+			"sql_database": "cw",
+			"sql_query": "SELECT * FROM IV WHERE Warehouse = {warehouse_id} AND Bin = {warehouse_bin_id}",
+			"sql_query_2": "SELECT * FROM Items",
+		}.items():
+			frappe.db.set_single_value("Inventory Count Settings", fieldname, value)
+		inventory_count = make_inventory_count("Snapshot cache")
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+
+		settings_doc = frappe.get_single("Inventory Count Settings")
+		cache_key = snapshot_cache_key(
+			inventory_count_module.get_snapshot_source(settings_doc),
+			*inventory_count_module.get_snapshot_parameters(inventory_count),
+			*inventory_count_module.get_snapshot_queries(settings_doc, inventory_count),
+		)
+		set_cached_snapshot(cache_key, pd.DataFrame({"Item_ID": ["A"]}), pd.DataFrame(), 60)
+
+		inventory_count_module.clear_snapshot_cache(inventory_count.name)
+
+		self.assertIsNone(get_cached_snapshot(cache_key))
@@ -4,6 +4,10 @@
 # import frappe
 from frappe.model.document import Document
 
+from inv_count.inventory_count.reference_cache import clear_reference_cache
+
 
 class InventoryCountSettings(Document):
-	pass
+	def on_update(self):
+		# Credentials or TTL may have changed: ConnectWise reference data is read again
+		clear_reference_cache()
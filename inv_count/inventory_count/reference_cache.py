@@ -0,0 +1,69 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Redis cache of the ConnectWise reference data shown by the Inventory Count form: the adjustment
+types. They change a few times a year but were read live on every form open and every submit.
+Warehouses and bins are mirrored in the database instead (see `warehouse_sync`).
+
+Entries are stored with the time they were fetched and no Redis expiry. An entry younger than the
+'Connectwise Cache TTL' of 'Inventory Count Settings' is served as is; an older one is still served
+at once (stale-while-revalidate) while a background job fetches it again. Only a missing entry is
+fetched during the request. Saving the settings clears every entry.
+"""
+
+import time
+
+import frappe
+from frappe.utils import cint
+
+REFERENCE_CACHE_KEY_PREFIX = "inv_count:connectwise_reference:"
+DEFAULT_TTL = 86400  # Seconds, when the setting is empty
+
+# Reference data name -> function fetching it from ConnectWise
+REFERENCE_FETCHERS = {
+	"type_adjustments": "inv_count.inventory_count.doctype.inventory_count.inventory_count.fetch_connectwise_type_adjustments",
+}
+
+
+def get_cache_ttl():
+	"""TTL of 'Inventory Count Settings', 0 disables the cache."""
+	ttl = frappe.db.get_single_value("Inventory Count Settings", "connectwise_cache_ttl")
+	return DEFAULT_TTL if ttl is None else cint(ttl)
+
+
+def get_reference_data(name):
+	"""
+	Returns (data, cache age in seconds) of the reference data `name`. A stale entry is returned
+	as is and refreshed by a background job, a missing one is fetched now (age 0).
+	"""
+	ttl = get_cache_ttl()
+	if not ttl:
+		return frappe.get_attr(REFERENCE_FETCHERS[name])(), 0
+
+	entry = frappe.cache.get_value(f"{REFERENCE_CACHE_KEY_PREFIX}{name}")
+	if entry is None:
+		return refresh_reference_data(name), 0
+
+	age = max(0, int(time.time() - entry["fetched_at"]))
+	if age >= ttl:
+		frappe.enqueue(
+			"inv_count.inventory_count.reference_cache.refresh_reference_data",
+			queue="short",
+			job_id=f"inv_count_refresh_connectwise_{name}",
+			deduplicate=True,  # One refresh at a time, however many forms are opened meanwhile
+			name=name,
+		)
+	return entry["data"], age
+
+
+def refresh_reference_data(name):
+	"""Fetches the reference data `name` from ConnectWise and caches it. Returns the data."""
+	data = frappe.get_attr(REFERENCE_FETCHERS[name])()
+	frappe.cache.set_value(f"{REFERENCE_CACHE_KEY_PREFIX}{name}", {"data": data, "fetched_at": time.time()})
+	return data
+
+
+def clear_reference_cache():
+	"""Drops every cached reference data, the next request fetches it again."""
+	frappe.cache.delete_keys(REFERENCE_CACHE_KEY_PREFIX)
@@ -0,0 +1,43 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Batched scans of the Inventory Count form.
+
+A barcode scanner can send several codes per second, faster than one request per scan. The form
+queues its scans, merges the repeated codes and sends the queue every few hundred milliseconds to
+`upsert_physical_items`, which applies the whole batch with one multi-row upsert and one commit.
+"""
+
+from frappe.utils import cint, flt
+
+from inv_count.inventory_count.difference_engine import normalize_code
+
+
+def coalesce_scans(scans):
+	"""
+	Merges the scans ({code, qty, timestamp, description, expected_qty, serial_numbers}) of the same
+	item code, in scan order (timestamp, then list order): quantities and serial numbers are added
+	up, the last description / expected quantity given wins and the first casing of the code is kept.
+	Returns one dict per code, codes never scanned before get their rows in first-scan order.
+	"""
+	ordered = sorted(enumerate(scans), key=lambda scan: (flt(scan[1].get("timestamp")), scan[0]))
+	merged = {}
+	for _position, scan in ordered:
+		code = str(scan.get("code") or "").strip()
+		key = normalize_code(code)
+		if not key:
+			continue
+		qty = scan.get("qty")
+		row = merged.setdefault(
+			key, {"code": code, "qty": 0, "description": "", "expected_qty": None, "serial_numbers": []}
+		)
+		row["qty"] += cint(qty) if qty not in (None, "") else 1
+		if scan.get("description"):
+			row["description"] = scan["description"]
+		if scan.get("expected_qty") not in (None, ""):
+			row["expected_qty"] = scan["expected_qty"]
+		row["serial_numbers"].extend(
+			str(sn).strip() for sn in scan.get("serial_numbers") or () if str(sn).strip()
+		)
+	return list(merged.values())
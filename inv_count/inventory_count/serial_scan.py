@@ -0,0 +1,81 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Serial number scan mode of the Inventory Count form.
+
+The form resolves a scanned serial number to its item with a hash map built from the snapshot's
+serial numbers ('Inv_virtual_sn'), then counts the item and records the serial number in
+'Inv_scanned_sn'. The unique (parent, serial_number) index makes a second scan of the same serial
+number a no-op, even from two counters at once. Like 'Inv_virtual_sn', the scanned serial numbers
+are not a table field of the count: a re-import of the snapshot keeps them.
+"""
+
+import frappe
+from frappe.utils import now
+
+from inv_count.inventory_count.difference_engine import normalize_code
+
+parent_doctype = "Inventory Count"
+scanned_serials_doctype = "Inv_scanned_sn"
+scanned_serials_parentfield = "inv_scanned_sn"
+
+
+def get_serial_index(parent_name):
+	"""(item_id, serial_number, scanned) of every serial number of the snapshot, for the form's serial → item map."""
+	return frappe.db.sql(
+		"""
+        SELECT sn.item_id, sn.serial_number, scanned.name IS NOT NULL
+        FROM `tabInv_virtual_sn` sn
+        LEFT JOIN `tabInv_scanned_sn` scanned
+            ON scanned.parent=sn.parent AND scanned.parenttype=sn.parenttype AND scanned.serial_number=sn.serial_number
+        WHERE sn.parent=%s AND sn.parenttype=%s
+        ORDER BY sn.idx
+        """,
+		(parent_name, parent_doctype),
+	)
+
+
+def record_scanned_serial(parent_name, item_id, serial_number):
+	"""Records `serial_number` as seen for `item_id`. Returns False when it was already scanned in this count."""
+	timestamp = now()
+	user = frappe.session.user
+	frappe.db.sql(
+		"""
+        INSERT IGNORE INTO `tabInv_scanned_sn`
+            (name, parent, parentfield, parenttype, idx, creation, modified, owner, modified_by, item_id, serial_number)
+        VALUES (%s, %s, %s, %s, 0, %s, %s, %s, %s, %s, %s)
+        """,
+		(
+			frappe.generate_hash(length=10),
+			parent_name,
+			scanned_serials_parentfield,
+			parent_doctype,
+			timestamp,
+			timestamp,
+			user,
+			user,
+			normalize_code(item_id),
+			str(serial_number).strip(),
+		),
+	)
+	return int(frappe.db.sql("SELECT ROW_COUNT()")[0][0]) > 0
+
+
+def get_scanned_serial_numbers(parent_name, codes):
+	"""(item code, serial number) pairs scanned for the given normalized item `codes`."""
+	if not codes:
+		return set()
+	return set(
+		frappe.db.sql(
+			"""
+            SELECT item_id, serial_number FROM `tabInv_scanned_sn`
+            WHERE parent=%s AND parenttype=%s AND item_id IN %s
+            """,
+			(parent_name, parent_doctype, tuple(codes)),
+		)
+	)
+
+
+def clear_scanned_serial_numbers(parent_name):
+	frappe.db.delete(scanned_serials_doctype, {"parent": parent_name, "parenttype": parent_doctype})
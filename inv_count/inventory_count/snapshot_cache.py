@@ -0,0 +1,84 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Redis cache of the raw SQL Server snapshot shared by every Inventory Count of the same
+server and database, warehouse, bin and valuation date.
+
+The DataFrames returned by 'SQL Query' and 'SQL Query #2' are pickled and zlib-compressed, and the
+compressed bytes stored as they are in Redis (not pickled again by `frappe.cache.set_value`), with
+the TTL set in 'Inventory Count Settings'.
+
+The item → (category, subcatname) index of each imported count is stored next to it, under its
+own key and without TTL: it is rebuilt by every import and read by every compare.
+"""
+
+import hashlib
+import pickle
+import zlib
+
+import frappe
+
+CACHE_KEY_PREFIX = "inv_count:snapshot:"
+CATEGORY_INDEX_KEY_PREFIX = "inv_count:category_index:"
+
+
+def snapshot_cache_key(source, warehouse_id, warehouse_bin_id, valuation_date, *queries):
+	"""
+	Cache key of a snapshot: warehouse, bin, valuation date and a hash of the server and database it
+	is read from (`source`) and of the queries that produce it, with their bound parameters (a count
+	filtered on a category gets its own snapshot). Pointing the settings to another server or
+	database changes every key.
+	"""
+	query_hash = hashlib.sha1(
+		"\n--\n".join([repr(source or ""), *(repr(query or "") for query in queries)]).encode("utf-8")
+	).hexdigest()
+	return f"{CACHE_KEY_PREFIX}{warehouse_id}:{warehouse_bin_id}:{valuation_date}:{query_hash}"
+
+
+def get_cached(cache_key):
+	"""Value stored by `set_cached`, None when missing or expired."""
+	payload = frappe.cache.get(frappe.cache.make_key(cache_key))
+	if not payload:
+		return None
+	try:
+		return pickle.loads(zlib.decompress(payload))
+	except zlib.error:
+		return None  # Stored by an older version through `frappe.cache.set_value`: read again
+
+
+def set_cached(cache_key, value, ttl=None):
+	"""Pickles and compresses `value`, stored as is (expires after `ttl` seconds when given)."""
+	payload = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+	frappe.cache.set(frappe.cache.make_key(cache_key), payload, ex=ttl or None)
+
+
+def get_cached_snapshot(cache_key):
+	"""Returns the cached (df, df_item_list) pair, or None on a cache miss."""
+	return get_cached(cache_key)
+
+
+def set_cached_snapshot(cache_key, df, df_item_list, ttl):
+	"""Stores the (df, df_item_list) pair, compressed, for `ttl` seconds."""
+	set_cached(cache_key, (df, df_item_list), ttl)
+
+
+def clear_cached_snapshots(cache_key=None):
+	"""Deletes one cached snapshot, or all of them when no key is given."""
+	if cache_key:
+		frappe.cache.delete_value(cache_key)
+	else:
+		frappe.cache.delete_keys(CACHE_KEY_PREFIX)
+
+
+def get_category_index(inventory_count_name):
+	"""Returns the item → (category, subcatname) index stored by the last import, or None."""
+	return get_cached(f"{CATEGORY_INDEX_KEY_PREFIX}{inventory_count_name}")
+
+
+def set_category_index(inventory_count_name, category_index):
+	set_cached(f"{CATEGORY_INDEX_KEY_PREFIX}{inventory_count_name}", category_index)
+
+
+def clear_category_index(inventory_count_name):
+	frappe.cache.delete_value(f"{CATEGORY_INDEX_KEY_PREFIX}{inventory_count_name}")
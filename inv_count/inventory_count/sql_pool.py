@@ -0,0 +1,200 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Per-worker pool of warm SQL Server (pyodbc) connections used by the virtual inventory import.
+
+Opening a connection costs a TCP + TLS handshake (`Encrypt=yes`), so idle connections are kept
+per connection string and reused by the next import. A connection idle for more than
+HEALTH_CHECK_AFTER seconds is checked with `SELECT 1` before reuse, and one idle for more than
+IDLE_TIMEOUT seconds is closed. Pools are keyed on the process id too: a forked worker never
+reuses its parent's connections.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+import pyodbc
+
+MAX_IDLE_CONNECTIONS = 4  # Idle connections kept per connection string
+IDLE_TIMEOUT = 300  # Seconds before an idle connection is closed
+HEALTH_CHECK_AFTER = 30  # Seconds of idleness after which a connection is checked before reuse
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# {name} placeholder of the settings queries, with the quotes some queries put around it
+_PLACEHOLDER = re.compile(r"""(['"]?)\{(\w+)\}\1""")
+
+
+class SQLConnectionPool:
+	def __init__(self, conn_str):
+		self.conn_str = conn_str
+		# Never expose the password in stats
+		self.key = hashlib.sha1(conn_str.encode("utf-8")).hexdigest()[:8]
+		self._idle = []  # (connection, released_at) pairs, most recently released last
+		self._lock = threading.Lock()
+		self.stats = {"hits": 0, "misses": 0, "evictions": 0, "failed_health_checks": 0}
+		self.query_timings = {}
+
+	def _take_idle(self):
+		"""Returns a usable idle connection or None, evicting expired and unhealthy ones on the way."""
+		while True:
+			with self._lock:
+				if not self._idle:
+					return None
+				conn, released_at = self._idle.pop()
+			idle_for = time.monotonic() - released_at
+
+			if idle_for > IDLE_TIMEOUT:
+				self._count("evictions")
+				_close_quietly(conn)
+				continue
+
+			if idle_for > HEALTH_CHECK_AFTER:
+				try:
+					conn.cursor().execute("SELECT 1").fetchall()
+				except pyodbc.Error:
+					self._count("failed_health_checks")
+					_close_quietly(conn)
+					continue
+
+			return conn
+
+	def evict_idle(self):
+		"""Closes the connections idle for more than IDLE_TIMEOUT seconds."""
+		now = time.monotonic()
+		with self._lock:
+			expired = [conn for conn, released_at in self._idle if now - released_at > IDLE_TIMEOUT]
+			self._idle = [
+				(conn, released_at) for conn, released_at in self._idle if now - released_at <= IDLE_TIMEOUT
+			]
+		for conn in expired:
+			self._count("evictions")
+			_close_quietly(conn)
+
+	def _count(self, stat):
+		with self._lock:
+			self.stats[stat] += 1
+
+	@contextmanager
+	def connection(self):
+		"""
+		Yields a pooled connection. It goes back to the pool when the block succeeds and is
+		closed when the block raises (the connection state is unknown after an error).
+		"""
+		self.evict_idle()
+		conn = self._take_idle()
+		self._count("hits" if conn is not None else "misses")
+		if conn is None:
+			conn = pyodbc.connect(self.conn_str)
+
+		try:
+			yield conn
+		except BaseException:
+			_close_quietly(conn)
+			raise
+
+		with self._lock:
+			if len(self._idle) < MAX_IDLE_CONNECTIONS:
+				self._idle.append((conn, time.monotonic()))
+				conn = None
+		if conn is not None:
+			_close_quietly(conn)
+
+	def record_timing(self, label, seconds):
+		milliseconds = round(seconds * 1000, 1)
+		with self._lock:
+			timing = self.query_timings.setdefault(
+				label, {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
+			)
+			timing["count"] += 1
+			timing["total_ms"] = round(timing["total_ms"] + milliseconds, 1)
+			timing["max_ms"] = max(timing["max_ms"], milliseconds)
+			timing["last_ms"] = milliseconds
+
+	def get_stats(self):
+		with self._lock:
+			return {
+				"pool": self.key,
+				"idle": len(self._idle),
+				**self.stats,
+				"query_timings": dict(self.query_timings),
+			}
+
+
+def _close_quietly(conn):
+	try:
+		conn.close()
+	except pyodbc.Error:
+		pass
+
+
+def get_pool(conn_str):
+	"""Returns the pool of this worker process for `conn_str`, created on first use."""
+	key = (os.getpid(), conn_str)
+	with _pools_lock:
+		if key not in _pools:
+			_pools[key] = SQLConnectionPool(conn_str)
+		return _pools[key]
+
+
+def bind_query(sql_query, parameters):
+	"""
+	Turns the {name} placeholders of a settings query into pyodbc `?` markers and returns
+	(sql, params), the values of `parameters` in placeholder order. The SQL text no longer depends
+	on the warehouse, bin or date, so SQL Server reuses one cached plan for every count.
+	Placeholders missing from `parameters` are left untouched.
+	"""
+	if not sql_query:
+		return None
+	params = []
+
+	def to_marker(match):
+		name = match.group(2)
+		if name not in parameters:
+			return match.group(0)
+		params.append(parameters[name])
+		return "?"
+
+	return _PLACEHOLDER.sub(to_marker, sql_query), tuple(params)
+
+
+def read_query(conn_str, label, sql_query, params=()):
+	"""Runs `sql_query` with its bound `params` on a pooled connection and returns the result as a DataFrame."""
+	pool = get_pool(conn_str)
+	start = time.perf_counter()
+	with pool.connection() as conn:
+		df = pd.read_sql_query(sql_query, conn, params=list(params) or None)
+	pool.record_timing(label, time.perf_counter() - start)
+	return df
+
+
+def read_queries_concurrently(conn_str, queries):
+	"""
+	Runs every query of `queries` ({label: (sql, params)}, see `bind_query`) at the same time,
+	each on its own pooled connection, and returns {label: DataFrame}. pyodbc releases the GIL
+	while SQL Server works, so a thread per query is enough.
+	"""
+	queries = {label: query for label, query in queries.items() if query}
+	if len(queries) <= 1:
+		return {label: read_query(conn_str, label, *query) for label, query in queries.items()}
+
+	with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+		futures = {
+			label: executor.submit(read_query, conn_str, label, *query) for label, query in queries.items()
+		}
+		return {label: future.result() for label, future in futures.items()}
+
+
+def get_pool_stats():
+	"""Hit/miss/eviction counters and query timings of every pool of this worker process."""
+	with _pools_lock:
+		pools = [pool for (pid, _conn_str), pool in _pools.items() if pid == os.getpid()]
+	return [pool.get_stats() for pool in pools]
@@ -0,0 +1,135 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+import json
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+from frappe.tests import UnitTestCase
+
+from inv_count.inventory_count import connectwise
+from inv_count.inventory_count.connectwise import get_warehouse_bins, iter_records
+from inv_count.tests.utils import ConnectWiseStandIn, make_bins_route, make_connectwise_client
+
+
+class UnitTestConnectWise(UnitTestCase):
+	"""The shared ConnectWise client and its paged collections, against a local stand-in."""
+
+	def test_connectwise_client_keeps_connection_alive(self):
+		stand_in = ConnectWiseStandIn()
+		self.addCleanup(stand_in.stop)
+		client = make_connectwise_client(stand_in)
+		self.addCleanup(client.close)
+
+		for _call in range(5):
+			client.get("/procurement/warehouses", label="warehouses").raise_for_status()
+		client.post("/procurement/adjustments", label="create_adjustment", data=b"{}").raise_for_status()
+
+		self.assertEqual(len(stand_in.connections), 1)  # One TCP connection for every call
+		self.assertEqual(stand_in.requests[-1], ("POST", "/procurement/adjustments"))
+		stats = client.get_stats()
+		self.assertEqual((stats["requests"], stats["retries"], stats["errors"]), (6, 0, 0))
+		self.assertEqual(stats["call_timings"]["warehouses"]["count"], 5)
+
+	def test_connectwise_client_retries_rate_limits(self):
+		stand_in = ConnectWiseStandIn(
+			[
+				(429, {"Retry-After": "1"}, '{"message": "Too many requests"}'),
+				(200, {}, '[{"id": 2}]'),
+				(429, {}, '{"message": "Too many requests"}'),
+				(201, {}, '{"id": 7}'),
+				(503, {}, '{"message": "Unavailable"}'),
+			]
+		)
+		self.addCleanup(stand_in.stop)
+		client = make_connectwise_client(stand_in)
+		self.addCleanup(client.close)
+
+		with patch("urllib3.util.retry.time") as retry_time:
+			response = client.get("/procurement/warehouses", label="warehouses")
+			self.assertEqual(response.json(), [{"id": 2}])
+			retry_time.sleep.assert_called_once_with(1)  # Waited for Retry-After
+
+			# Refused, so sent again
+			response = client.post("/procurement/adjustments", label="create_adjustment", data=b"{}")
+			self.assertEqual(response.status_code, 201)
+
+			# A 503 does not prove the adjustment was not created: never sent twice
+			response = client.post("/procurement/adjustments", label="create_adjustment", data=b"{}")
+			self.assertEqual(response.status_code, 503)
+		self.assertEqual(len(stand_in.requests), 5)
+		self.assertEqual(client.get_stats()["retries"], 2)
+
+	def test_connectwise_client_caps_retry_after(self):
+		stand_in = ConnectWiseStandIn(
+			[(429, {"Retry-After": "3600"}, '{"message": "Too many requests"}'), (200, {}, "[]")]
+		)
+		self.addCleanup(stand_in.stop)
+		client = make_connectwise_client(stand_in)
+		self.addCleanup(client.close)
+
+		with patch.object(connectwise, "BACKOFF_MAX", 0.2), patch("urllib3.util.retry.time") as retry_time:
+			response = client.get("/procurement/warehouses", label="warehouses")
+
+		self.assertEqual(response.status_code, 200)
+		retry_time.sleep.assert_called_once_with(0.2)  # Capped, not an hour
+
+	def test_iter_records_follows_link_headers(self):
+		stand_in = None
+
+		def route(method, path):
+			page = int(parse_qs(urlsplit(path).query).get("page", ["1"])[0])
+			links = (
+				[f'<{stand_in.url}/procurement/adjustments/types?pagesize=2&page={page + 1}>; rel="next"']
+				if page < 3
+				else []
+			)
+			links.append(f'<{stand_in.url}/procurement/adjustments/types?pagesize=2&page=3>; rel="last"')
+			return (
+				200,
+				{"Link": ", ".join(links)},
+				json.dumps([{"id": page * 10 + i} for i in range(2 if page < 3 else 1)]),
+			)
+
+		stand_in = ConnectWiseStandIn(route=route)
+		self.addCleanup(stand_in.stop)
+		client = make_connectwise_client(stand_in)
+		self.addCleanup(client.close)
+
+		records = iter_records(client, "/procurement/adjustments/types", "adjustment_types", page_size=2)
+		self.assertEqual(next(records), {"id": 10})
+		self.assertEqual(len(stand_in.requests), 1)  # Lazy: the next page is not read yet
+		self.assertEqual([record["id"] for record in records], [11, 20, 21, 30])
+		self.assertEqual(len(stand_in.requests), 3)  # No request after the page without a 'next' link
+
+	def test_iter_records_numbers_pages_without_link_headers(self):
+		stand_in = ConnectWiseStandIn(route=make_bins_route(3, 5))
+		self.addCleanup(stand_in.stop)
+		client = make_connectwise_client(stand_in)
+		self.addCleanup(client.close)
+		client.page_size = 4
+
+		records = list(
+			iter_records(
+				client, "/procurement/warehouseBins", "warehouse_bins", conditions="inactiveFlag=false"
+			)
+		)
+
+		self.assertEqual(len(records), 15)
+		self.assertEqual(len(stand_in.requests), 4)  # 4 + 4 + 4 + 3: the short page is the last one
+		self.assertIn("pagesize=4", stand_in.requests[0][1])
+
+	def test_warehouse_bins_in_one_query(self):
+		"""The bins of 30 warehouses in one paged query, or one request per warehouse when ConnectWise refuses it."""
+		warehouse_ids = list(range(1, 31))
+		for refuse_unfiltered, requests in [(False, 2), (True, 31)]:
+			stand_in = ConnectWiseStandIn(route=make_bins_route(30, 40, refuse_unfiltered))
+			self.addCleanup(stand_in.stop)
+			client = make_connectwise_client(stand_in)
+			self.addCleanup(client.close)
+
+			bins = get_warehouse_bins(client, warehouse_ids)
+
+			self.assertEqual(len(stand_in.requests), requests)
+			self.assertEqual(sorted(bins), warehouse_ids)
+			self.assertEqual([bin_record["id"] for bin_record in bins[7]], [700 + i for i in range(40)])
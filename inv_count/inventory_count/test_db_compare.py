@@ -0,0 +1,135 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+import frappe
+import pandas as pd
+from frappe.tests import IntegrationTestCase
+
+from inv_count.inventory_count.db_compare import compare_in_database
+from inv_count.inventory_count.difference_engine import REMOVE_ADD, plan_differences
+from inv_count.inventory_count.doctype.inventory_count import inventory_count as inventory_count_module
+from inv_count.inventory_count.doctype.inventory_count.inventory_count import (
+	apply_difference_plan,
+	get_difference_delta,
+)
+from inv_count.inventory_count.virtual_import import insert_serial_numbers
+from inv_count.tests.utils import get_difference_values, make_inventory_count
+
+
+class IntegrationTestDBCompare(IntegrationTestCase):
+	"""The database-side compare, checked against the Python engine."""
+
+	def test_compare_modes_agree_on_duplicate_codes(self):
+		"""A code listed on several virtual rows counts its last row in both engines: same difference rows."""
+		inventory_count = make_inventory_count(
+			"Compare modes",
+			inv_physical_items=[
+				{"code": "A", "qty": 3},
+				{"code": "B", "qty": 2},
+				{"code": "P", "qty": 1, "description": "Physical only"},
+			],
+			inv_virtual_items=[
+				{"item_id": "A", "qty": 2, "iv_item_recid": "11"},
+				{"item_id": "a ", "qty": 3, "iv_item_recid": "12"},  # Last row of A: matches
+				{"item_id": "B", "qty": 2, "iv_item_recid": "21"},
+				{"item_id": "B", "qty": 5, "iv_item_recid": "", "shortdescription": "Item B"},
+				{"item_id": "V", "qty": 1, "iv_item_recid": "31", "shortdescription": "Virtual only"},
+			],
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+
+		compare_in_database(inventory_count.name)
+		database_rows = get_difference_values(inventory_count.name)
+
+		frappe.db.delete("Inv_difference", {"parent": inventory_count.name})
+		doc = frappe.get_doc("Inventory Count", inventory_count.name)
+		plan = plan_differences(doc.get("inv_physical_items"), doc.get("inv_virtual_items"), [])
+		apply_difference_plan(doc, plan)
+		doc.save()
+		python_rows = get_difference_values(inventory_count.name)
+
+		self.assertEqual(database_rows, python_rows)
+		self.assertEqual(
+			[(row[0], row[2], row[3], row[5]) for row in python_rows],
+			[("B", 2, 5, 0), ("P", 1, 0, 0), ("V", 0, 1, 31)],
+		)
+
+	def test_resolved_difference_drops_its_serial_numbers(self):
+		"""A 'Remove/Add' serial row goes with its difference once the scans make the quantities match."""
+		inventory_count = make_inventory_count(
+			"Resolved serial difference",
+			inv_physical_items=[{"code": "S", "qty": 1}],
+			inv_virtual_items=[{"item_id": "S", "qty": 2, "iv_item_recid": "41"}],
+			inv_difference_sn=[
+				{"product": "S", "serial_number": "SN-1", "to_do": REMOVE_ADD},
+				{"product": "T", "serial_number": "SN-9", "to_do": REMOVE_ADD},
+			],
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+
+		compare_in_database(inventory_count.name, ["S"])
+		self.assertEqual(
+			frappe.db.count("Inv_difference_sn", {"parent": inventory_count.name, "product": "S"}), 1
+		)
+
+		frappe.db.set_value("Inv_physical_items", inventory_count.inv_physical_items[0].name, "qty", 2)
+		compare_in_database(inventory_count.name, ["S"])
+
+		self.assertFalse(
+			frappe.db.exists("Inv_difference", {"parent": inventory_count.name, "item_code": "S"})
+		)
+		products = frappe.get_all(
+			"Inv_difference_sn", filters={"parent": inventory_count.name}, pluck="product"
+		)
+		self.assertEqual(products, ["T"])  # Not recomputed by this call
+
+	def test_compare_keeps_unchanged_serial_rows(self):
+		"""A compare leaves the serial rows it still expects as they are (same name and idx), in both engines."""
+		inventory_count = make_inventory_count(
+			"Serial rows kept",
+			inv_physical_items=[{"code": "S", "qty": 1}, {"code": "T", "qty": 1}],
+			inv_virtual_items=[
+				{"item_id": "S", "qty": 2, "iv_item_recid": "41"},
+				{"item_id": "T", "qty": 3, "iv_item_recid": "42"},
+			],
+		)
+		self.addCleanup(frappe.delete_doc, "Inventory Count", inventory_count.name, force=True)
+		insert_serial_numbers(
+			inventory_count.name,
+			pd.DataFrame({"item_id": ["S", "S", "T"], "serial_number": ["SN-1", "SN-2", "SN-3"]}),
+		)
+
+		def get_serial_rows():
+			return {
+				row.name: (row.product, row.serial_number, row.idx)
+				for row in frappe.get_all(
+					"Inv_difference_sn",
+					filters={"parent": inventory_count.name},
+					fields=["name", "product", "serial_number", "idx"],
+				)
+			}
+
+		compare_in_database(inventory_count.name)
+		rows = get_serial_rows()
+		self.assertEqual(len(rows), 3)
+		compare_in_database(inventory_count.name)
+		self.assertEqual(get_serial_rows(), rows)
+
+		# T resolved: only its serial row goes
+		frappe.db.set_value("Inv_physical_items", {"parent": inventory_count.name, "code": "T"}, "qty", 3)
+		compare_in_database(inventory_count.name)
+		rows_of_s = {name: row for name, row in rows.items() if row[0] == "S"}
+		self.assertEqual(get_serial_rows(), rows_of_s)
+
+		doc = frappe.get_doc("Inventory Count", inventory_count.name)
+		rows_before = inventory_count_module.get_difference_rows(inventory_count.name)
+		plan = plan_differences(
+			doc.get("inv_physical_items"), doc.get("inv_virtual_items"), doc.get("inv_difference")
+		)
+		apply_difference_plan(doc, plan)
+		doc.save()
+		self.assertEqual(get_serial_rows(), rows_of_s)
+		delta = get_difference_delta(
+			rows_before, inventory_count_module.get_difference_rows(inventory_count.name)
+		)
+		self.assertEqual(delta["inv_difference_sn"], {"added": [], "updated": [], "removed": []})
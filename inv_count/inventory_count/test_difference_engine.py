@@ -0,0 +1,54 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+from frappe.tests import UnitTestCase
+
+from inv_count.inventory_count.difference_engine import (
+	PHYSICAL_ONLY,
+	QUANTITY_DIFFERENT,
+	VIRTUAL_ONLY,
+	filter_category_scope,
+	index_categories,
+	plan_differences,
+)
+from inv_count.tests.utils import make_compare_rows
+
+
+class UnitTestDifferenceEngine(UnitTestCase):
+	"""Difference plans of the indexed compare."""
+
+	def test_difference_plan(self):
+		physical, virtual, differences = make_compare_rows(40)
+		differences.append({"item_code": "ITEM-3", "confirmed": 0})  # No longer a difference
+
+		plan = plan_differences(physical, virtual, differences)
+
+		self.assertEqual(plan["counts"][QUANTITY_DIFFERENT], 4)
+		self.assertEqual(plan["counts"][PHYSICAL_ONLY], 2)
+		self.assertEqual(plan["counts"][VIRTUAL_ONLY], 2)
+		self.assertEqual(len(plan["updates"]), 4)  # Existing rows, 'confirmed' untouched
+		self.assertEqual(
+			[values["item_code"] for values in plan["inserts"]], ["ITEM-2", "ITEM-22", "ITEM-1", "ITEM-21"]
+		)
+		self.assertEqual([row["item_code"] for row in plan["removals"]], ["ITEM-3"])
+
+	def test_category_scope_filters_both_sides(self):
+		physical, virtual, differences = make_compare_rows(40)
+		for row in virtual:
+			odd = int(row["item_id"].split("-")[1]) % 2
+			row["category"], row["subcatname"] = ("Cables", "USB") if odd else ("Laptops", "")
+		category_index = index_categories(virtual)
+		physical.append({"code": "UNKNOWN-1", "qty": 1, "description": "Not in ConnectWise"})
+
+		plan = plan_differences(
+			filter_category_scope(physical, "code", category_index, "Cables", "USB"),
+			filter_category_scope(virtual, "item_id", category_index, "Cables", "USB"),
+			[],
+		)
+
+		# The quantity differences of the Laptops are out of scope, codes unknown to the snapshot are kept
+		self.assertEqual(
+			[code for code, _values in plan["differences"]],
+			["ITEM-2", "ITEM-22", "UNKNOWN-1", "ITEM-1", "ITEM-21"],
+		)
+		self.assertIs(filter_category_scope(physical, "code", category_index), physical)
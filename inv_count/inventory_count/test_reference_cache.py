@@ -0,0 +1,50 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+import time
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from inv_count.inventory_count import reference_cache
+
+reference_fetches = []
+
+
+def fetch_reference_stand_in():
+	"""Reference data fetcher of the cache tests: returns the number of fetches so far."""
+	reference_fetches.append(time.time())
+	return {"fetch": len(reference_fetches)}
+
+
+class IntegrationTestReferenceCache(IntegrationTestCase):
+	"""The stale-while-revalidate cache of the ConnectWise reference data."""
+
+	def test_reference_cache_serves_stale_data(self):
+		"""A stale entry is served at once and refreshed in the background, saving the settings clears it."""
+		fetcher = {"stand_in": "inv_count.inventory_count.test_reference_cache.fetch_reference_stand_in"}
+		with (
+			patch.dict(reference_cache.REFERENCE_FETCHERS, fetcher),
+			patch.object(reference_cache, "get_cache_ttl", return_value=60),
+		):
+			reference_cache.clear_reference_cache()
+			reference_fetches.clear()
+
+			# Miss: fetched now
+			self.assertEqual(reference_cache.get_reference_data("stand_in"), ({"fetch": 1}, 0))
+			self.assertEqual(reference_cache.get_reference_data("stand_in")[0], {"fetch": 1})
+			self.assertEqual(len(reference_fetches), 1)
+
+			key = f"{reference_cache.REFERENCE_CACHE_KEY_PREFIX}stand_in"
+			frappe.cache.set_value(key, {"data": {"fetch": 1}, "fetched_at": time.time() - 120})
+			with patch("frappe.enqueue") as enqueue:
+				data, cache_age = reference_cache.get_reference_data("stand_in")
+			self.assertEqual(data, {"fetch": 1})  # Stale, still served
+			self.assertGreaterEqual(cache_age, 120)
+			self.assertEqual(enqueue.call_args.kwargs["name"], "stand_in")
+			self.assertEqual(len(reference_fetches), 1)
+
+			# Settings saved: cache cleared
+			frappe.get_single("Inventory Count Settings").run_method("on_update")
+			self.assertEqual(reference_cache.get_reference_data("stand_in"), ({"fetch": 2}, 0))
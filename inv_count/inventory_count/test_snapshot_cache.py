@@ -0,0 +1,40 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+import time
+
+import frappe
+import pandas as pd
+from frappe.tests import IntegrationTestCase
+
+from inv_count.inventory_count.snapshot_cache import (
+	clear_cached_snapshots,
+	get_cached_snapshot,
+	set_cached_snapshot,
+	snapshot_cache_key,
+)
+
+
+class IntegrationTestSnapshotCache(IntegrationTestCase):
+	"""The shared cache of the SQL snapshots."""
+
+	def test_snapshot_cache(self):
+		"""Miss, hit, TTL and invalidation of a cached snapshot, keyed on its server and database too."""
+		df = pd.DataFrame({"Item_ID": ["A", "B"], "QOH": [2, 3]})
+		df_item_list = pd.DataFrame({"Item_ID": ["C"]})
+		query = ("SELECT * FROM IV WHERE Warehouse = ?", (2,))
+		cache_key = snapshot_cache_key("sql01,1433/cw", 2, 33, '"2025-04-22"', query)
+		self.assertNotEqual(cache_key, snapshot_cache_key("sql02,1433/cw", 2, 33, '"2025-04-22"', query))
+		self.addCleanup(clear_cached_snapshots, cache_key)
+
+		self.assertIsNone(get_cached_snapshot(cache_key))
+
+		set_cached_snapshot(cache_key, df, df_item_list, 60)
+		cached_df, cached_item_list = get_cached_snapshot(cache_key)
+		pd.testing.assert_frame_equal(cached_df, df)
+		pd.testing.assert_frame_equal(cached_item_list, df_item_list)
+		self.assertTrue(0 < frappe.cache.ttl(frappe.cache.make_key(cache_key)) <= 60)
+
+		set_cached_snapshot(cache_key, df, df_item_list, 1)
+		time.sleep(1.5)
+		self.assertIsNone(get_cached_snapshot(cache_key))  # Expired
@@ -0,0 +1,74 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+from unittest.mock import MagicMock, patch
+
+import pyodbc
+from frappe.tests import UnitTestCase
+
+from inv_count.inventory_count import sql_pool
+from inv_count.inventory_count.sql_pool import SQLConnectionPool, bind_query
+
+
+class UnitTestSQLPool(UnitTestCase):
+	"""Query binding and the pooled ODBC connections."""
+
+	def test_bind_query_uses_parameter_markers(self):
+		sql, params = bind_query(
+			'EXEC report {warehouse_id}, {warehouse_bin_id}, "{valuation_date}" '
+			"WHERE ({category} IS NULL OR Category = '{category}')",
+			{"warehouse_id": 2, "warehouse_bin_id": 33, "valuation_date": "2025-04-22", "category": None},
+		)
+
+		self.assertEqual(sql, "EXEC report ?, ?, ? WHERE (? IS NULL OR Category = ?)")
+		self.assertEqual(params, (2, 33, "2025-04-22", None, None))
+
+	def test_sql_pool_reuses_checks_and_evicts_connections(self):
+		"""Idle connections are reused, checked with SELECT 1 after HEALTH_CHECK_AFTER and closed after IDLE_TIMEOUT."""
+		clock = [1000.0]
+		pool = SQLConnectionPool("DSN=stand-in;PWD=secret")
+		with (
+			patch.object(sql_pool.pyodbc, "connect", side_effect=lambda conn_str: MagicMock()) as connect,
+			patch.object(sql_pool, "time", MagicMock(monotonic=lambda: clock[0])),
+		):
+			with pool.connection() as first:
+				pass
+			with pool.connection() as conn:
+				self.assertIs(conn, first)
+			first.cursor.assert_not_called()  # Idle for less than HEALTH_CHECK_AFTER: reused as is
+
+			clock[0] += sql_pool.HEALTH_CHECK_AFTER + 1
+			with pool.connection() as conn:
+				self.assertIs(conn, first)
+			first.cursor.return_value.execute.assert_called_once_with("SELECT 1")
+
+			clock[0] += sql_pool.HEALTH_CHECK_AFTER + 1
+			first.cursor.return_value.execute.side_effect = pyodbc.Error("Communication link failure")
+			with pool.connection() as second:
+				self.assertIsNot(second, first)
+			first.close.assert_called_once()
+
+			with self.assertRaises(ValueError), pool.connection() as conn:
+				raise ValueError("Query failed")  # Unknown state: closed, not pooled
+			self.assertIs(conn, second)
+			second.close.assert_called_once()
+
+			with pool.connection() as third:
+				pass
+			clock[0] += sql_pool.IDLE_TIMEOUT + 1
+			pool.evict_idle()
+			third.close.assert_called_once()
+
+		self.assertEqual(connect.call_count, 3)
+		stats = pool.get_stats()
+		self.assertEqual(
+			(
+				stats["hits"],
+				stats["misses"],
+				stats["evictions"],
+				stats["failed_health_checks"],
+				stats["idle"],
+			),
+			(3, 3, 1, 1, 0),
+		)
+		self.assertNotIn("secret", str(stats))
@@ -0,0 +1,128 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+import os
+import shutil
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+from frappe.tests import UnitTestCase
+
+from inv_count.inventory_count import virtual_import
+from inv_count.inventory_count.virtual_import import (
+	apply_item_list,
+	iter_sql_chunks,
+	map_virtual_items_frame,
+	parse_serial_numbers,
+	read_snapshot_csv,
+)
+from inv_count.tests.utils import make_snapshot_frame, map_rows_with_iterrows
+
+
+class UnitTestVirtualImport(UnitTestCase):
+	"""Mapping, merge and parsing of the ConnectWise snapshot."""
+
+	def test_vectorized_mapping_matches_row_mapping(self):
+		df = make_snapshot_frame(500)
+		qty_type = "QOH+PickedNotShipped+PickedNotInvoiced"
+
+		mapped = map_virtual_items_frame(df, qty_type)
+		expected = map_rows_with_iterrows(df, qty_type)
+
+		self.assertEqual(mapped["item_id"].tolist(), [row["item_id"] for row in expected])
+		self.assertEqual(mapped["qty"].tolist(), [row["qty"] for row in expected])
+
+	def test_item_list_merge(self):
+		mapped = map_virtual_items_frame(make_snapshot_frame(3), "QOH")
+		item_list = pd.DataFrame(
+			{
+				"IV_Item_RecID": [9, 2],
+				"Item_ID": ["catalog-9", "item-1"],
+				"Description": "From catalog",
+				"catName": "Cat 9",
+				"subCatName": ["Sub 9", "Sub 2"],
+				"Vendor_RecID": 1,
+				"Vendor_Name": "Vendor",
+			}
+		)
+
+		merged = apply_item_list(mapped, item_list)
+
+		self.assertEqual(merged["iv_item_recid"].tolist(), [1, 2, 3, 9])
+		self.assertEqual(merged["subcatname"].tolist(), ["", "Sub 2", "", "Sub 9"])
+		self.assertEqual(merged["item_id"].tolist()[-1], "CATALOG-9")
+		self.assertEqual(merged["qty"].tolist(), [0, 1, 2, 0])
+		self.assertEqual(merged["warehouse_recid"].tolist(), [2, 2, 2, ""])
+
+	def test_serial_numbers_parsed_once(self):
+		df = make_snapshot_frame(4)
+		df["SNList"] = ["SN1, SN2", None, "0", "SN3,,SN3"]
+		df.loc[3, "Item_ID"] = " item-3 "
+
+		pairs = parse_serial_numbers(map_virtual_items_frame(df, "QOH"))
+
+		self.assertEqual(
+			list(pairs.itertuples(index=False, name=None)),
+			[("ITEM-0", "SN1"), ("ITEM-0", "SN2"), ("ITEM-3", "SN3")],
+		)
+
+	def test_sql_chunks_hold_chunk_size_rows(self):
+		"""The SQL result set is fetched and yielded chunk_size rows at a time, with its bound parameters."""
+		rows = [("item-0", 1), ("item-1", 2), ("item-2", 3), ("item-3", 4), ("item-4", 5)]
+		cursor = MagicMock(description=[("Item_ID",), ("QOH",)])
+		cursor.fetchmany.side_effect = [rows[0:2], rows[2:4], rows[4:], []]
+		pool = MagicMock()
+		pool.connection.return_value.__enter__.return_value.cursor.return_value = cursor
+
+		with patch.object(virtual_import, "get_pool", return_value=pool):
+			chunks = list(
+				iter_sql_chunks("DSN=stand-in", "SELECT Item_ID, QOH FROM snapshot WHERE bin=?", 2, (33,))
+			)
+
+		cursor.execute.assert_called_once_with("SELECT Item_ID, QOH FROM snapshot WHERE bin=?", (33,))
+		self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+		self.assertEqual(chunks[2].to_dict("records"), [{"Item_ID": "item-4", "QOH": 5}])
+		self.assertEqual({call.args for call in cursor.fetchmany.call_args_list}, {(2,)})
+		pool.record_timing.assert_called_once()
+
+	def test_snapshot_csv_typed_and_cached(self):
+		"""Only the snapshot columns are read with their dtypes, an unchanged file is parsed once."""
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		csv_path = os.path.join(directory, "snapshot.csv")
+		cache_dir = os.path.join(directory, "cache")
+		make_snapshot_frame(3).assign(P_Warehouse="Magasin").to_csv(csv_path, index=False)
+
+		df = read_snapshot_csv(csv_path, cache_dir=cache_dir)
+		self.assertNotIn("P_Warehouse", df.columns)
+		self.assertEqual(str(df["QOH"].dtype), "Int64")
+		self.assertEqual(df["QOH"].tolist(), [0, 1, 2])
+
+		with patch.object(pd, "read_csv", wraps=pd.read_csv) as read_csv:
+			cached = read_snapshot_csv(csv_path, cache_dir=cache_dir)
+		self.assertEqual(read_csv.call_count, 1)  # The header only
+		pd.testing.assert_frame_equal(cached, df)
+
+		# Decimal quantities do not fit the Int64 dtype: parsed again with inferred dtypes
+		make_snapshot_frame(3).assign(QOH=[0.5, 1, 2]).to_csv(csv_path, index=False)
+		mtime_ns = os.stat(csv_path).st_mtime_ns + 1_000_000_000
+		os.utime(csv_path, ns=(mtime_ns, mtime_ns))
+		df = read_snapshot_csv(csv_path, cache_dir=cache_dir)
+		self.assertEqual(df["QOH"].tolist(), [0.5, 1.0, 2.0])
+		self.assertEqual(len(os.listdir(cache_dir)), 1)  # The parse of the former version was dropped
+
+	def test_snapshot_csv_chunks_fall_back_to_inferred_dtypes(self):
+		"""A chunk that does not fit the declared dtypes is read again with inferred dtypes, no row lost or repeated."""
+		directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, directory)
+		csv_path = os.path.join(directory, "snapshot.csv")
+		snapshot = make_snapshot_frame(5).assign(QOH=[0, 1, 2, 3.5, 4], P_Warehouse="Magasin")
+		snapshot.to_csv(csv_path, index=False)
+
+		chunks = list(read_snapshot_csv(csv_path, chunksize=2))
+		self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+		self.assertEqual(str(chunks[0]["QOH"].dtype), "Int64")
+		self.assertNotIn("P_Warehouse", chunks[1].columns)
+		self.assertEqual(pd.concat(chunks)["QOH"].tolist(), [0, 1, 2, 3.5, 4])
+		self.assertEqual(pd.concat(chunks)["Item_ID"].tolist(), snapshot["Item_ID"].tolist())
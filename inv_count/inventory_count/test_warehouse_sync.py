@@ -0,0 +1,114 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+import json
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+
+from inv_count.inventory_count import warehouse_sync
+from inv_count.inventory_count.warehouse_sync import deactivate_missing, last_updated
+from inv_count.tests.utils import ConnectWiseStandIn, make_connectwise_client, make_cw_warehouse_and_bin
+
+
+def make_sync_route(full, updated):
+	"""
+	`route` of a stand-in serving the warehouses and bins of ConnectWise: the `full` records, or the
+	`updated` ones for a `lastUpdated` condition, as {"warehouses": [...], "warehouseBins": [...]}.
+	"""
+
+	def route(method, path):
+		url = urlsplit(path)
+		conditions = parse_qs(url.query).get("conditions", [""])[0]
+		records = updated if "lastUpdated" in conditions else full
+		return 200, {}, json.dumps(records[url.path.rsplit("/", 1)[-1]])
+
+	return route
+
+
+def cw_record(record_id, name, last_updated, warehouse_id=None):
+	record = {"id": record_id, "name": name, "_info": {"lastUpdated": last_updated}}
+	if warehouse_id:
+		record["warehouse"] = {"id": warehouse_id}
+	return record
+
+
+class UnitTestWarehouseSync(UnitTestCase):
+	"""Parsing of the ConnectWise warehouse records."""
+
+	def test_warehouse_sync_last_updated(self):
+		self.assertEqual(
+			last_updated({"_info": {"lastUpdated": "2025-04-22T13:05:00Z"}}), "2025-04-22 13:05:00"
+		)
+		self.assertIsNone(last_updated({"id": 2, "name": "Magasin"}))
+
+
+class IntegrationTestWarehouseSync(IntegrationTestCase):
+	"""Full and incremental sync of the local warehouse and bin mirror."""
+
+	def test_warehouse_sync(self):
+		"""Full sync upserts and flags the missing records inactive, the incremental one reads the updated records only."""
+		make_cw_warehouse_and_bin()
+		frappe.get_doc({"doctype": "CW Warehouse", "warehouse_name": "Fermé", "cw_id": 9002}).insert()
+		full = {
+			"warehouses": [
+				cw_record(2, "Magasin", "2025-04-01T10:00:00Z"),
+				cw_record(9001, "Entrepôt test", "2025-04-02T10:00:00Z"),
+			],
+			"warehouseBins": [
+				cw_record(33, "Bureaux", "2025-04-01T10:00:00Z", 2),
+				cw_record(900101, "Allée 1", "2025-04-02T10:00:00Z", 9001),
+			],
+		}
+		updated = {
+			"warehouses": [cw_record(9001, "Entrepôt renommé", "2025-05-01T08:30:00Z")],
+			"warehouseBins": [],
+		}
+		stand_in = ConnectWiseStandIn(route=make_sync_route(full, updated))
+		self.addCleanup(stand_in.stop)
+		client = make_connectwise_client(stand_in)
+		self.addCleanup(client.close)
+
+		with (
+			patch.object(warehouse_sync, "has_credentials", return_value=True),
+			patch.object(warehouse_sync, "get_client", return_value=client),
+			patch.object(frappe.db, "commit"),
+		):
+			full_counts = warehouse_sync.sync_connectwise_warehouses(full=True)
+			incremental_counts = warehouse_sync.sync_connectwise_warehouses()
+
+		self.assertEqual(full_counts, {"warehouses": 2, "bins": 2, "deactivated": 1})
+		self.assertEqual(incremental_counts, {"warehouses": 1, "bins": 0, "deactivated": 0})
+		incremental_requests = [path for _method, path in stand_in.requests[-2:]]
+		self.assertTrue(all("lastUpdated" in path for path in incremental_requests))
+
+		# Renamed in ConnectWise: the name linked by the counts is kept
+		warehouse = frappe.db.get_value(
+			"CW Warehouse",
+			{"cw_id": 9001},
+			["name", "warehouse_name", "last_updated", "inactive"],
+			as_dict=True,
+		)
+		self.assertEqual(
+			(warehouse.name, warehouse.warehouse_name, str(warehouse.last_updated), warehouse.inactive),
+			("Entrepôt test (9001)", "Entrepôt renommé", "2025-05-01 08:30:00", 0),
+		)
+		bin_row = frappe.db.get_value(
+			"CW Warehouse Bin", {"cw_id": 900101}, ["name", "warehouse", "cw_warehouse_id"]
+		)
+		self.assertEqual(bin_row, ("Allée 1 (900101)", "Entrepôt test (9001)", 9001))
+		self.assertEqual(frappe.db.get_value("CW Warehouse", {"cw_id": 9002}, "inactive"), 1)
+		self.assertEqual(frappe.db.get_value("CW Warehouse", "Magasin (2)", "inactive"), 0)
+
+		self.assertEqual(deactivate_missing("CW Warehouse", set()), 0)  # Empty answer: nothing flagged
+		self.assertEqual(frappe.db.count("CW Warehouse", {"inactive": 0, "cw_id": ["in", [2, 9001]]}), 2)
+
+	def test_warehouse_sync_without_credentials(self):
+		with (
+			patch.object(warehouse_sync, "has_credentials", return_value=False),
+			patch.object(warehouse_sync, "get_client") as get_client,
+		):
+			self.assertIsNone(warehouse_sync.sync_connectwise_warehouses())
+		get_client.assert_not_called()
@@ -0,0 +1,745 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Vectorized helpers used by the bulk import mode of `import_data_with_pandas`.
+
+The DataFrame coming from the CSV file or the SQL query is mapped to the
+'Inv_virtual_items' fields column by column, then written to `tabInv_virtual_items`
+with multi-row INSERT statements instead of one child Document per row.
+
+The comma separated 'SNList' of each row is parsed once, at import, into 'Inv_virtual_sn': one row
+per (parent, item_id, serial_number), under a unique index. Compare and push read the serial
+numbers of the items they need from there instead of splitting SNList strings again.
+"""
+
+import glob
+import hashlib
+import os
+import time
+
+import frappe
+import pandas as pd
+from frappe.utils import now
+
+from inv_count.inventory_count.sql_pool import get_pool
+
+virtual_items_doctype = "Inv_virtual_items"
+virtual_items_parentfield = "inv_virtual_items"
+serial_numbers_doctype = "Inv_virtual_sn"
+serial_numbers_parentfield = "inv_virtual_sn"  # No table field on the parent: never loaded with the document
+parent_doctype = "Inventory Count"
+
+# Maps each 'Inv_virtual_items' field to its source column in the snapshot and the default used
+# when the column is missing. Keep the order of the childtable's field_order for readability.
+VIRTUAL_ITEM_COLUMN_MAP = {
+	"location": ("Location", ""),
+	"iv_item_recid": ("IV_Item_RecID", ""),
+	"item_id": ("Item_ID", ""),
+	"shortdescription": ("ShortDescription", ""),
+	"category": ("Category", ""),
+	"vendor_recid": ("Vendor_RecID", ""),
+	"vendor_name": ("Vendor_Name", ""),
+	"warehouse_recid": ("Warehouse_RecID", ""),
+	"warehouse": ("Warehouse", ""),
+	"warehouse_bin_recid": ("Warehouse_Bin_RecID", ""),
+	"bin": ("Bin", ""),
+	"qoh": ("QOH", 0),
+	"lasttransactiondate": ("LastTransactionDate", None),
+	"iv_audit_recid": ("IV_Audit_RecID", ""),
+	"pickednotshipped": ("PickedNotShipped", 0),
+	"pickednotshippedcost": ("PickedNotShippedCost", 0.0),
+	"pickednotinvoiced": ("PickedNotInvoiced", 0),
+	"pickednotinvoicedcost": ("PickedNotInvoicedCost", 0.0),
+	"selectedcost": ("SelectedCost", 0.0),
+	"extendedcost": ("ExtendedCost", 0.0),
+	"snlist": ("SNList", ""),
+}
+
+# Same idea for the item list returned by 'SQL Query #2' (catalog items that may not be in the bin)
+CATALOG_ITEM_COLUMN_MAP = {
+	"iv_item_recid": ("IV_Item_RecID", ""),
+	"item_id": ("Item_ID", ""),
+	"shortdescription": ("Description", ""),
+	"category": ("catName", ""),
+	"vendor_recid": ("Vendor_RecID", ""),
+	"vendor_name": ("Vendor_Name", ""),
+	"subcatname": ("subCatName", ""),
+}
+
+VIRTUAL_ITEM_FIELDS = [*VIRTUAL_ITEM_COLUMN_MAP.keys(), "subcatname", "qty"]
+
+# Explicit dtypes of the snapshot columns read by the fast CSV parser, every other report column
+# (P_* parameters, CurrencyFormatString, ...) is skipped. Nullable Int64 keeps empty cells as NA.
+SNAPSHOT_CSV_DTYPES = {
+	"Location": "object",
+	"IV_Item_RecID": "Int64",
+	"Item_ID": "object",
+	"ShortDescription": "object",
+	"Category": "object",
+	"Vendor_RecID": "Int64",
+	"Vendor_Name": "object",
+	"Warehouse_RecID": "Int64",
+	"Warehouse": "object",
+	"Warehouse_Bin_RecID": "Int64",
+	"Bin": "object",
+	"QOH": "Int64",
+	"LastTransactionDate": "object",
+	"IV_Audit_RecID": "Int64",
+	"PickedNotShipped": "Int64",
+	"PickedNotShippedCost": "float64",
+	"PickedNotInvoiced": "Int64",
+	"PickedNotInvoicedCost": "float64",
+	"SelectedCost": "float64",
+	"ExtendedCost": "float64",
+	"SNList": "object",
+}
+
+
+def _no_progress(stage, **details):
+	pass
+
+
+def _numeric_column(df, column):
+	"""Returns a numeric Series for `column`, or 0 when the column is missing or not a number."""
+	if column not in df.columns:
+		return pd.Series(0, index=df.index)
+	return pd.to_numeric(df[column], errors="coerce").fillna(0)
+
+
+def compute_qty(df, qoh_calculation_type):
+	"""
+	Vectorized version of the per-row qty sum: QOH plus PickedNotShipped and/or
+	PickedNotInvoiced depending on the 'Qty Calculation' setting.
+	"""
+	qty = _numeric_column(df, "QOH")
+	if "PickedNotShipped" in qoh_calculation_type:
+		qty = qty + _numeric_column(df, "PickedNotShipped")
+	if "PickedNotInvoiced" in qoh_calculation_type:
+		qty = qty + _numeric_column(df, "PickedNotInvoiced")
+	return qty
+
+
+def map_virtual_items_frame(df, qoh_calculation_type):
+	"""
+	Maps the snapshot DataFrame (CSV or 'SQL Query') to a DataFrame whose columns are the
+	'Inv_virtual_items' fieldnames. Same rules as the row by row mapping of the standard mode.
+	"""
+	df = df.fillna(0)
+	mapped = pd.DataFrame(index=df.index)
+
+	for fieldname, (column, default) in VIRTUAL_ITEM_COLUMN_MAP.items():
+		mapped[fieldname] = df[column] if column in df.columns else default
+
+	mapped["item_id"] = mapped["item_id"].astype(str).str.upper()
+	mapped["subcatname"] = ""
+	mapped["qty"] = compute_qty(df, qoh_calculation_type)
+
+	return mapped.reset_index(drop=True)
+
+
+def map_catalog_items_frame(df_item_list):
+	"""Maps the 'SQL Query #2' item list to 'Inv_virtual_items' columns with zero quantities."""
+	df_item_list = df_item_list.fillna(0)
+	mapped = pd.DataFrame(index=df_item_list.index)
+
+	for fieldname in VIRTUAL_ITEM_FIELDS:
+		if fieldname in CATALOG_ITEM_COLUMN_MAP:
+			column, default = CATALOG_ITEM_COLUMN_MAP[fieldname]
+			mapped[fieldname] = df_item_list[column] if column in df_item_list.columns else default
+		else:
+			# Not part of the item list: same defaults as an empty snapshot row (qty included)
+			mapped[fieldname] = VIRTUAL_ITEM_COLUMN_MAP.get(fieldname, (None, 0))[1]
+
+	mapped["item_id"] = mapped["item_id"].astype(str).str.upper()
+
+	return mapped.reset_index(drop=True)
+
+
+def prepare_catalog(df_item_list):
+	"""Returns the mapped 'SQL Query #2' item list (one row per IV_Item_RecID), or None when empty."""
+	if df_item_list is None or df_item_list.empty or "IV_Item_RecID" not in df_item_list.columns:
+		return None
+
+	catalog = map_catalog_items_frame(df_item_list[df_item_list["IV_Item_RecID"].notna()])
+	return catalog.drop_duplicates(subset="iv_item_recid", keep="last")
+
+
+def set_subcategories(mapped, catalog):
+	"""Copies the catalog 'subcatname' onto the snapshot rows whose IV_Item_RecID is in the catalog."""
+	subcat_by_recid = catalog.set_index("iv_item_recid")["subcatname"]
+	known = mapped["iv_item_recid"].isin(subcat_by_recid.index)
+	mapped.loc[known, "subcatname"] = mapped.loc[known, "iv_item_recid"].map(subcat_by_recid)
+	return mapped
+
+
+def apply_item_list(mapped, df_item_list):
+	"""
+	Adds the 'SQL Query #2' item list to the mapped snapshot with one outer merge on
+	IV_Item_RecID: known items get their 'subcatname', unknown items come out as zero quantity
+	"catalog only" rows (catalog description, category and vendor, defaults elsewhere).
+	Snapshot rows keep their order and the catalog only rows follow, in item list order.
+	"""
+	catalog = prepare_catalog(df_item_list)
+	if catalog is None:
+		return mapped
+
+	snapshot = mapped.drop(columns="subcatname").assign(_snapshot_row=range(len(mapped)))
+	catalog = catalog.assign(_catalog_row=range(len(catalog)))
+	merged = snapshot.merge(
+		catalog, on="iv_item_recid", how="outer", suffixes=("", "_catalog"), indicator=True
+	)
+
+	catalog_only = merged["_merge"] == "right_only"
+	merged["_order"] = merged["_snapshot_row"].where(~catalog_only, len(mapped) + merged["_catalog_row"])
+	merged = merged.sort_values("_order", kind="stable").reset_index(drop=True)
+	catalog_only = merged["_merge"] == "right_only"
+
+	for fieldname in VIRTUAL_ITEM_FIELDS:
+		if fieldname == "iv_item_recid":
+			continue  # Merge key, already set on every row
+		if fieldname == "subcatname":
+			merged[fieldname] = merged[fieldname].fillna("")
+			continue
+		if fieldname in CATALOG_ITEM_COLUMN_MAP:
+			fill = merged[f"{fieldname}_catalog"]
+		else:
+			fill = VIRTUAL_ITEM_COLUMN_MAP.get(fieldname, (None, 0))[1]
+
+		column = merged[fieldname]
+		integer_column = fieldname in mapped.columns and pd.api.types.is_integer_dtype(
+			mapped[fieldname].dtype
+		)
+		if integer_column:
+			# The NaN of the outer merge turned the snapshot integers into floats
+			column = column.astype("Int64").astype(object)
+		elif fill is None:
+			column = column.astype(object)  # Keeps None (not NaN) on the catalog only rows
+		merged[fieldname] = column.where(~catalog_only, fill)
+		if integer_column:
+			try:
+				merged[fieldname] = merged[fieldname].astype(mapped[fieldname].dtype)
+			except (TypeError, ValueError):
+				pass  # Mixed with the "" default of the catalog only rows, stays an object column
+
+	return merged[VIRTUAL_ITEM_FIELDS]
+
+
+def _to_db_values(frame):
+	"""Converts a mapped frame to a list of plain Python tuples (no numpy scalars, NaN -> None)."""
+	frame = frame.astype(object).where(frame.notna(), None)
+	return list(frame.itertuples(index=False, name=None))
+
+
+def add_row_hashes(mapped):
+	"""Adds a 'row_hash' column (hash of every mapped field) used by the Delta import mode to spot changed rows."""
+	hashes = pd.util.hash_pandas_object(mapped[VIRTUAL_ITEM_FIELDS].astype(str), index=False)
+	mapped["row_hash"] = hashes.map("{:016x}".format)
+	return mapped
+
+
+def bulk_insert_virtual_items(parent_name, mapped, start_idx=1, chunk_size=10_000):
+	"""
+	Writes the mapped rows as 'Inv_virtual_items' children of `parent_name` with multi-row
+	INSERT statements. No child Document is built, so no per-row validation happens.
+	Rows that already carry a `name` and `idx` column (rows rewritten by the Delta mode) keep them.
+
+	Returns the number of inserted rows.
+	"""
+	if mapped.empty:
+		return 0
+
+	timestamp = now()
+	user = frappe.session.user
+	row_count = len(mapped)
+
+	if "row_hash" not in mapped.columns:
+		mapped = add_row_hashes(mapped.copy())
+
+	if "name" in mapped.columns:
+		names = mapped["name"].tolist()
+		idxs = mapped["idx"].tolist()
+	else:
+		names = [frappe.generate_hash(length=10) for _ in range(row_count)]
+		idxs = range(start_idx, start_idx + row_count)
+
+	meta_columns = {
+		"name": names,
+		"parent": parent_name,
+		"parentfield": virtual_items_parentfield,
+		"parenttype": parent_doctype,
+		"idx": idxs,
+		"docstatus": 0,
+		"creation": timestamp,
+		"modified": timestamp,
+		"owner": user,
+		"modified_by": user,
+	}
+	frame = mapped[[*VIRTUAL_ITEM_FIELDS, "row_hash"]].reset_index(drop=True)
+	frame = pd.concat([pd.DataFrame(meta_columns, index=frame.index), frame], axis=1)
+
+	frappe.db.bulk_insert(
+		virtual_items_doctype, list(frame.columns), _to_db_values(frame), chunk_size=chunk_size
+	)
+	return row_count
+
+
+def clear_virtual_items(parent_name):
+	"""Deletes every 'Inv_virtual_items' row of the given Inventory Count in one statement."""
+	frappe.db.delete(
+		virtual_items_doctype,
+		{"parent": parent_name, "parenttype": parent_doctype, "parentfield": virtual_items_parentfield},
+	)
+
+
+def parse_serial_numbers(mapped):
+	"""
+	Unique (item_id, serial_number) pairs of the mapped rows, parsed from their 'snlist' column
+	('0' and empty strings are the import defaults for no serial number). Item IDs are normalized
+	like the compare keys.
+	"""
+	if mapped.empty or "snlist" not in mapped.columns:
+		return pd.DataFrame(columns=["item_id", "serial_number"])
+
+	snlist = mapped["snlist"].fillna("").astype(str)
+	has_serials = ~snlist.str.strip().isin(["", "0"])
+	pairs = pd.DataFrame(
+		{
+			"item_id": mapped.loc[has_serials, "item_id"].astype(str).str.strip().str.upper(),
+			"serial_number": snlist[has_serials].str.split(","),
+		}
+	).explode("serial_number")
+	pairs["serial_number"] = pairs["serial_number"].str.strip()
+	pairs = pairs[(pairs["serial_number"] != "") & (pairs["item_id"] != "")]
+	return pairs.drop_duplicates().reset_index(drop=True)
+
+
+def clear_serial_numbers(parent_name):
+	"""Deletes every 'Inv_virtual_sn' row of the given Inventory Count in one statement."""
+	frappe.db.delete(serial_numbers_doctype, {"parent": parent_name, "parenttype": parent_doctype})
+
+
+def insert_serial_numbers(parent_name, pairs, start_idx=1, chunk_size=10_000):
+	"""Writes (item_id, serial_number) pairs as 'Inv_virtual_sn' rows, pairs already stored are skipped. Returns the pair count."""
+	if pairs.empty:
+		return 0
+
+	timestamp = now()
+	user = frappe.session.user
+	frappe.db.bulk_insert(
+		serial_numbers_doctype,
+		[
+			"name",
+			"parent",
+			"parentfield",
+			"parenttype",
+			"idx",
+			"creation",
+			"modified",
+			"owner",
+			"modified_by",
+			"item_id",
+			"serial_number",
+		],
+		[
+			(
+				frappe.generate_hash(length=10),
+				parent_name,
+				serial_numbers_parentfield,
+				parent_doctype,
+				idx,
+				timestamp,
+				timestamp,
+				user,
+				user,
+				item_id,
+				serial_number,
+			)
+			for idx, (item_id, serial_number) in enumerate(
+				pairs[["item_id", "serial_number"]].itertuples(index=False, name=None), start=start_idx
+			)
+		],
+		ignore_duplicates=True,
+		chunk_size=chunk_size,
+	)
+	return len(pairs)
+
+
+def sync_serial_numbers(parent_name, pairs):
+	"""
+	Brings 'Inv_virtual_sn' of `parent_name` in line with `pairs` with set operations: only the
+	pairs that appeared are inserted and the ones that vanished deleted. Returns (inserted, deleted).
+	"""
+	stored = {
+		(item_id, serial_number): name
+		for name, item_id, serial_number in frappe.db.sql(
+			"SELECT name, item_id, serial_number FROM `tabInv_virtual_sn` WHERE parent=%s AND parenttype=%s",
+			(parent_name, parent_doctype),
+		)
+	}
+	incoming = set(pairs[["item_id", "serial_number"]].itertuples(index=False, name=None))
+
+	to_delete = [name for key, name in stored.items() if key not in incoming]
+	to_insert = pairs[
+		[key not in stored for key in pairs[["item_id", "serial_number"]].itertuples(index=False, name=None)]
+	]
+	if to_delete:
+		frappe.db.delete(serial_numbers_doctype, {"name": ("in", to_delete)})
+	insert_serial_numbers(parent_name, to_insert, start_idx=len(stored) + 1)
+	return len(to_insert), len(to_delete)
+
+
+def get_serial_numbers(parent_name, codes):
+	"""{item code: [serial numbers]} of the given normalized item `codes`, read through the unique (parent, item_id, serial_number) index."""
+	serials = {}
+	if not codes:
+		return serials
+	for item_id, serial_number in frappe.db.sql(
+		"""
+        SELECT item_id, serial_number FROM `tabInv_virtual_sn`
+        WHERE parent=%s AND parenttype=%s AND item_id IN %s
+        ORDER BY idx
+        """,
+		(parent_name, parent_doctype, tuple(codes)),
+	):
+		serials.setdefault(item_id, []).append(serial_number)
+	return serials
+
+
+def _csv_engine(chunked=False):
+	"""
+	The pyarrow CSV engine when pyarrow is installed (multi-threaded parser), pandas' C engine otherwise.
+	Chunked reads always get the C engine: pandas does not support `chunksize` with pyarrow.
+	"""
+	if chunked:
+		return "c"
+	try:
+		import pyarrow
+	except ImportError:
+		return "c"
+	return "pyarrow"
+
+
+def _read_csv_chunks(csv_full_path, encoding, usecols, dtype, chunksize):
+	"""
+	DataFrames of `chunksize` rows with the declared dtypes. From the first chunk that does not match
+	them, the rest of the file is read again with inferred dtypes, as `read_snapshot_csv` does.
+	"""
+	rows_read = 0
+	try:
+		for chunk in pd.read_csv(
+			csv_full_path,
+			encoding=encoding,
+			usecols=usecols,
+			dtype=dtype,
+			chunksize=chunksize,
+			engine=_csv_engine(chunked=True),
+		):
+			rows_read += len(chunk)
+			yield chunk
+		return
+	except (ValueError, TypeError):
+		pass
+
+	# Skip the rows already yielded, the header is kept
+	yield from pd.read_csv(
+		csv_full_path,
+		encoding=encoding,
+		usecols=usecols,
+		skiprows=range(1, rows_read + 1),
+		chunksize=chunksize,
+		engine=_csv_engine(chunked=True),
+	)
+
+
+def read_snapshot_csv(csv_full_path, encoding="iso-8859-1", chunksize=None, cache_dir=None):
+	"""
+	Fast CSV parser: reads only the columns used by the 'Inv_virtual_items' mapping, with explicit dtypes.
+
+	When `cache_dir` is given, the parsed DataFrame is pickled there under a key made of the file path,
+	mtime and size, so re-importing an unchanged file skips parsing. With `chunksize`, an iterator of
+	DataFrames is returned instead (no cache).
+	"""
+	header = pd.read_csv(csv_full_path, encoding=encoding, nrows=0).columns
+	usecols = [column for column in header if column in SNAPSHOT_CSV_DTYPES]
+	dtype = {column: SNAPSHOT_CSV_DTYPES[column] for column in usecols}
+
+	if chunksize:
+		return _read_csv_chunks(csv_full_path, encoding, usecols, dtype, chunksize)
+
+	cache_path = None
+	if cache_dir:
+		stat = os.stat(csv_full_path)
+		path_key = hashlib.sha1(os.path.abspath(csv_full_path).encode("utf-8")).hexdigest()[:16]
+		file_key = hashlib.sha1(f"{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:16]
+		cache_path = os.path.join(cache_dir, f"{path_key}-{file_key}.pkl")
+		if os.path.exists(cache_path):
+			return pd.read_pickle(cache_path)
+
+	try:
+		df = pd.read_csv(csv_full_path, encoding=encoding, usecols=usecols, dtype=dtype, engine=_csv_engine())
+	except (ValueError, TypeError):
+		# A column does not match its declared dtype (e.g. decimal quantities): let pandas infer them
+		df = pd.read_csv(csv_full_path, encoding=encoding, usecols=usecols)
+
+	if cache_path:
+		os.makedirs(cache_dir, exist_ok=True)
+		# Older parses of the same file are stale now
+		for stale_path in glob.glob(os.path.join(cache_dir, f"{path_key}-*.pkl")):
+			os.remove(stale_path)
+		df.to_pickle(cache_path)
+
+	return df
+
+
+def _import_stats(row_count, start):
+	seconds = time.perf_counter() - start
+	return {
+		"rows": row_count,
+		"seconds": round(seconds, 3),
+		"rows_per_second": round(row_count / seconds) if seconds else row_count,
+	}
+
+
+def bulk_import_virtual_items(parent_name, df, df_item_list, qoh_calculation_type, progress=None):
+	"""
+	Bulk import mode: replaces the virtual snapshot of `parent_name` with the mapped content of
+	`df` (plus the optional item list) and touches the parent's `modified` timestamp.
+	`progress(stage, **details)` is called when the map and write stages start.
+
+	Returns a dict with the row count and throughput, the caller is responsible for the commit.
+	"""
+	progress = progress or _no_progress
+	start = time.perf_counter()
+
+	progress("map")
+	mapped = map_virtual_items_frame(df, qoh_calculation_type)
+
+	progress("merge")
+	merge_start = time.perf_counter()
+	mapped = apply_item_list(mapped, df_item_list)
+	merge_seconds = time.perf_counter() - merge_start
+
+	progress("write", rows=len(mapped))
+	clear_virtual_items(parent_name)
+	row_count = bulk_insert_virtual_items(parent_name, mapped)
+	clear_serial_numbers(parent_name)
+	serial_count = insert_serial_numbers(parent_name, parse_serial_numbers(mapped))
+	frappe.db.set_value(parent_doctype, parent_name, "modified", now(), update_modified=False)
+
+	stats = _import_stats(row_count, start)
+	stats["merge_seconds"] = round(merge_seconds, 3)
+	stats["serial_numbers"] = serial_count
+	return stats
+
+
+def iter_sql_chunks(conn_str, sql_query, chunk_size, params=()):
+	"""
+	Runs `sql_query` with its bound `params` on SQL Server and yields the result set as DataFrames of at most
+	`chunk_size` rows (pyodbc `fetchmany`). The pooled connection is released once the generator
+	is exhausted, or closed if the generator is abandoned halfway.
+	"""
+	pool = get_pool(conn_str)
+	start = time.perf_counter()
+	with pool.connection() as conn:
+		cursor = conn.cursor()
+		cursor.execute(sql_query, params)
+		columns = [column[0] for column in cursor.description]
+		while True:
+			rows = cursor.fetchmany(chunk_size)
+			if not rows:
+				break
+			yield pd.DataFrame.from_records([tuple(row) for row in rows], columns=columns)
+		cursor.close()
+	pool.record_timing("snapshot", time.perf_counter() - start)
+
+
+def stream_import_virtual_items(
+	parent_name, chunks, df_item_list, qoh_calculation_type, chunk_size, progress=None
+):
+	"""
+	Streaming import mode: each DataFrame yielded by `chunks` is mapped and flushed to
+	`tabInv_virtual_items` before the next one is read, so only one chunk is held in memory.
+	`progress(stage, **details)` is called once before the first chunk and after every chunk.
+
+	Only the item list (subcategories) and the set of seen IV_Item_RecIDs are kept for the whole
+	run, to append the "catalog only" rows at the end. The caller is responsible for the commit.
+	"""
+	progress = progress or _no_progress
+	start = time.perf_counter()
+
+	catalog = prepare_catalog(df_item_list)
+	seen_recids = set()
+	row_count = 0
+	chunk_count = 0
+
+	serial_count = 0
+
+	progress("map")
+	clear_virtual_items(parent_name)
+	clear_serial_numbers(parent_name)
+
+	for chunk in chunks:
+		mapped = map_virtual_items_frame(chunk, qoh_calculation_type)
+		if catalog is not None:
+			mapped = set_subcategories(mapped, catalog)
+			seen_recids.update(mapped["iv_item_recid"].tolist())
+		row_count += bulk_insert_virtual_items(
+			parent_name, mapped, start_idx=row_count + 1, chunk_size=chunk_size
+		)
+		# A pair already written by a previous chunk is skipped by the unique index
+		serial_count += insert_serial_numbers(
+			parent_name, parse_serial_numbers(mapped), start_idx=serial_count + 1, chunk_size=chunk_size
+		)
+		chunk_count += 1
+		progress("write", rows=row_count, chunks=chunk_count)
+
+	if catalog is not None:
+		catalog_only = catalog[~catalog["iv_item_recid"].isin(seen_recids)]
+		row_count += bulk_insert_virtual_items(
+			parent_name, catalog_only, start_idx=row_count + 1, chunk_size=chunk_size
+		)
+
+	frappe.db.set_value(parent_doctype, parent_name, "modified", now(), update_modified=False)
+
+	stats = _import_stats(row_count, start)
+	stats["chunks"] = chunk_count
+	stats["serial_numbers"] = serial_count
+	return stats
+
+
+def _delta_keys(frame):
+	"""Key of a snapshot row for the Delta mode: IV_Item_RecID + Warehouse_Bin_RecID (+ occurrence number)."""
+	keys = frame["iv_item_recid"].astype(str) + "|" + frame["warehouse_bin_recid"].astype(str)
+	# Same item listed twice for the same bin: number the occurrences so every key stays unique
+	return keys + "|" + keys.groupby(keys).cumcount().astype(str)
+
+
+def get_stored_virtual_items(parent_name):
+	"""Returns name, idx, keys and row_hash of the stored 'Inv_virtual_items' rows as a DataFrame."""
+	columns = ["name", "idx", "iv_item_recid", "warehouse_bin_recid", "row_hash"]
+	rows = frappe.db.sql(
+		"""
+        SELECT name, idx, iv_item_recid, warehouse_bin_recid, row_hash
+        FROM `tabInv_virtual_items`
+        WHERE parent=%s AND parenttype=%s AND parentfield=%s
+        ORDER BY idx
+        """,
+		(parent_name, parent_doctype, virtual_items_parentfield),
+	)
+	return pd.DataFrame(list(rows), columns=columns).fillna("")
+
+
+def get_virtual_item_categories(parent_name):
+	"""item_id, category and subcatname of every stored 'Inv_virtual_items' row of `parent_name`."""
+	return frappe.db.sql(
+		"""
+        SELECT item_id, category, subcatname
+        FROM `tabInv_virtual_items`
+        WHERE parent=%s AND parenttype=%s AND parentfield=%s
+        ORDER BY idx
+        """,
+		(parent_name, parent_doctype, virtual_items_parentfield),
+		as_dict=True,
+	)
+
+
+def get_virtual_item_totals(parent_name, category=None, subcategory=None):
+	"""
+	Quantity and valuation totals of the stored snapshot of `parent_name`, optionally limited to a
+	category / subcategory, aggregated by the database (the quantity and cost fields are numeric).
+	"""
+	conditions = ["parent=%(parent)s", "parenttype=%(parenttype)s", "parentfield=%(parentfield)s"]
+	values = {"parent": parent_name, "parenttype": parent_doctype, "parentfield": virtual_items_parentfield}
+	if category:
+		conditions.append("category=%(category)s")
+		values["category"] = category
+	if subcategory:
+		conditions.append("subcatname=%(subcategory)s")
+		values["subcategory"] = subcategory
+
+	return frappe.db.sql(
+		f"""
+        SELECT
+            COUNT(*) AS `rows`,
+            COUNT(DISTINCT UPPER(item_id)) AS items,
+            COALESCE(SUM(qoh), 0) AS qoh,
+            COALESCE(SUM(qty), 0) AS qty,
+            COALESCE(SUM(pickednotshipped), 0) AS pickednotshipped,
+            COALESCE(SUM(pickednotinvoiced), 0) AS pickednotinvoiced,
+            COALESCE(SUM(extendedcost), 0) AS extendedcost,
+            COALESCE(SUM(qty * selectedcost), 0) AS valuation
+        FROM `tabInv_virtual_items`
+        WHERE {" AND ".join(conditions)}
+        """,
+		values,
+		as_dict=True,
+	)[0]
+
+
+def delta_import_virtual_items(
+	parent_name, df, df_item_list, qoh_calculation_type, progress=None, chunk_size=10_000
+):
+	"""
+	Delta import mode: compares the incoming snapshot with the stored rows, keyed on
+	IV_Item_RecID + Warehouse_Bin_RecID, using the per-row content hash ('row_hash').
+	Only new rows are inserted, changed rows rewritten (same name and idx) and vanished rows deleted,
+	so re-importing an unchanged bin does no write at all.
+
+	Returns a dict with the inserted/updated/deleted/unchanged counts, the caller is responsible for the commit.
+	"""
+	progress = progress or _no_progress
+	start = time.perf_counter()
+
+	progress("map")
+	mapped = map_virtual_items_frame(df, qoh_calculation_type)
+
+	progress("merge")
+	merge_start = time.perf_counter()
+	mapped = apply_item_list(mapped, df_item_list)
+	merge_seconds = time.perf_counter() - merge_start
+
+	mapped = add_row_hashes(mapped)
+	mapped["delta_key"] = _delta_keys(mapped)
+
+	stored = get_stored_virtual_items(parent_name)
+	stored["delta_key"] = _delta_keys(stored)
+	stored_by_key = stored.set_index("delta_key")
+
+	exists = mapped["delta_key"].isin(stored_by_key.index)
+	stored_hash = mapped["delta_key"].map(stored_by_key["row_hash"])
+
+	to_insert = mapped[~exists]
+	to_update = mapped[exists & (mapped["row_hash"] != stored_hash)].copy()
+	to_update["name"] = to_update["delta_key"].map(stored_by_key["name"])
+	to_update["idx"] = to_update["delta_key"].map(stored_by_key["idx"])
+	to_delete = stored.loc[~stored["delta_key"].isin(mapped["delta_key"]), "name"].tolist()
+
+	progress("write", rows=len(to_insert) + len(to_update) + len(to_delete))
+
+	# Changed rows are deleted then written back under their existing name and idx
+	names_to_delete = to_delete + to_update["name"].tolist()
+	if names_to_delete:
+		frappe.db.delete(virtual_items_doctype, {"name": ("in", names_to_delete)})
+
+	bulk_insert_virtual_items(parent_name, to_update, chunk_size=chunk_size)
+	next_idx = int(stored["idx"].max()) + 1 if not stored.empty else 1
+	bulk_insert_virtual_items(parent_name, to_insert, start_idx=next_idx, chunk_size=chunk_size)
+	serials_inserted, serials_deleted = sync_serial_numbers(parent_name, parse_serial_numbers(mapped))
+
+	if len(to_insert) or len(to_update) or to_delete:
+		frappe.db.set_value(parent_doctype, parent_name, "modified", now(), update_modified=False)
+
+	stats = _import_stats(len(mapped), start)
+	stats.update(
+		{
+			"inserted": len(to_insert),
+			"updated": len(to_update),
+			"deleted": len(to_delete),
+			"unchanged": len(mapped) - len(to_insert) - len(to_update),
+			"merge_seconds": round(merge_seconds, 3),
+			"serial_numbers_inserted": serials_inserted,
+			"serial_numbers_deleted": serials_deleted,
+		}
+	)
+	return stats
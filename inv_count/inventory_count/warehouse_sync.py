@@ -0,0 +1,216 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Local mirror of the ConnectWise warehouses and bins ('CW Warehouse', 'CW Warehouse Bin').
+
+The Inventory Count form links to these doctypes, so its dropdowns and the ConnectWise ids of a
+count are read from the local database. The hourly job only asks ConnectWise for the records
+updated since the latest one mirrored (`lastUpdated` condition) and upserts them on their unique
+ConnectWise id. The daily job reads every active record and flags the others inactive, which
+covers records deleted in ConnectWise. A record renamed in ConnectWise keeps its name here, so the
+counts linking to it stay valid.
+"""
+
+import time
+
+import frappe
+from frappe.utils import now
+
+from inv_count.inventory_count.connectwise import (
+	get_client,
+	get_warehouse_bins,
+	has_credentials,
+	iter_records,
+)
+from inv_count.inventory_count.db_compare import upsert_rows
+
+LAST_SYNC_KEY = "inv_count:connectwise_warehouse_sync"
+
+WAREHOUSE_FIELDS = [
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"docstatus",
+	"idx",
+	"warehouse_name",
+	"cw_id",
+	"inactive",
+	"last_updated",
+]
+BIN_FIELDS = [
+	"name",
+	"creation",
+	"modified",
+	"owner",
+	"modified_by",
+	"docstatus",
+	"idx",
+	"bin_name",
+	"cw_id",
+	"warehouse",
+	"cw_warehouse_id",
+	"inactive",
+	"last_updated",
+]
+# Refreshed on existing rows, the name (linked by the counts) is kept
+WAREHOUSE_UPDATE_FIELDS = ["warehouse_name", "inactive", "last_updated", "modified", "modified_by"]
+BIN_UPDATE_FIELDS = [
+	"bin_name",
+	"warehouse",
+	"cw_warehouse_id",
+	"inactive",
+	"last_updated",
+	"modified",
+	"modified_by",
+]
+
+
+def last_updated(record):
+	"""`_info.lastUpdated` of a ConnectWise record ('2025-04-22T13:05:00Z') as a datetime string, UTC."""
+	value = (record.get("_info") or {}).get("lastUpdated")
+	return value[:19].replace("T", " ") if value else None
+
+
+def updated_since_condition(doctype):
+	"""ConnectWise condition selecting the records updated since the latest one of `doctype`, None when it is empty."""
+	since = frappe.db.sql(f"SELECT MAX(last_updated) FROM `tab{doctype}`")[0][0]
+	if not since:
+		return None
+	return f"lastUpdated >= [{since:%Y-%m-%dT%H:%M:%SZ}]"  # Same second again: the upsert makes it harmless
+
+
+def upsert_warehouses(records):
+	timestamp = now()
+	user = frappe.session.user
+	rows = [
+		(
+			f"{record['name']} ({record['id']})",
+			timestamp,
+			timestamp,
+			user,
+			user,
+			0,
+			0,
+			record["name"],
+			record["id"],
+			int(bool(record.get("inactiveFlag"))),
+			last_updated(record),
+		)
+		for record in records
+		if isinstance(record, dict) and record.get("id") and record.get("name")
+	]
+	upsert_rows("tabCW Warehouse", WAREHOUSE_FIELDS, WAREHOUSE_UPDATE_FIELDS, rows)
+	return {row[8] for row in rows}
+
+
+def upsert_bins(records):
+	"""Upserts (warehouse id, bin record) pairs, linked to the mirrored warehouse of that id."""
+	warehouse_names = dict(frappe.db.sql("SELECT cw_id, name FROM `tabCW Warehouse`"))
+	timestamp = now()
+	user = frappe.session.user
+	rows = [
+		(
+			f"{record['name']} ({record['id']})",
+			timestamp,
+			timestamp,
+			user,
+			user,
+			0,
+			0,
+			record["name"],
+			record["id"],
+			warehouse_names.get(warehouse_id),
+			warehouse_id,
+			int(bool(record.get("inactiveFlag"))),
+			last_updated(record),
+		)
+		for warehouse_id, record in records
+		if isinstance(record, dict) and record.get("id") and record.get("name")
+	]
+	upsert_rows("tabCW Warehouse Bin", BIN_FIELDS, BIN_UPDATE_FIELDS, rows)
+	return {row[8] for row in rows}
+
+
+def deactivate_missing(doctype, seen_ids):
+	"""Flags inactive the records of `doctype` that ConnectWise no longer lists as active."""
+	if not seen_ids:
+		return 0  # An empty answer is more likely an error than a tenant without any warehouse
+	frappe.db.sql(
+		f"UPDATE `tab{doctype}` SET inactive=1, modified=%s WHERE inactive=0 AND cw_id NOT IN %s",
+		(now(), tuple(seen_ids)),
+	)
+	return int(frappe.db.sql("SELECT ROW_COUNT()")[0][0])
+
+
+def sync_connectwise_warehouses(full=False):
+	"""
+	Brings 'CW Warehouse' and 'CW Warehouse Bin' in line with ConnectWise: only the records updated
+	since the last sync, or every active one (`full`, or an empty mirror). Returns the counts, None
+	when the ConnectWise credentials are not set (site without ConnectWise, the jobs do nothing).
+	"""
+	settings_doc = frappe.get_single("Inventory Count Settings")
+	if not has_credentials(settings_doc):
+		return None
+	client = get_client(settings_doc)
+	counts = {"warehouses": 0, "bins": 0, "deactivated": 0}
+
+	warehouse_condition = None if full else updated_since_condition("CW Warehouse")
+	if warehouse_condition:
+		seen = upsert_warehouses(
+			iter_records(client, "/procurement/warehouses", "warehouses_sync", conditions=warehouse_condition)
+		)
+	else:
+		seen = upsert_warehouses(iter_records(client, "/procurement/warehouses", "warehouses_sync"))
+		counts["deactivated"] += deactivate_missing("CW Warehouse", seen)
+	counts["warehouses"] = len(seen)
+
+	bin_condition = None if full else updated_since_condition("CW Warehouse Bin")
+	if bin_condition:
+		records = iter_records(
+			client, "/procurement/warehouseBins", "warehouse_bins_sync", conditions=bin_condition
+		)
+		seen = upsert_bins(
+			((record.get("warehouse") or {}).get("id"), record)
+			for record in records
+			if isinstance(record, dict)
+		)
+	else:
+		# Every active bin, in one paged query (see `get_warehouse_bins`)
+		active_warehouses = [
+			row[0] for row in frappe.db.sql("SELECT cw_id FROM `tabCW Warehouse` WHERE inactive=0")
+		]
+		bins = get_warehouse_bins(client, active_warehouses)
+		seen = upsert_bins(
+			(warehouse_id, record) for warehouse_id, records in bins.items() for record in records
+		)
+		counts["deactivated"] += deactivate_missing("CW Warehouse Bin", seen)
+	counts["bins"] = len(seen)
+
+	frappe.db.commit()
+	frappe.cache.set_value(LAST_SYNC_KEY, time.time())
+	return counts
+
+
+def enqueue_sync(full=False):
+	"""Runs the sync in a background job, once at a time."""
+	frappe.enqueue(
+		"inv_count.inventory_count.warehouse_sync.sync_connectwise_warehouses",
+		queue="long",
+		job_id="inv_count_connectwise_warehouse_sync",
+		deduplicate=True,
+		full=full,
+	)
+
+
+def full_sync_connectwise_warehouses():
+	"""Daily job: every active record, the others are flagged inactive."""
+	return sync_connectwise_warehouses(full=True)
+
+
+def get_sync_age():
+	"""Seconds since the last sync of this site, None when it never ran (or Redis was flushed)."""
+	last_sync = frappe.cache.get_value(LAST_SYNC_KEY)
+	return int(time.time() - last_sync) if last_sync else None
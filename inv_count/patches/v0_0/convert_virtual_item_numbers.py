@@ -0,0 +1,62 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Prepares 'Inv_virtual_items' for its Int / Currency quantity and cost fields (they were Data).
+
+Runs before the doctype sync: every value is rewritten in place, in one UPDATE, to a clean number
+('' / NULL / text -> '0', '3.0' -> '3', '1,234.50' -> '1234.5', '1e3' -> '1000') so the ALTER TABLE
+done by the sync cannot fail on a value MariaDB refuses to convert in strict mode. The count of
+non-empty values that are not numbers (zeroed) is logged per field.
+"""
+
+import frappe
+
+INTEGER_FIELDS = ("qoh", "qty", "pickednotshipped", "pickednotinvoiced")
+CURRENCY_FIELDS = ("pickednotshippedcost", "pickednotinvoicedcost", "selectedcost", "extendedcost")
+# Optional sign, digits with or without thousands separators, decimals and exponent: '+3', '.5', '1,234.00', '1e3'
+NUMBER_PATTERN = r"^[[:space:]]*[-+]?(([0-9]{1,3}(,[0-9]{3})+|[0-9]+)(\.[0-9]*)?|\.[0-9]+)([eE][-+]?[0-9]{1,2})?[[:space:]]*$"
+
+
+def execute():
+	if not frappe.db.table_exists("Inv_virtual_items"):
+		return
+
+	columns = frappe.db.get_table_columns("Inv_virtual_items")
+	fieldnames = [fieldname for fieldname in INTEGER_FIELDS + CURRENCY_FIELDS if fieldname in columns]
+	if not fieldnames:
+		return
+
+	log_zeroed_values(fieldnames)
+	assignments = [
+		f"`{fieldname}` = {clean_number(f'`{fieldname}`', integer=fieldname in INTEGER_FIELDS)}"
+		for fieldname in fieldnames
+	]
+	frappe.db.sql(f"UPDATE `tabInv_virtual_items` SET {', '.join(assignments)}", {"pattern": NUMBER_PATTERN})
+
+
+def log_zeroed_values(fieldnames):
+	"""Logs how many non-empty values of each field are not numbers, so the conversion turns them to 0."""
+	counts = frappe.db.sql(
+		"SELECT {} FROM `tabInv_virtual_items`".format(
+			", ".join(
+				f"COALESCE(SUM(TRIM(`{fieldname}`) != '' AND `{fieldname}` NOT REGEXP %(pattern)s), 0)"
+				for fieldname in fieldnames
+			)
+		),
+		{"pattern": NUMBER_PATTERN},
+	)[0]
+	zeroed = {fieldname: int(count) for fieldname, count in zip(fieldnames, counts, strict=True) if count}
+	if zeroed:
+		frappe.log_error(
+			f"{sum(zeroed.values())} non-numeric values set to 0: {zeroed}",
+			"Inv_virtual_items number conversion",
+		)
+
+
+def clean_number(column, integer):
+	"""SQL expression of the clean number stored in text `column` (rounded when `integer`), '0' when it is not a number."""
+	number = f"CAST(REPLACE(TRIM({column}), ',', '') AS DECIMAL(21, 9))"
+	if integer:
+		number = f"ROUND({number})"
+	return f"CASE WHEN {column} REGEXP %(pattern)s THEN CAST({number} AS CHAR) ELSE '0' END"
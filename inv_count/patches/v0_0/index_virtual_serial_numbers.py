@@ -0,0 +1,34 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Fills 'Inv_virtual_sn' for the counts imported before it existed: the SNList of their virtual items
+is parsed once here, the compare and the push only read the serial table.
+"""
+
+import frappe
+import pandas as pd
+
+from inv_count.inventory_count.virtual_import import (
+	clear_serial_numbers,
+	insert_serial_numbers,
+	parse_serial_numbers,
+)
+
+
+def execute():
+	rows = frappe.db.sql(
+		"""
+        SELECT parent, item_id, snlist FROM `tabInv_virtual_items`
+        WHERE parenttype='Inventory Count' AND parentfield='inv_virtual_items'
+            AND snlist IS NOT NULL AND TRIM(snlist) NOT IN ('', '0')
+        ORDER BY parent, idx
+        """,
+		as_dict=True,
+	)
+	if not rows:
+		return
+
+	for parent_name, items in pd.DataFrame(rows).groupby("parent", sort=False):
+		clear_serial_numbers(parent_name)
+		insert_serial_numbers(parent_name, parse_serial_numbers(items))
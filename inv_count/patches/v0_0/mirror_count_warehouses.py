@@ -0,0 +1,91 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Seeds 'CW Warehouse' and 'CW Warehouse Bin' with the warehouses and bins of the existing counts, so
+their links stay valid before the first sync, and fills the ConnectWise ids of the counts. The
+'Name (id)' strings are parsed once here; `last_updated` is left empty, so the first sync reads
+every record from ConnectWise.
+"""
+
+import re
+
+import frappe
+from frappe.utils import now
+
+from inv_count.inventory_count.warehouse_sync import BIN_FIELDS, WAREHOUSE_FIELDS
+
+NAME_AND_ID = re.compile(r"^(.*) \((\d+)\)$")
+
+
+def execute():
+	pairs = frappe.db.sql(
+		"""
+        SELECT DISTINCT warehouse, warehouse_bin FROM `tabInventory Count`
+        WHERE IFNULL(warehouse, '') != ''
+        """
+	)
+	if not pairs:
+		return
+
+	timestamp = now()
+	warehouses, bins = {}, {}
+	for warehouse, warehouse_bin in pairs:
+		warehouse_match = NAME_AND_ID.match(warehouse)
+		if not warehouse_match:
+			continue
+		warehouse_id = int(warehouse_match.group(2))
+		warehouses[warehouse] = (
+			warehouse,
+			timestamp,
+			timestamp,
+			"Administrator",
+			"Administrator",
+			0,
+			0,
+			warehouse_match.group(1),
+			warehouse_id,
+			0,
+			None,
+		)
+		bin_match = NAME_AND_ID.match(warehouse_bin or "")
+		if bin_match:
+			bins[warehouse_bin] = (
+				warehouse_bin,
+				timestamp,
+				timestamp,
+				"Administrator",
+				"Administrator",
+				0,
+				0,
+				bin_match.group(1),
+				int(bin_match.group(2)),
+				warehouse,
+				warehouse_id,
+				0,
+				None,
+			)
+
+	insert_ignore("tabCW Warehouse", WAREHOUSE_FIELDS, list(warehouses.values()))
+	insert_ignore("tabCW Warehouse Bin", BIN_FIELDS, list(bins.values()))
+
+	frappe.db.sql(
+		"""
+        UPDATE `tabInventory Count` ic
+        LEFT JOIN `tabCW Warehouse` wh ON wh.name = ic.warehouse
+        LEFT JOIN `tabCW Warehouse Bin` bin ON bin.name = ic.warehouse_bin
+        SET ic.warehouse_id = wh.cw_id, ic.warehouse_bin_id = bin.cw_id
+        """
+	)
+
+
+def insert_ignore(table, fields, rows):
+	"""Rows already there (same name or ConnectWise id) are kept."""
+	if not rows:
+		return
+	column_list = ", ".join(f"`{field}`" for field in fields)
+	row_placeholder = "(" + ", ".join(["%s"] * len(fields)) + ")"
+	frappe.db.sql(
+		f"INSERT IGNORE INTO `{table}` ({column_list}) VALUES {', '.join([row_placeholder] * len(rows))}",
+		[value for row in rows for value in row],
+	)
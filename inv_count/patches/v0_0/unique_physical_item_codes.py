@@ -0,0 +1,36 @@
+# Copyright (c) 2025, Microtec and contributors
+# For license information, please see license.txt
+
+"""
+Adds the unique (parent, code) index of 'Inv_physical_items' behind the single statement scan upsert.
+
+Runs before the doctype sync (its `on_doctype_update` adds the same index): rows of the same code in
+a count are merged first, into the first row of the code, with their quantities summed.
+"""
+
+import frappe
+
+
+def execute():
+	if not frappe.db.table_exists("Inv_physical_items"):
+		return
+
+	duplicates = frappe.db.sql(
+		"""
+        SELECT parent, code, SUM(COALESCE(qty, 0)) AS qty, MIN(CONCAT(LPAD(idx, 10, '0'), name)) AS first_row
+        FROM `tabInv_physical_items`
+        WHERE parenttype='Inventory Count' AND parentfield='inv_physical_items'
+        GROUP BY parent, code
+        HAVING COUNT(*) > 1
+        """,
+		as_dict=True,
+	)
+	for row in duplicates:
+		kept_name = row.first_row[10:]
+		frappe.db.sql("UPDATE `tabInv_physical_items` SET qty=%s WHERE name=%s", (row.qty, kept_name))
+		frappe.db.sql(
+			"DELETE FROM `tabInv_physical_items` WHERE parent=%s AND parenttype='Inventory Count' AND parentfield='inv_physical_items' AND code=%s AND name!=%s",
+			(row.parent, row.code, kept_name),
+		)
+
+	frappe.db.add_unique("Inv_physical_items", ["parent", "code"], constraint_name="parent_code")
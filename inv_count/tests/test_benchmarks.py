@@ -0,0 +1,85 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+"""
+Wall-clock comparisons of the import, compare and ConnectWise paths against their former versions.
+They depend on the machine running them, so they are skipped unless INV_COUNT_BENCHMARKS is set:
+
+    INV_COUNT_BENCHMARKS=1 bench --site <site> run-tests --module inv_count.tests.test_benchmarks
+"""
+
+import os
+import time
+import unittest
+
+from frappe.tests import UnitTestCase
+
+from inv_count.inventory_count.connectwise import get_bins_of_warehouse, get_warehouse_bins
+from inv_count.inventory_count.difference_engine import plan_differences
+from inv_count.inventory_count.virtual_import import map_virtual_items_frame
+from inv_count.tests.utils import (
+	ConnectWiseStandIn,
+	make_bins_route,
+	make_compare_rows,
+	make_connectwise_client,
+	make_snapshot_frame,
+	map_rows_with_iterrows,
+)
+
+
+def get_bins_one_by_one(client, warehouse_ids):
+	"""One request per warehouse, one after the other: the former N+1 lookup, kept here as the benchmark baseline."""
+	return {warehouse_id: get_bins_of_warehouse(client, warehouse_id) for warehouse_id in warehouse_ids}
+
+
+@unittest.skipUnless(os.environ.get("INV_COUNT_BENCHMARKS"), "set INV_COUNT_BENCHMARKS=1 to run")
+class BenchmarkInventoryCount(UnitTestCase):
+	"""Benchmarks, out of the default test run."""
+
+	def test_bulk_mapping_benchmark(self):
+		"""The bulk mapping beats the iterrows path on a 50k-row frame."""
+		df = make_snapshot_frame(50_000)
+		qty_type = "QOH+PickedNotInvoiced"
+
+		start = time.perf_counter()
+		map_rows_with_iterrows(df, qty_type)
+		iterrows_seconds = time.perf_counter() - start
+
+		start = time.perf_counter()
+		map_virtual_items_frame(df, qty_type)
+		vectorized_seconds = time.perf_counter() - start
+
+		self.assertLess(vectorized_seconds, iterrows_seconds)
+
+	def test_difference_engine_scales_linearly(self):
+		"""Compare time per item from 1k to 100k items, each run with one existing difference row per ten items."""
+		seconds_per_item = {}
+		for items in (1_000, 10_000, 100_000):
+			physical, virtual, differences = make_compare_rows(items)
+			start = time.perf_counter()
+			plan_differences(physical, virtual, differences)
+			seconds_per_item[items] = (time.perf_counter() - start) / items
+
+		# Quadratic behaviour would make the 100k run ~10x slower per item than the 10k run
+		self.assertLess(seconds_per_item[100_000], seconds_per_item[10_000] * 3)
+
+	def test_warehouse_bins_benchmark(self):
+		"""Wall-clock of the bin lookup of 30 warehouses against a stand-in adding 20 ms per request."""
+		warehouse_ids = list(range(1, 31))
+		timings = {}
+		for label, refuse_unfiltered, lookup in [
+			("N+1", False, get_bins_one_by_one),
+			("single query", False, get_warehouse_bins),
+			("thread pool", True, get_warehouse_bins),
+		]:
+			stand_in = ConnectWiseStandIn(route=make_bins_route(30, 40, refuse_unfiltered), latency=0.02)
+			self.addCleanup(stand_in.stop)
+			client = make_connectwise_client(stand_in)
+			self.addCleanup(client.close)
+
+			start = time.perf_counter()
+			lookup(client, warehouse_ids)
+			timings[label] = time.perf_counter() - start
+
+		self.assertLess(timings["single query"] * 5, timings["N+1"])
+		self.assertLess(timings["thread pool"] * 3, timings["N+1"])
@@ -0,0 +1,206 @@
+# Copyright (c) 2025, Microtec and Contributors
+# See license.txt
+
+"""Fixtures shared by the inv_count tests: synthetic snapshots, a ConnectWise stand-in and test counts."""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import frappe
+import pandas as pd
+from frappe.utils import today
+
+from inv_count.inventory_count.connectwise import ConnectWiseClient
+
+
+def make_snapshot_frame(rows):
+	"""Synthetic ConnectWise snapshot with the same columns as the 'SQL Query' / CSV report."""
+	return pd.DataFrame(
+		{
+			"Location": "Drummondville",
+			"IV_Item_RecID": range(1, rows + 1),
+			"Item_ID": [f"item-{i}" for i in range(rows)],
+			"ShortDescription": "Synthetic item",
+			"Category": [f"Cat {i % 20}" for i in range(rows)],
+			"Vendor_RecID": 29783,
+			"Vendor_Name": "Vendor",
+			"Warehouse_RecID": 2,
+			"Warehouse": "Magasin",
+			"Warehouse_Bin_RecID": 33,
+			"Bin": "Bureaux",
+			"QOH": [i % 7 for i in range(rows)],
+			"LastTransactionDate": "2025-04-22 17:17",
+			"IV_Audit_RecID": range(rows),
+			"PickedNotShipped": [i % 2 for i in range(rows)],
+			"PickedNotShippedCost": 0.0,
+			"PickedNotInvoiced": [i % 3 for i in range(rows)],
+			"PickedNotInvoicedCost": 0.0,
+			"SelectedCost": 10.0,
+			"ExtendedCost": 0.0,
+			"SNList": None,
+		}
+	)
+
+
+def map_rows_with_iterrows(df, qoh_calculation_type):
+	"""Row by row mapping of the former standard import mode: the reference of the vectorized mapping."""
+	rows = []
+	for _index, row in df.fillna(0).iterrows():
+		qty = row.get("QOH", 0)
+		if "PickedNotShipped" in qoh_calculation_type:
+			qty += row.get("PickedNotShipped", 0)
+		if "PickedNotInvoiced" in qoh_calculation_type:
+			qty += row.get("PickedNotInvoiced", 0)
+		rows.append({"item_id": row.get("Item_ID", "").upper(), "qoh": row.get("QOH", 0), "qty": qty})
+	return rows
+
+
+def make_compare_rows(items):
+	"""
+	Physical, virtual and existing difference rows for `items` codes: one code in ten has a
+	quantity difference, one in twenty is physical only, one in twenty virtual only.
+	"""
+	physical, virtual, differences = [], [], []
+	for i in range(items):
+		code = f"ITEM-{i}"
+		if i % 20 != 1:
+			physical.append(
+				{"code": code.lower(), "qty": i % 5 + (1 if i % 10 == 0 else 0), "description": "Scanned"}
+			)
+		if i % 20 != 2:
+			virtual.append({"item_id": code, "qty": i % 5, "shortdescription": "Virtual", "iv_item_recid": i})
+		if i % 10 == 0:
+			differences.append({"item_code": code, "confirmed": 1})
+	return physical, virtual, differences
+
+
+class ConnectWiseStandInHandler(BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"  # Keep-alive, like ConnectWise
+
+	def respond(self):
+		self.rfile.read(int(self.headers.get("Content-Length") or 0))
+		self.server.requests.append((self.command, self.path))
+		self.server.connections.add(self.client_address)
+		time.sleep(self.server.latency)
+		if self.server.responses:
+			status, headers, body = self.server.responses.pop(0)
+		elif self.server.route:
+			status, headers, body = self.server.route(self.command, self.path)
+		else:
+			status, headers, body = 200, {}, "[]"
+		body = body.encode("utf-8")
+		self.send_response(status)
+		for header, value in headers.items():
+			self.send_header(header, value)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	do_GET = do_POST = do_DELETE = respond
+
+	def log_message(self, *args):
+		pass
+
+
+class ConnectWiseStandIn(ThreadingHTTPServer):
+	"""
+	Local stand-in of the ConnectWise API, served from a thread: each request gets the next queued
+	(status, headers, body) response, then the one of `route(method, path)`, 200 '[]' by default,
+	after `latency` seconds. The requests and the client (host, port) of each TCP connection are
+	recorded.
+	"""
+
+	daemon_threads = True
+
+	def __init__(self, responses=(), route=None, latency=0):
+		super().__init__(("127.0.0.1", 0), ConnectWiseStandInHandler)
+		self.responses = list(responses)
+		self.route = route
+		self.latency = latency
+		self.requests = []
+		self.connections = set()
+		self.url = f"http://127.0.0.1:{self.server_port}"
+		threading.Thread(target=self.serve_forever, daemon=True).start()
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+def make_connectwise_client(stand_in):
+	return ConnectWiseClient(stand_in.url, "microtec", "public", "private", "client-id")
+
+
+def make_bins_route(warehouses, bins_per_warehouse, refuse_unfiltered=False):
+	"""`route` of a stand-in serving the active bins of `warehouses` warehouses, paged like ConnectWise."""
+	bins = [
+		{
+			"id": warehouse_id * 100 + i,
+			"name": f"Bin {i}",
+			"warehouse": {"id": warehouse_id, "name": f"Warehouse {warehouse_id}"},
+		}
+		for warehouse_id in range(1, warehouses + 1)
+		for i in range(bins_per_warehouse)
+	]
+
+	def route(method, path):
+		query = parse_qs(urlsplit(path).query)
+		warehouse = re.search(r"warehouse/id=(\d+)", query.get("conditions", [""])[0])
+		if warehouse:
+			records = [
+				bin_record for bin_record in bins if bin_record["warehouse"]["id"] == int(warehouse.group(1))
+			]
+		elif refuse_unfiltered:
+			return 400, {}, '{"message": "Invalid conditions"}'
+		else:
+			records = bins
+		page_size, page = int(query["pagesize"][0]), int(query["page"][0])
+		return 200, {}, json.dumps(records[(page - 1) * page_size : page * page_size])
+
+	return route
+
+
+def make_cw_warehouse_and_bin():
+	"""'Magasin (2)' / 'Bureaux (33)' in the local mirror, as linked by the counts of the integration tests."""
+	if not frappe.db.exists("CW Warehouse", "Magasin (2)"):
+		frappe.get_doc({"doctype": "CW Warehouse", "warehouse_name": "Magasin", "cw_id": 2}).insert(
+			ignore_permissions=True
+		)
+	if not frappe.db.exists("CW Warehouse Bin", "Bureaux (33)"):
+		frappe.get_doc(
+			{
+				"doctype": "CW Warehouse Bin",
+				"bin_name": "Bureaux",
+				"cw_id": 33,
+				"warehouse": "Magasin (2)",
+				"cw_warehouse_id": 2,
+			}
+		).insert(ignore_permissions=True)
+
+
+def make_inventory_count(form_name, **fields):
+	"""Inventory Count of the integration tests, in 'Magasin (2)' / 'Bureaux (33)'."""
+	make_cw_warehouse_and_bin()
+	return frappe.get_doc(
+		{
+			"doctype": "Inventory Count",
+			"form_name": form_name,
+			"location": "Drummondville",
+			"warehouse": "Magasin (2)",
+			"warehouse_bin": "Bureaux (33)",
+			"date": today(),
+			**fields,
+		}
+	).insert()
+
+
+def get_difference_values(parent_name):
+	"""Difference rows of `parent_name` as sorted tuples, to compare the rows written by both compare modes."""
+	fields = ["item_code", "description", "physical_qty", "virtual_qty", "difference_reason", "recid"]
+	rows = frappe.get_all("Inv_difference", filters={"parent": parent_name}, fields=fields)
+	return sorted(tuple(row[field] for field in fields) for row in rows)